@@ -0,0 +1,291 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# local imports
+from robofast import imstats
+
+"""
+Model-based autofocus
+
+Instead of sweeping a fixed grid of focus positions, FocusModel fits the FWHM
+vs. focus position curve after every frame and picks the next position where
+a measurement would shrink the uncertainty in the best focus the most. The
+run stops as soon as the best focus is known to within tolerance.
+
+Two models are supported:
+  hyperbola -- FWHM^2 = a^2 + b^2 (p - c)^2, the shape of a defocused star;
+               fit as a quadratic in FWHM^2, so it's still linear least squares
+  parabola  -- FWHM = A p^2 + B p + C, fine close to focus
+
+Autofocus drives a camera and a focuser. The focuser only needs a function
+move(position) that returns once it's there (e.g.,
+Telescope_DFM.move_focus_and_check, or Irf90Focus.move). The focuser moves to
+the next position while the previous frame is read out and measured, so
+each new position is chosen from the frames before the previous one.
+"""
+
+
+class FocusModel:
+    """
+    model -- 'hyperbola' or 'parabola'
+    fwhm_noise -- typical uncertainty of a FWHM measurement (same units as the FWHMs)
+    """
+
+    models = ('hyperbola', 'parabola')
+
+    def __init__(self, model='hyperbola', fwhm_noise=0.1):
+        if model not in self.models:
+            raise ValueError("Unknown focus model (" + str(model) + "); must be one of " + str(self.models))
+        self.model = model
+        self.fwhm_noise = fwhm_noise
+        self.positions = []
+        self.fwhms = []
+        self.coeffs = None
+        self.covariance = None
+
+    def add(self, position, fwhm):
+        """ add a measurement (a FWHM of nan, e.g. no stars found, is ignored) and refit """
+        if fwhm is None or not np.isfinite(fwhm): return
+        self.positions.append(float(position))
+        self.fwhms.append(float(fwhm))
+        self.fit()
+
+    def _sigma(self, fwhm):
+        """ uncertainty of the fitted quantity for each FWHM """
+        fwhm = np.asarray(fwhm, dtype=np.float64)
+        if self.model == 'hyperbola':
+            return 2.0*np.maximum(fwhm, self.fwhm_noise)*self.fwhm_noise
+        return np.full(fwhm.shape, self.fwhm_noise)
+
+    def _design(self, p):
+        # scaled about the middle of the samples so the fit is well conditioned
+        u = (np.asarray(p, dtype=np.float64) - self._p0)/self._scale
+        return np.stack((u**2, u, np.ones_like(u)), axis=-1)
+
+    def fit(self):
+        """ weighted least squares fit; returns False if there aren't enough points yet """
+        p = np.array(self.positions)
+        if len(np.unique(p)) < 3:
+            self.coeffs = None
+            return False
+        self._p0 = p.mean()
+        self._scale = max(np.ptp(p)/2.0, 1e-9)
+
+        f = np.array(self.fwhms)
+        y = f**2 if self.model == 'hyperbola' else f
+        w = 1.0/self._sigma(f)
+        X = self._design(p)
+        self.information = (X*w[:, None]**2).T @ X
+        self.coeffs = np.linalg.lstsq(X*w[:, None], y*w, rcond=None)[0]
+        self.covariance = np.linalg.pinv(self.information)
+
+        # scale the uncertainties by the scatter about the fit, if it's bigger than expected
+        dof = len(p) - 3
+        if dof > 0:
+            chi2 = np.sum(((X @ self.coeffs - y)*w)**2)/dof
+            if chi2 > 1: self.covariance = self.covariance*chi2
+        return True
+
+    @property
+    def converging(self):
+        """ True if the fit curves upward (it has a minimum) """
+        return self.coeffs is not None and self.coeffs[0] > 0
+
+    def _vertex_jacobian(self, coeffs):
+        A, B = coeffs[0], coeffs[1]
+        return np.array([B/(2.0*A**2), -1.0/(2.0*A), 0.0])*self._scale
+
+    @property
+    def best(self):
+        """ (best focus position, its 1-sigma uncertainty), or (None, None) """
+        if not self.converging: return None, None
+        A, B = self.coeffs[0], self.coeffs[1]
+        J = self._vertex_jacobian(self.coeffs)
+        return float(self._p0 - B/(2.0*A)*self._scale), float(np.sqrt(max(J @ self.covariance @ J, 0.0)))
+
+    def predict(self, position):
+        """ the FWHM the model predicts at position(s) """
+        y = self._design(position) @ self.coeffs
+        if self.model == 'hyperbola':
+            return np.sqrt(np.maximum(y, 0.0))
+        return y
+
+    def next_position(self, candidates, max_fwhm=None, pending=()):
+        """
+        The candidate position that would most reduce the uncertainty of the best focus
+
+        Each candidate's measurement uncertainty is taken from the FWHM the
+        model predicts there; candidates where that's over max_fwhm (stars
+        too blurred to measure) are skipped. pending are positions that will
+        be measured but aren't in the fit yet, so they aren't picked again.
+        """
+        candidates = np.asarray(candidates, dtype=np.float64)
+        fwhm = self.predict(candidates)
+        ok = np.ones(len(candidates), dtype=bool) if max_fwhm is None else fwhm <= max_fwhm
+        if not ok.any(): ok[:] = True
+
+        info = self.information.copy()
+        for p in pending:
+            x = self._design(p)
+            info += np.outer(x, x)/self._sigma(self.predict(p))**2
+
+        # the updated information matrix for every candidate at once: (n, 3, 3)
+        X = self._design(candidates)
+        w2 = 1.0/self._sigma(fwhm)**2
+        infos = info[None, :, :] + w2[:, None, None]*X[:, :, None]*X[:, None, :]
+        J = self._vertex_jacobian(self.coeffs)
+        covs = np.linalg.pinv(infos)
+        variance = np.einsum('i,nij,j->n', J, covs, J)
+        variance[~ok] = np.inf
+        return float(candidates[np.argmin(variance)])
+
+
+def _measure_fwhm(image):
+    return imstats.measure(image, halfwidth=10)['fwhm']
+
+
+class Autofocus:
+    """
+    Parameters
+    ----------
+    camera : Camera
+        see camera.load_camera
+    move : function
+        move(position) moves the focuser and returns once it's there.
+    guess : float
+        Where to start (e.g., the current or predicted best focus).
+    step : float
+        Spacing of the first three positions (guess - step, guess, guess + step).
+    min_position, max_position : float
+        The positions the search may use.
+    exptime : float
+        Seconds per frame.
+    model : str
+        'hyperbola' or 'parabola' (see FocusModel).
+    tolerance : float
+        Stop once the 1-sigma uncertainty in the best focus is below this.
+    max_exposures : int
+        Give up after this many frames.
+    max_fwhm : float
+        Don't pick positions where the model predicts a FWHM (pixels) larger than this.
+    measure : function
+        measure(image) returns the FWHM; by default the median FWHM of the stars (see imstats.measure).
+    fwhm_noise : float
+        Typical uncertainty of a FWHM measurement (pixels).
+    focus_model : focusmodel.FocusPredictor
+        The best focus is recorded in it (default: the camera's focus_model, if any).
+    """
+
+    def __init__(self, camera, move, guess, step, min_position, max_position, exptime=5.0, model='hyperbola',
+                 tolerance=5.0, max_exposures=15, max_fwhm=None, measure=None, fwhm_noise=0.1, ncandidates=101,
+                 simulate=None, timeout=60.0, focus_model=None):
+        self.logger = logging.getLogger()
+        self.camera = camera
+        self.move = move
+        self.guess = float(guess)
+        self.step = float(step)
+        self.min_position = float(min_position)
+        self.max_position = float(max_position)
+        self.exptime = exptime
+        self.tolerance = tolerance
+        self.max_exposures = max_exposures
+        self.max_fwhm = max_fwhm
+        self.measure = _measure_fwhm if measure is None else measure
+        self.candidates = np.linspace(self.min_position, self.max_position, ncandidates)
+        self.simulate = simulate
+        self.timeout = timeout
+        self.focus_model = getattr(camera, 'focus_model', None) if focus_model is None else focus_model
+
+        self.model = FocusModel(model, fwhm_noise=fwhm_noise)
+        self.history = []
+
+    def _next(self, planned, pending):
+        """ the position after the ones already planned """
+        if len(planned) > 0: return planned.pop(0)
+        if self.model.coeffs is None:
+            # not enough good points yet; keep stepping out
+            return float(np.clip(max(self.model.positions + list(pending) + [self.guess]) + self.step,
+                                 self.min_position, self.max_position))
+        if not self.model.converging:
+            # no minimum yet; head downhill
+            downhill = -np.sign(self.model.coeffs[1]) or 1.0
+            edge = max(self.model.positions) if downhill > 0 else min(self.model.positions)
+            return float(np.clip(edge + downhill*self.step, self.min_position, self.max_position))
+        return self.model.next_position(self.candidates, max_fwhm=self.max_fwhm, pending=pending)
+
+    def _converged(self):
+        best, sigma = self.model.best
+        if best is None: return False
+        # the minimum must be bracketed by the samples, not extrapolated
+        return sigma < self.tolerance and min(self.model.positions) < best < max(self.model.positions)
+
+    def run(self):
+        """
+        Find the best focus and move there
+
+        The best focus is recorded in the focus model, if there is one.
+        Returns (best position, its uncertainty), or (None, None) if it didn't converge
+        """
+        planned = [self.guess - self.step, self.guess, self.guess + self.step]
+        planned = [float(np.clip(p, self.min_position, self.max_position)) for p in planned]
+
+        mover = ThreadPoolExecutor(max_workers=1, thread_name_prefix='focusmove')
+        camera = self.camera
+        try:
+            position = planned.pop(0)
+            moving = mover.submit(self.move, position)
+            t0 = time.monotonic()
+            for n in range(self.max_exposures):
+                moving.result()
+
+                t_start = time.monotonic()
+                camera._start_exposure(self.exptime, simulate=self.simulate)
+                sleeptime = t_start + self.exptime - time.monotonic()
+                if sleeptime > 0: time.sleep(sleeptime)
+
+                # the shutter's closed: move on while this frame reads out and is measured
+                last = n+1 == self.max_exposures
+                if not last:
+                    next_position = self._next(planned, [position])
+                image = camera._read_image(self.exptime, t_start, self.timeout, simulate=self.simulate)
+                if not last:
+                    moving = mover.submit(self.move, next_position)
+
+                if image is None:
+                    self.logger.error("Timed out waiting for autofocus image")
+                    fwhm = np.nan
+                else:
+                    try:
+                        fwhm = self.measure(image)
+                    finally:
+                        if camera.frame_pool is not None: camera.frame_pool.release(image)
+
+                self.model.add(position, fwhm)
+                best, sigma = self.model.best
+                self.history.append({'position': position, 'fwhm': fwhm, 'best': best, 'sigma': sigma,
+                                     'elapsed': time.monotonic() - t0})
+                self.logger.info("Autofocus frame " + str(n+1) + ": FWHM=" + str(fwhm) + " at " + str(position) +
+                                 "; best focus " + str(best) + " +/- " + str(sigma))
+                if self._converged(): break
+                if last: break
+                position = next_position
+            moving.result()
+        finally:
+            mover.shutdown()
+
+        if not self._converged():
+            self.logger.error("Autofocus did not converge after " + str(len(self.history)) + " frames")
+            return None, None
+
+        best, sigma = self.model.best
+        self.logger.info("Best focus is " + '{0:.1f}'.format(best) + " +/- " + '{0:.1f}'.format(sigma) + " (" +
+                         str(len(self.history)) + " frames, " + '{0:.1f}'.format(self.history[-1]['elapsed']) + " s)")
+        self.move(best)
+
+        # so the focus model predicts from here on (see focusmodel.FocusPredictor)
+        if self.focus_model is not None:
+            self.focus_model.record(best, fwhm=float(self.model.predict(best)), filter=self.focus_model.filter,
+                                    altitude=self.focus_model.altitude)
+        return best, sigma
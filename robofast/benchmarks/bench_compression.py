@@ -0,0 +1,44 @@
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+
+# local imports
+from robofast import simulate
+from robofast import fitswriter
+
+# measures write throughput (MB/s of raw pixels) and compression ratio of the
+# FitsWriter compression modes on simulated frames
+# to run, type this from the directory above robofast
+# python -m robofast.benchmarks.bench_compression
+
+
+def simulated_frame(size=2048, nstars=2000, seed=1):
+    frame = np.empty((size, size), dtype=np.float32)
+    simulate.NoiseGenerator(seed=seed, nthreads=1).fill(frame, background=300.0, noise=10.0)
+    rng = np.random.default_rng(seed)
+    simulate.render_stars(frame, rng.uniform(0, size, nstars), rng.uniform(0, size, nstars),
+                          10**rng.uniform(3, 6, nstars), 2.0, rng=rng)
+    np.clip(frame, 0, 65535, out=frame)
+    return frame
+
+
+def bench(data, compression, quantize_level=16.0, nframes=5):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        writer = fitswriter.FitsWriter(nworkers=1, maxqueue=nframes, compression=compression,
+                                       quantize_level=quantize_level)
+        t0 = time.perf_counter()
+        for i in range(nframes):
+            writer.submit(Path(tmpdir) / ('frame' + str(i) + '.fits'), data.copy())
+        writer.close()
+        elapsed = time.perf_counter() - t0
+    return writer.nbytes/elapsed/1e6, writer.nbytes/writer.nbytes_written
+
+
+if __name__ == '__main__':
+    frame = simulated_frame()
+    print('%-8s %-10s %10s %8s' % ('dtype', 'mode', 'MB/s', 'ratio'))
+    for data in (frame.astype(np.uint16), frame):
+        for compression in (None, 'rice', 'gzip', 'hcompress'):
+            mbps, ratio = bench(data, compression)
+            print('%-8s %-10s %10.1f %8.2f' % (data.dtype, compression, mbps, ratio))
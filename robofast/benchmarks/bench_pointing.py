@@ -0,0 +1,103 @@
+import logging
+import os
+import tempfile
+import time
+import numpy as np
+from scipy.interpolate import Rbf
+
+# local imports
+from robofast import pointingmodel
+
+# fit and evaluation time of the pointing model as the number of calibration points grows:
+# the two scipy.interpolate.Rbf models compute_pointing_model used to fit every time (evaluated
+# one position at a time), RBFPointingModel (global, and local with 30 neighbors),
+# reloading a cached fit, and the 8 term ParametricPointingModel
+# to run, type this from the directory above robofast
+# python -m robofast.benchmarks.bench_pointing
+
+
+def calibration_points(npoints, seed=1):
+    rng = np.random.default_rng(seed)
+    alt = np.degrees(np.arcsin(rng.uniform(np.sin(np.radians(20.0)), 1.0, npoints)))
+    az = rng.uniform(0.0, 360.0, npoints)
+    # a few arcmin of smooth offsets
+    alt_tel = alt + 0.05*np.cos(np.radians(az)) + 0.02*np.cos(np.radians(alt))
+    az_tel = az + 0.03*np.sin(np.radians(az)) + 0.01/np.maximum(np.cos(np.radians(alt)), 0.1)
+    return alt, az, alt_tel, az_tel
+
+
+def legacy_fit(alt, az, alt_tel, az_tel):
+    """ the original model, kept here as a reference for the benchmark """
+    v = pointingmodel.unit_vectors(alt, az)
+    rbf_alt = Rbf(v[:, 0], v[:, 1], v[:, 2], alt_tel, function='thin_plate')
+    rbf_az = Rbf(v[:, 0], v[:, 1], v[:, 2], az_tel, function='thin_plate')
+
+    def f(alt, az):
+        v = pointingmodel.unit_vectors(alt, az)
+        return float(rbf_alt(v[0], v[1], v[2])), float(rbf_az(v[0], v[1], v[2]))
+    return f
+
+
+def bench(npoints, neval=2000, repeat=3):
+    alt, az, alt_tel, az_tel = calibration_points(npoints)
+    rng = np.random.default_rng(2)
+    qalt = rng.uniform(25.0, 85.0, neval)
+    qaz = rng.uniform(0.0, 360.0, neval)
+    results = {}
+
+    # the old way: refit on every call to compute_pointing_model, then one position per call
+    t0 = time.perf_counter()
+    f = legacy_fit(alt, az, alt_tel, az_tel)
+    results['legacy_fit'] = time.perf_counter() - t0
+    n = min(neval, 200)
+    t0 = time.perf_counter()
+    for i in range(n):
+        f(qalt[i], qaz[i])
+    results['legacy_eval'] = (time.perf_counter() - t0)/n
+
+    for name, neighbors in (('global', None), ('local', 30)):
+        best_fit, best_eval = np.inf, np.inf
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            model = pointingmodel.RBFPointingModel(neighbors=neighbors).fit(alt, az, alt_tel, az_tel)
+            best_fit = min(best_fit, time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            model(qalt, qaz)
+            best_eval = min(best_eval, (time.perf_counter() - t0)/neval)
+        results[name + '_fit'] = best_fit
+        results[name + '_eval'] = best_eval
+
+    best_fit, best_eval = np.inf, np.inf
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        model = pointingmodel.ParametricPointingModel('equatorial', latitude=31.68).fit(alt, az, alt_tel, az_tel)
+        best_fit = min(best_fit, time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        model(qalt, qaz)
+        best_eval = min(best_eval, (time.perf_counter() - t0)/neval)
+    results['parametric_fit'] = best_fit
+    results['parametric_eval'] = best_eval
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'pointing.dat')
+        np.savetxt(filename, np.transpose((alt, az, alt_tel, az_tel)))
+        pointingmodel.RBFPointingModel.from_file(filename)
+        t0 = time.perf_counter()
+        pointingmodel.RBFPointingModel.from_file(filename)
+        results['cached'] = time.perf_counter() - t0
+    return results
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    print('%7s | %10s %12s | %10s %12s | %10s %12s | %10s | %10s %12s' %
+          ('npoints', 'Rbf fit', 'Rbf eval', 'fit', 'eval', 'local fit', 'local eval', 'cached', 'param fit',
+           'param eval'))
+    print('%7s | %10s %12s | %10s %12s | %10s %12s | %10s | %10s %12s' % ('', '(ms)', '(us/pos)', '(ms)', '(us/pos)',
+                                                                          '(ms)', '(us/pos)', '(ms)', '(ms)', '(us/pos)'))
+    for npoints in (20, 50, 100, 200, 500, 1000, 2000):
+        t = bench(npoints)
+        print('%7d | %10.2f %12.1f | %10.2f %12.2f | %10.2f %12.2f | %10.2f | %10.2f %12.2f' %
+              (npoints, t['legacy_fit']*1e3, t['legacy_eval']*1e6, t['global_fit']*1e3, t['global_eval']*1e6,
+               t['local_fit']*1e3, t['local_eval']*1e6, t['cached']*1e3, t['parametric_fit']*1e3,
+               t['parametric_eval']*1e6))
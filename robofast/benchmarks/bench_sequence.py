@@ -0,0 +1,37 @@
+import tempfile
+import time
+import numpy as np
+
+# local imports
+from robofast import camera
+
+# runs CameraBase.sequence on simulated images and reports the per-frame overhead
+# to run, type this from the directory above robofast
+# python -m robofast.benchmarks.bench_sequence
+
+
+def simulated_camera(size=1024):
+    cam = camera.CameraBase({})
+    cam.x1, cam.x2, cam.y1, cam.y2 = 1, size+1, 1, size+1
+    cam.gain = 1.0
+    cam.platescale = 0.5
+    return cam
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(1)
+    for size in (512, 1024, 2048):
+        cam = simulated_camera(size)
+        simulate = {'x': rng.uniform(0, size, 200), 'y': rng.uniform(0, size, 200),
+                    'flux': 10**rng.uniform(3, 5, 200), 'seed': None}
+        for exptime in (0.0, 0.1):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                t0 = time.perf_counter()
+                stats = cam.sequence([(exptime, 'V', 20)], tmpdir, simulate=simulate)
+                cam.writer.flush()
+                elapsed = time.perf_counter() - t0
+            overhead = np.array([s['overhead'] for s in stats])
+            print('%4dx%-4d exptime=%.1f s: %5.1f frames/s, overhead per frame %.4f s (mean) %.4f s (max), duty cycle %.0f%%' %
+                  (size, size, exptime, len(stats)/elapsed, overhead.mean(), overhead.max(),
+                   100.0*exptime*len(stats)/elapsed))
+        cam.writer.close()
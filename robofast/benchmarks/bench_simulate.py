@@ -0,0 +1,115 @@
+import math
+import time
+import numpy as np
+
+# local imports
+from robofast import simulate
+
+# compares the vectorized star renderer (simulate.render_stars) to the
+# one-star-per-iteration loop CameraBase.simulate_star_image used to use,
+# and the parallel float32 noise generator to a single float64 np.random.normal
+# to run, type this from the directory above robofast
+# python -m robofast.benchmarks.bench_simulate
+
+
+def legacy_render(image, x, y, flux, sigma, gain=1.0):
+    """ the original python loop, kept here as a reference for the benchmark """
+    ywidth, xwidth = image.shape
+    boxsize = math.ceil(sigma*10.0)
+    if boxsize % 2 == 1: boxsize += 1
+
+    xgrid, ygrid = np.meshgrid(np.linspace(-boxsize, boxsize, 2*boxsize+1), np.linspace(-boxsize, boxsize, 2*boxsize+1))
+    d = np.sqrt(xgrid*xgrid+ygrid*ygrid)
+    g = np.exp(-(d**2/(2.0*sigma**2)))
+    g = g/np.sum(g)
+
+    for ii in range(len(x)):
+        xii = int(x[ii])
+        yii = int(y[ii])
+
+        if xii >= boxsize:
+            x1 = xii-boxsize
+            x1stamp = 0
+        else:
+            x1 = 0
+            x1stamp = boxsize-xii
+        if xii <= (xwidth-boxsize):
+            x2 = xii+boxsize+1
+            x2stamp = 2*boxsize+1
+        else:
+            x2 = xwidth
+            x2stamp = xwidth - xii + boxsize
+        if yii >= boxsize:
+            y1 = yii-boxsize
+            y1stamp = 0
+        else:
+            y1 = 0
+            y1stamp = boxsize-yii
+        if yii <= (ywidth-boxsize):
+            y2 = yii+boxsize+1
+            y2stamp = 2*boxsize+1
+        else:
+            y2 = ywidth
+            y2stamp = ywidth - yii + boxsize
+
+        if (y2-y1) > 0 and (x2-x1) > 0:
+            star = g[y1stamp:y2stamp, x1stamp:x2stamp]*flux[ii]
+            noise = np.random.normal(size=(y2stamp-y1stamp, x2stamp-x1stamp))
+            image[y1:y2, x1:x2] += (star + np.sqrt(star)*noise)/gain
+
+
+def bench(nstars, size=2048, sigma=2.0, repeat=3):
+    rng = np.random.default_rng(42)
+    # stay away from the edges; the old loop mishandles stamps that touch them
+    margin = math.ceil(sigma*10.0) + 2
+    x = rng.uniform(margin, size-margin, nstars)
+    y = rng.uniform(margin, size-margin, nstars)
+    flux = 10**rng.uniform(3, 6, nstars)
+
+    results = {}
+    for name, func in (('loop', legacy_render), ('vectorized', simulate.render_stars)):
+        best = np.inf
+        for i in range(repeat):
+            image = np.zeros((size, size))
+            t0 = time.perf_counter()
+            func(image, x, y, flux, sigma)
+            best = min(best, time.perf_counter() - t0)
+        results[name] = best
+    return results
+
+
+def bench_noise(size=4096, nthreads=None, repeat=3):
+    results = {}
+
+    best = np.inf
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        image = np.zeros((size, size), dtype=np.float64) + 300.0 + np.random.normal(scale=10.0, size=(size, size))
+        best = min(best, time.perf_counter() - t0)
+    results['normal'] = best
+
+    noise = simulate.NoiseGenerator(seed=1, nthreads=nthreads)
+    frame = np.empty((size, size), dtype=np.float32)
+    best = np.inf
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        noise.fill(frame, background=300.0, noise=10.0)
+        best = min(best, time.perf_counter() - t0)
+    noise.close()
+    results['parallel'] = best
+    results['nthreads'] = noise.nthreads
+
+    return results
+
+
+if __name__ == '__main__':
+    print('%8s %14s %14s %8s' % ('nstars', 'loop (star/s)', 'vector (star/s)', 'speedup'))
+    for nstars in (100, 1000, 5000, 20000):
+        t = bench(nstars)
+        print('%8d %14.0f %14.0f %8.1f' % (nstars, nstars/t['loop'], nstars/t['vectorized'], t['loop']/t['vectorized']))
+
+    t = bench_noise()
+    print()
+    print('4k x 4k background + noise: np.random.normal (float64) %.3f s (%.1f frames/s); '
+          'NoiseGenerator (float32, %d threads) %.3f s (%.1f frames/s)' %
+          (t['normal'], 1.0/t['normal'], t['nthreads'], t['parallel'], 1.0/t['parallel']))
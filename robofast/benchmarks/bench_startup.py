@@ -0,0 +1,58 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# how long the modules the daemons start from take to import, from python -X importtime
+# in a fresh interpreter: the total, the slowest imports under it, and whether any of the
+# heavy scientific packages (which should only load when first used) came along
+# (tests/test_startup.py checks that the heavy packages stay out)
+# to run, type this from the directory above robofast
+# python -m robofast.benchmarks.bench_startup
+
+HEAVY = ('astropy', 'scipy', 'astroquery', 'erfa', 'matplotlib')
+DAEMON_MODULES = ('robofast.dome', 'robofast.telescope', 'robofast.camera', 'robofast.observatory',
+                  'robofast.weather')
+
+
+def import_report(module):
+    """
+    Import module in a fresh interpreter with -X importtime
+
+    Returns a dictionary with total (s, the module's cumulative import time),
+    wall (s, including interpreter startup), imports (a list of (self,
+    cumulative (s), name) for everything imported), and heavy (the HEAVY
+    packages that were imported)
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    t0 = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=root, env=env,
+                            capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - t0
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'): continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit(): continue
+        imports.append((int(fields[0])*1e-6, int(fields[1])*1e-6, fields[2].strip()))
+    total = next((cumulative for self_time, cumulative, name in imports if name == module), 0.0)
+    heavy = sorted({name.split('.')[0] for self_time, cumulative, name in imports if name.split('.')[0] in HEAVY})
+    return {'total': total, 'wall': wall, 'imports': imports, 'heavy': heavy}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report the import time of the modules the daemons start from')
+    parser.add_argument('modules', nargs='*', default=DAEMON_MODULES, help='modules to import')
+    parser.add_argument('--top', type=int, default=5, help='slowest imports (self time) to list for each')
+    opt = parser.parse_args()
+
+    print('%-24s | %10s | %10s | %s' % ('module', 'import (ms)', 'wall (ms)', 'heavy packages'))
+    for module in opt.modules:
+        report = import_report(module)
+        print('%-24s | %11.1f | %10.1f | %s' % (module, report['total']*1e3, report['wall']*1e3,
+                                               ', '.join(report['heavy']) if report['heavy'] else 'none'))
+        for self_time, cumulative, name in sorted(report['imports'], reverse=True)[:opt.top]:
+            print('%-24s | %11.1f |            |   %s' % ('', self_time*1e3, name))
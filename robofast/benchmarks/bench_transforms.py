@@ -0,0 +1,96 @@
+import logging
+import time
+import numpy as np
+from astropy.coordinates import SkyCoord, AltAz
+from astropy.time import Time
+from astropy import units as u
+
+# local imports
+from robofast import transforms
+
+# per-coordinate cost of ICRS -> AltAz: the old TelescopeBase.icrs_to_altaz (a SkyCoord and
+# AltAz frame per call), astropy vectorized over the targets, and transforms.AltAzTransform,
+# exact and fast (interpolated), for many targets at one time, one target at many times, and
+# single calls a second apart (as a scheduler or tracking loop makes), with the error of each vs astropy
+# to run, type this from the directory above robofast
+# python -m robofast.benchmarks.bench_transforms
+
+
+def legacy_icrs_to_altaz(ra_icrs, dec_icrs, obstime, location):
+    """ the original TelescopeBase.icrs_to_altaz, kept here as a reference for the benchmark """
+    if not isinstance(obstime, Time):
+        obstime = Time(obstime)
+    icrs = SkyCoord(ra=(ra_icrs * u.deg), dec=(dec_icrs * u.deg), frame="icrs")
+    return icrs.transform_to(AltAz(obstime=obstime, location=location))
+
+
+def error_mas(alt, az, reference):
+    """ largest separation (mas) of alt, az from an astropy AltAz coordinate """
+    return 3.6e6*float(np.max(SkyCoord(az*u.deg, alt*u.deg).separation(
+        SkyCoord(reference.az, reference.alt)).deg))
+
+
+def timed(function, n, repeat=3):
+    best = np.inf
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - t0)
+    return best/n*1e6, result
+
+
+def bench(ntargets=2000, ntimes=2000, nsingle=200):
+    transform = transforms.AltAzTransform(31.680407, -110.878977, 2316.0)
+    location = transform.location
+    rng = np.random.default_rng(1)
+    ra = rng.uniform(0.0, 360.0, ntargets)
+    dec = np.degrees(np.arcsin(rng.uniform(-0.6, 1.0, ntargets)))
+    t0 = Time('2026-10-18T02:00:00')
+    night = t0 + np.linspace(0.0, 10.0, ntimes)*u.hour
+    rows = []
+
+    # one position per call, each at a new time a second later (as a scheduler or tracking loop)
+    singles = t0 + np.arange(nsingle)*u.s
+    reference = legacy_icrs_to_altaz(ra[:nsingle], dec[:nsingle], singles, location)
+    us, _ = timed(lambda: [legacy_icrs_to_altaz(ra[i], dec[i], singles[i], location) for i in range(nsingle)],
+                  nsingle, repeat=1)
+    rows.append(('single, new times', 'legacy', us, 0.0))
+    for fast in (False, True):
+        transform._cache.clear()
+        transform._grid.clear()
+        us, altaz = timed(lambda: [transform.icrs_to_altaz(ra[i], dec[i], singles[i], fast=fast)
+                                   for i in range(nsingle)], nsingle, repeat=1)
+        alt, az = np.transpose(altaz)
+        rows.append(('single, new times', 'fast' if fast else 'exact', us, error_mas(alt, az, reference)))
+
+    # many targets at one time (a visibility check)
+    reference = legacy_icrs_to_altaz(ra, dec, t0, location)
+    us, _ = timed(lambda: legacy_icrs_to_altaz(ra, dec, t0, location), ntargets)
+    rows.append((str(ntargets) + ' targets, 1 time', 'astropy', us, 0.0))
+    transform._cache.clear()
+    us, (alt, az) = timed(lambda: transform.icrs_to_altaz(ra, dec, t0), ntargets, repeat=1)
+    rows.append((str(ntargets) + ' targets, 1 time', 'exact', us, error_mas(alt, az, reference)))
+    us, (alt, az) = timed(lambda: transform.icrs_to_altaz(ra, dec, t0), ntargets)
+    rows.append((str(ntargets) + ' targets, 1 time', 'cached', us, error_mas(alt, az, reference)))
+
+    # one target over a night (a visibility curve)
+    reference = legacy_icrs_to_altaz(ra[0], dec[0], night, location)
+    us, _ = timed(lambda: legacy_icrs_to_altaz(ra[0], dec[0], night, location), ntimes)
+    rows.append(('1 target, ' + str(ntimes) + ' times', 'astropy', us, 0.0))
+    transform._cache.clear()
+    us, (alt, az) = timed(lambda: transform.icrs_to_altaz(ra[0], dec[0], night), ntimes, repeat=1)
+    rows.append(('1 target, ' + str(ntimes) + ' times', 'exact', us, error_mas(alt, az, reference)))
+    for resolution in (300.0, 3600.0):
+        transform.time_resolution = resolution
+        transform._grid.clear()
+        us, (alt, az) = timed(lambda: transform.icrs_to_altaz(ra[0], dec[0], night, fast=True), ntimes, repeat=1)
+        rows.append(('1 target, ' + str(ntimes) + ' times', 'fast ' + str(int(resolution)) + ' s', us,
+                     error_mas(alt, az, reference)))
+    return rows
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    print('%-22s | %-12s | %12s | %12s' % ('case', 'path', 'us/coord', 'error (mas)'))
+    for case, path, us, err in bench():
+        print('%-22s | %-12s | %12.2f | %12.2g' % (case, path, us, err))
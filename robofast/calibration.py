@@ -0,0 +1,281 @@
+import argparse
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from astropy.io import fits
+
+"""
+Builds master bias, dark, and flat frames from any number of exposures, in bounded memory
+
+The inputs are memory-mapped, and the stack is combined a block of rows at a
+time: each block is a (nframes, nrows, nx) float32 cube, sized so all the
+blocks being worked on at once fit in memory_budget bytes. Blocks are
+combined in parallel by a thread pool (numpy's sorting and reductions release
+the GIL, so they use every core). Each pixel is sigma clipped, then the
+survivors are averaged (mean or median).
+
+Every master also gets a NOISE extension with the per-pixel standard
+deviation of the (clipped) inputs, and an NCOMBINE extension with the number
+of frames that survived clipping at each pixel.
+
+From the command line (from the directory above robofast):
+python -m robofast.calibration bias master_bias.fits bias*.fits
+python -m robofast.calibration dark master_dark.fits dark*.fits --bias master_bias.fits
+python -m robofast.calibration flat master_flat_V.fits flat_V*.fits --bias master_bias.fits --dark master_dark.fits
+"""
+
+
+def _image_hdu(hdulist):
+    for hdu in hdulist:
+        if hdu.is_image and hdu.header.get('NAXIS', 0) == 2:
+            return hdu
+    raise ValueError("No 2D image in " + str(hdulist.filename()))
+
+
+class FrameReader:
+    """
+    Reads blocks of rows from a FITS image without loading it
+
+    Uncompressed images are memory-mapped and tile compressed images only
+    decompress the tiles a block needs. Either way the raw values are read
+    (astropy won't memory-map scaled data) and BZERO/BSCALE are applied to
+    each block, so unsigned 16 bit frames come out right.
+    """
+
+    def __init__(self, filename):
+        self.filename = str(filename)
+        self.hdulist = fits.open(self.filename, memmap=True, do_not_scale_image_data=True)
+        self.hdu = _image_hdu(self.hdulist)
+        self.header = self.hdu.header
+        self.compressed = isinstance(self.hdu, fits.CompImageHDU)
+        self.shape = (self.header['NAXIS2'], self.header['NAXIS1'])
+        self.bzero = self.header.get('BZERO', 0.0)
+        self.bscale = self.header.get('BSCALE', 1.0)
+        self.exptime = self.header.get('EXPTIME')
+
+    def rows(self, r0, r1, out):
+        """ rows r0 to r1 into out (float32, (r1-r0, nx)) """
+        if self.compressed:
+            out[:] = self.hdu.section[r0:r1]
+        else:
+            out[:] = self.hdu.data[r0:r1]
+        if self.bscale != 1.0: out *= self.bscale
+        if self.bzero != 0.0: out += self.bzero
+        return out
+
+    def sample(self, nsample=100000):
+        """ every Nth row, for a quick median """
+        step = max(1, self.shape[0]*self.shape[1]//nsample)
+        rows = np.arange(0, self.shape[0], max(1, step//self.shape[1]))
+        return np.concatenate([self.rows(r, r+1, np.empty((1, self.shape[1]), dtype=np.float32))[0] for r in rows])
+
+    def close(self):
+        self.hdulist.close()
+
+
+def _load_master(master):
+    """ a master frame: an array, a filename (memory-mapped), or None """
+    if master is None or isinstance(master, np.ndarray): return master
+    return fits.getdata(master, memmap=True)
+
+
+def sigma_clip_stack(cube, nsigma=3.0, maxiters=3, method='median'):
+    """
+    Sigma clip a (nframes, ny, nx) cube along the frames, in place
+
+    Outliers are replaced with nan. Returns the combined image, the standard
+    deviation of the surviving frames, and how many survived, per pixel
+    """
+    for i in range(maxiters):
+        center = np.nanmedian(cube, axis=0)
+        # the MAD is robust to the outliers we're trying to find
+        std = 1.4826*np.nanmedian(np.abs(cube - center), axis=0)
+        bad = np.abs(cube - center) > nsigma*std
+        # constant pixels (std = 0) can't be clipped
+        bad &= std > 0
+        if not bad.any(): break
+        cube[bad] = np.nan
+
+    if method == 'median':
+        combined = np.nanmedian(cube, axis=0)
+    else:
+        combined = np.nanmean(cube, axis=0)
+    return combined, np.nanstd(cube, axis=0), np.count_nonzero(np.isfinite(cube), axis=0)
+
+
+def combine(filenames, output=None, method='median', nsigma=3.0, maxiters=3, bias=None, dark=None, normalize=False,
+            memory_budget=256e6, nworkers=None, overwrite=False, header=None):
+    """
+    Sigma-clipped combine of many frames, a block of rows at a time
+
+    Parameters
+    ----------
+    filenames : list
+        The frames (all the same size).
+    output : str
+        Where to write the master (None to just return it).
+    method : str
+        'median' or 'mean' (of the pixels that survive clipping).
+    bias : array or filename
+        Master bias to subtract from each frame.
+    dark : array or filename
+        Master dark (ADU/s) to scale by each frame's EXPTIME and subtract.
+    normalize : bool
+        Divide each frame by its median (after bias and dark), for flats.
+    memory_budget : float
+        Bytes of stack to hold at once, over all workers.
+    nworkers : int
+        Blocks combined at once (default: number of cores).
+
+    Returns
+    -------
+    master, noise, ncombine : arrays
+    """
+    logger = logging.getLogger()
+    if method not in ('median', 'mean'):
+        raise ValueError("Unknown combine method (" + str(method) + "); must be median or mean")
+    if len(filenames) == 0:
+        raise ValueError("No frames to combine")
+
+    readers = [FrameReader(f) for f in filenames]
+    try:
+        ny, nx = readers[0].shape
+        for reader in readers:
+            if reader.shape != (ny, nx):
+                raise ValueError(reader.filename + " is " + str(reader.shape) + "; expected " + str((ny, nx)))
+
+        bias = _load_master(bias)
+        dark = _load_master(dark)
+        exptimes = np.array([r.exptime or 0.0 for r in readers], dtype=np.float32)
+        if dark is not None and np.any(exptimes <= 0):
+            logger.warning("Some frames have no EXPTIME; not dark subtracting them")
+
+        scales = np.ones(len(readers), dtype=np.float32)
+        if normalize:
+            for i, reader in enumerate(readers):
+                sample = reader.sample()
+                level = np.median(sample)
+                if bias is not None: level -= np.median(bias)
+                if dark is not None: level -= np.median(dark)*exptimes[i]
+                scales[i] = level if level > 0 else 1.0
+
+        if nworkers is None: nworkers = os.cpu_count() or 1
+        # the float32 cube plus about three times as much in clipping temporaries, per worker
+        bytes_per_row = len(readers)*nx*4*4
+        rows_per_block = int(max(1, min(ny, memory_budget//(nworkers*bytes_per_row))))
+        nworkers = max(1, min(nworkers, -(-ny//rows_per_block)))
+        logger.info("Combining " + str(len(readers)) + " frames in blocks of " + str(rows_per_block) +
+                    " rows with " + str(nworkers) + " workers")
+
+        master = np.empty((ny, nx), dtype=np.float32)
+        noise = np.empty((ny, nx), dtype=np.float32)
+        ncombine = np.empty((ny, nx), dtype=np.int16)
+        # each reader's file handle is shared, so only one block reads at a time
+        read_lock = threading.Lock()
+
+        def work(r0):
+            r1 = min(r0 + rows_per_block, ny)
+            cube = np.empty((len(readers), r1-r0, nx), dtype=np.float32)
+            with read_lock:
+                for i, reader in enumerate(readers):
+                    reader.rows(r0, r1, cube[i])
+            if bias is not None: cube -= np.asarray(bias[r0:r1], dtype=np.float32)
+            if dark is not None: cube -= np.asarray(dark[r0:r1], dtype=np.float32)*exptimes[:, None, None]
+            if normalize: cube /= scales[:, None, None]
+            master[r0:r1], noise[r0:r1], ncombine[r0:r1] = sigma_clip_stack(cube, nsigma=nsigma, maxiters=maxiters,
+                                                                           method=method)
+
+        with ThreadPoolExecutor(max_workers=nworkers, thread_name_prefix='calib') as pool:
+            # list() so exceptions are raised here
+            list(pool.map(work, range(0, ny, rows_per_block)))
+
+        if normalize:
+            # the master flat has a median of 1
+            level = np.median(master)
+            if level > 0:
+                master /= level
+                noise /= level
+
+        if output is not None:
+            hdr = fits.Header() if header is None else header
+            hdr['NCOMBINE'] = (len(readers), 'Number of frames combined')
+            hdr['COMBINE'] = (method, 'Combine method')
+            hdr['NSIGMA'] = (nsigma, 'Sigma clipping threshold')
+            hdulist = fits.HDUList([fits.PrimaryHDU(master, header=hdr),
+                                    fits.ImageHDU(noise, name='NOISE'),
+                                    fits.ImageHDU(ncombine, name='NCOMBINE')])
+            hdulist[1].header['COMMENT'] = 'Per-pixel standard deviation of the clipped input frames'
+            hdulist.writeto(output, overwrite=overwrite)
+            logger.info("Wrote " + str(output))
+    finally:
+        for reader in readers:
+            reader.close()
+    return master, noise, ncombine
+
+
+def master_bias(filenames, output=None, **kwargs):
+    """ median combine of bias frames """
+    hdr = fits.Header()
+    hdr['IMAGETYP'] = ('BIAS', 'Master bias')
+    return combine(filenames, output, header=hdr, **kwargs)
+
+
+def master_dark(filenames, output=None, bias=None, **kwargs):
+    """ combine of bias-subtracted darks, divided by their exposure time (ADU/s) """
+    exptimes = [fits.getheader(f, ext=_image_index(f)).get('EXPTIME') for f in filenames]
+    if any(t is None or t <= 0 for t in exptimes) or len(set(exptimes)) > 1:
+        raise ValueError("Darks must all have the same, non-zero EXPTIME")
+    master, noise, ncombine = combine(filenames, None, bias=bias, **kwargs)
+    master /= exptimes[0]
+    noise /= exptimes[0]
+
+    if output is not None:
+        hdr = fits.Header()
+        hdr['IMAGETYP'] = ('DARK', 'Master dark (ADU/s)')
+        hdr['EXPTIME'] = (exptimes[0], 'Exposure time of the input darks')
+        hdr['NCOMBINE'] = (len(filenames), 'Number of frames combined')
+        fits.HDUList([fits.PrimaryHDU(master, header=hdr), fits.ImageHDU(noise, name='NOISE'),
+                      fits.ImageHDU(ncombine, name='NCOMBINE')]).writeto(output, overwrite=kwargs.get('overwrite', False))
+    return master, noise, ncombine
+
+
+def master_flat(filenames, output=None, bias=None, dark=None, **kwargs):
+    """ combine of bias- and dark-subtracted flats, each normalized by its median; the master has a median of 1 """
+    hdr = fits.Header()
+    hdr['IMAGETYP'] = ('FLAT', 'Master flat (normalized)')
+    return combine(filenames, output, bias=bias, dark=dark, normalize=True, header=hdr, **kwargs)
+
+
+def _image_index(filename):
+    with fits.open(filename) as hdulist:
+        for i, hdu in enumerate(hdulist):
+            if hdu.is_image and hdu.header.get('NAXIS', 0) == 2:
+                return i
+    raise ValueError("No 2D image in " + str(filename))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a master calibration frame')
+    parser.add_argument('type', choices=('bias', 'dark', 'flat'), help='Type of master')
+    parser.add_argument('output', help='Master to write')
+    parser.add_argument('inputs', nargs='+', help='Frames to combine')
+    parser.add_argument('--bias', default=None, help='Master bias to subtract')
+    parser.add_argument('--dark', default=None, help='Master dark to subtract (flats)')
+    parser.add_argument('--method', default='median', choices=('median', 'mean'), help='Combine method')
+    parser.add_argument('--nsigma', type=float, default=3.0, help='Sigma clipping threshold')
+    parser.add_argument('--memory', type=float, default=256.0, help='Memory budget (MB)')
+    parser.add_argument('--workers', type=int, default=None, help='Blocks combined at once (default: all cores)')
+    parser.add_argument('--overwrite', action='store_true', help='Overwrite the output')
+    opt = parser.parse_args()
+
+    kwargs = {'method': opt.method, 'nsigma': opt.nsigma, 'memory_budget': opt.memory*1e6, 'nworkers': opt.workers,
+              'overwrite': opt.overwrite}
+    if opt.type == 'bias':
+        master_bias(opt.inputs, opt.output, **kwargs)
+    elif opt.type == 'dark':
+        master_dark(opt.inputs, opt.output, bias=opt.bias, **kwargs)
+    else:
+        master_flat(opt.inputs, opt.output, bias=opt.bias, dark=opt.dark, **kwargs)
+    print('Wrote ' + opt.output)
@@ -5,11 +5,20 @@ from pathlib import Path
 from abc import ABC, abstractmethod
 import datetime
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
 import numpy as np
 import math
 
-# this is more for the camera simulator
-from astroquery.vizier import Vizier
+from robofast import simulate
+from robofast import catalog
+from robofast import fitswriter
+from robofast import framepool
+from robofast import thermal
+from robofast import ringbuffer
+from robofast import coadd
+from robofast import imstats
+from robofast import header
 
 # local imports
 #import filterwheel, focuser, ao, pdu
@@ -28,150 +37,708 @@ class CameraBase(ABC):
 
         root_dir = Path(__file__).resolve().parent
 
-    def starcat(self, ra, dec, width, height):
-        result = Vizier.query_region(coord.SkyCoord(ra=ra, dec=dec,unit=(u.deg, u.deg),frame='icrs'),width="30m",catalog=["I/337/gaia"])
-        ra = result[0]['RA_ICRS']
-        dec = result[0]['DE_ICRS']
-        mag = result[0]['__Gmag_']
-        x = 0
-        y = 0
-        flux = 10**(-0.4*mag)
-
-    '''                                                                                                                                                       
-    this creates a simple simulated image of a star field                                                                                                     
-    the idea is to be able to test guide performance, acquisition, etc, without being on sky                                                                                     
-    x -- an array of X centroids of the stars (only integers tested!)                                                                                         
-    y -- an array of Y centroids of the stars (only integers tested!)                                                                                         
-    flux -- an array of fluxes of the stars (e-)                                                                                                       
-    fwhm -- the fwhm of the stars (arcsec)                                                                                                                    
+        # a local tiled star catalog (see catalog.py) for the simulator and plate solving
+        # without it, starcat falls back to querying Vizier
+        self.catalog = None
+        if config.get('catalog_dir') is not None:
+            self.catalog = catalog.StarCatalog(root_dir / config['catalog_dir'])
+
+        # the magnitude that gives 1 e-/s, used to turn catalog magnitudes into fluxes
+        self.zeropoint = config.get('zeropoint', 25.0)
+
+        # the latest (simulated) image, and whether it's ready to be saved
+        self.image = None
+        self.ready = False
+
+        # frames are written to disk in the background by writer_threads threads
+        # save_image blocks if more than writer_queue frames are waiting to be written
+        # and frames can be tile compressed (by the writer threads)
+        self.writer = fitswriter.FitsWriter(nworkers=config.get('writer_threads', 2),
+                                            maxqueue=config.get('writer_queue', 4),
+                                            compression=config.get('compression'),
+                                            quantize_level=config.get('quantize_level', 16.0))
+
+        # if image_stats is True, every saved frame is measured (sky, star count, FWHM,
+        # ellipticity; see imstats.py) by stats_threads threads before it's written, and the
+        # results go in the header. Frames that arrive while they're all busy, or that aren't
+        # measured within stats_budget seconds, are written without them (counted in
+        # self.image_stats.nskipped). Other code can get them with self.image_stats.callbacks
+        self.image_stats = None
+        if config.get('image_stats', False):
+            self.image_stats = imstats.ImageStats(nworkers=config.get('stats_threads', 1),
+                                                  budget=config.get('stats_budget', 1.0),
+                                                  threshold=config.get('stats_threshold', 5.0),
+                                                  halfwidth=config.get('stats_halfwidth', 5))
+
+        # if quicklook is True, every frame on disk is calibrated with the master bias, dark, and
+        # flat, measured, and written as a reduced copy and thumbnail by quicklook_workers
+        # processes (see quicklook.py). Frames are skipped, never queued, when it falls behind
+        self.quicklook = None
+        if config.get('quicklook', False):
+            from robofast import quicklook
+            masters = {}
+            for name in ('master_bias', 'master_dark', 'master_flat'):
+                if config.get(name) is not None: masters[name[len('master_'):]] = root_dir / config[name]
+            self.quicklook = quicklook.QuickLook(output_dir=config.get('quicklook_dir'),
+                                                 nworkers=config.get('quicklook_workers', 1),
+                                                 maxpending=config.get('quicklook_pending'),
+                                                 thumbnail_size=config.get('quicklook_thumbnail', 256),
+                                                 threshold=config.get('stats_threshold', 5.0),
+                                                 halfwidth=config.get('stats_halfwidth', 5),
+                                                 **masters)
+            self.quicklook.watch(self.writer)
+
+        # header keywords from the other devices (dome, telescope, ...), added with
+        # add_header_provider (Observatory adds its domes and telescopes), are gathered
+        # concurrently and reused for up to header_max_age seconds. A frame waits at most
+        # header_timeout seconds for them (see header.HeaderSnapshot)
+        self.header_max_age = config.get('header_max_age', 0.0)
+        self.header_snapshot = header.HeaderSnapshot(timeout=config.get('header_timeout', 1.0),
+                                                     nworkers=config.get('header_threads', 8))
+
+        # the CCD temperature is watched in the background while cooling (see cool)
+        self.cooling_interval = config.get('cooling_interval', 10.0)
+        self.cooling_monitor = None
+
+        # a focusmodel.FocusPredictor, kept in focus_model (a CSV file); if set, the focus
+        # follows every filter change and autofocus results are recorded in it
+        self.focus_model = None
+        if config.get('focus_model') is not None:
+            from robofast import focusmodel
+            # the focuser is looked up when it's used; the hardware isn't set up yet
+            self.focus_model = focusmodel.load_focus_model(config, move=lambda position: self.move_focus(position))
+
+        # frames are read into preallocated buffers that are recycled once they're written
+        # by default, enough for every frame the writer can hold plus the one being read
+        self.frame_dtype = np.dtype(config.get('frame_dtype', 'uint16'))
+        self.frame_pool_size = config.get('frame_pool_size', self.writer.nworkers + self.writer.maxqueue + 1)
+        self.frame_pool = None
+
+        # video mode reads frames straight into a ring of video_frames preallocated frames
+        # (see start_video and ringbuffer.FrameRing)
+        self.video_frames = config.get('video_frames', 32)
+        self.video_ring = None
+        self.video_missed = 0
+        self._video_thread = None
+        self._video_stop = threading.Event()
+        self.coadder = None
+
+        # simulated frames are generated in float32, in place, in this buffer
+        # with the noise filled in parallel by sim_threads threads (default: all cores)
+        self.sim_threads = config.get('sim_threads')
+        self._sim_noise = None
+        self._sim_frame = None
+
+    def starcat(self, ra, dec, width, height, maglimit=None):
+        """
+        Find the stars in a width x height (deg) field centered at ra, dec (deg)
+
+        Stars come from the local tiled catalog (catalog_dir in the config) if
+        there is one, otherwise from Gaia via Vizier (slow, and needs a network).
+
+        Returns the x, y detector coordinates (north up, east left, centered on
+        the current ROI) and fluxes (e-/s) of the stars
+        """
+        if self.catalog is not None:
+            stars = self.catalog.box(ra, dec, width, height, maglimit=maglimit)
+            cat_ra = stars['ra']
+            cat_dec = stars['dec']
+            mag = stars['mag'].astype(np.float64)
+        else:
+            from astroquery.vizier import Vizier
+            from astropy import coordinates as coord
+            from astropy import units as u
+
+            self.logger.info("No local catalog; querying Vizier")
+            result = Vizier(row_limit=-1).query_region(coord.SkyCoord(ra=ra, dec=dec,unit=(u.deg, u.deg),frame='icrs'),
+                                                      width=width*u.deg, height=height*u.deg, catalog=["I/337/gaia"])
+            if len(result) == 0:
+                return np.empty(0), np.empty(0), np.empty(0)
+            cat_ra = np.asarray(result[0]['RA_ICRS'], dtype=np.float64)
+            cat_dec = np.asarray(result[0]['DE_ICRS'], dtype=np.float64)
+            mag = np.asarray(result[0]['__Gmag_'], dtype=np.float64)
+            if maglimit is not None:
+                keep = mag <= maglimit
+                cat_ra, cat_dec, mag = cat_ra[keep], cat_dec[keep], mag[keep]
+
+        xi, eta = catalog.project(cat_ra, cat_dec, ra, dec)
+        x = 0.5*(self.x1+self.x2) - xi*3600.0/self.platescale
+        y = 0.5*(self.y1+self.y2) + eta*3600.0/self.platescale
+        flux = 10**(-0.4*(mag-self.zeropoint))
+        return x, y, flux
+
+    '''
+    this creates a simple simulated image of a star field
+    the idea is to be able to test guide performance, acquisition, etc, without being on sky
+    x -- an array of X centroids of the stars (sub-pixel centroids allowed)
+    y -- an array of Y centroids of the stars (sub-pixel centroids allowed)
+    flux -- an array of fluxes of the stars (e-)
+    fwhm -- the fwhm of the stars (arcsec)
     background -- the sky background of the image, in ADU
     exptime -- the exposure time, in seconds. This will be written to the header, but will not impact the runtime unless wait=True
-    noise -- readnoise of the image, in ADU
+    noise -- readnoise of the image, in ADU (generated in parallel chunks, see simulate.NoiseGenerator)
     wait -- boolean; wait for exptime to elapse
+    ra, dec -- if given, also add the catalog stars (see starcat) in the field centered here (deg)
+    seed -- seed for the random number generator (for reproducible images)
+    profile -- the PSF profile ('gaussian' or 'moffat'); stamps are cached between calls
+
+    All stars are rendered in one vectorized pass (see simulate.render_stars)
     '''
-    def simulate_star_image(self,x,y,flux,fwhm=1.0,background=300.0,exptime=1.0,noise=10.0, wait=False, ra=None, dec=None):
+    def simulate_star_image(self,x,y,flux,fwhm=1.0,background=300.0,exptime=1.0,noise=10.0, wait=False, ra=None, dec=None, seed=None, profile='gaussian'):
 
         t0 = datetime.datetime.utcnow()
         self.exptime = exptime
         self.dateobs = datetime.datetime.utcnow()
 
-        # query a catalog to simulate a star field
-        if ra !=None and dec != None:
-                pass
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        flux = np.broadcast_to(np.asarray(flux, dtype=np.float64), x.shape)
 
+        # query a catalog to simulate a star field
+        if ra is not None and dec is not None:
+            width = (self.x2-self.x1)*self.platescale/3600.0
+            height = (self.y2-self.y1)*self.platescale/3600.0
+            catx, caty, catflux = self.starcat(ra, dec, width, height)
+            x = np.concatenate((x, catx))
+            y = np.concatenate((y, caty))
+            flux = np.concatenate((flux, catflux*exptime))
+
+        rng = np.random.default_rng(seed)
+        # one generator (and thread pool) per camera, reseeded when asked
+        if self._sim_noise is None:
+            self._sim_noise = simulate.NoiseGenerator(seed=seed, nthreads=self.sim_threads)
+        elif seed is not None:
+            self._sim_noise.seed(seed)
+
+        # reuse the frame buffer unless the ROI changed
         xwidth = self.x2-self.x1
         ywidth = self.y2-self.y1
-        image = np.zeros((ywidth,xwidth),dtype=np.float64) + background + np.random.normal(scale=noise,size=(ywidth,xwidth))
-
-        # add a guide star?
-        sigma = fwhm/self.platescale
-        mu = 0.0
-        boxsize = math.ceil(sigma*10.0)
-
-        # make sure it's even to make the indices/centroids come out right
-        if boxsize % 2 == 1: boxsize+=1
-
-        xgrid,ygrid = np.meshgrid(np.linspace(-boxsize,boxsize,2*boxsize+1), np.linspace(-boxsize,boxsize,2*boxsize+1))
-        d = np.sqrt(xgrid*xgrid+ygrid*ygrid)
-        g = np.exp(-( (d-mu)**2 / ( 2.0 * sigma**2 ) ) )
-        g = g/np.sum(g) # normalize the gaussian
-
-        # add each of the stars
-        for ii in range(len(x)):
-
-            xii = x[ii]-self.x1+1
-            yii = y[ii]-self.y1+1
-
-            # make sure the stamp fits on the image (if not, truncate the stamp)
-            if xii >= boxsize:
-                x1 = xii-boxsize
-                x1stamp = 0
-            else:
-                x1 = 0
-                x1stamp = boxsize-xii
-            if xii <= (xwidth-boxsize):
-                x2 = xii+boxsize+1
-                x2stamp = 2*boxsize+1
-            else:
-                x2 = xwidth
-                x2stamp = xwidth - xii + boxsize
-            if yii >= boxsize:
-                y1 = yii-boxsize
-                y1stamp = 0
-            else:
-                y1 = 0
-                y1stamp = boxsize-yii
-            if yii <= (ywidth-boxsize):
-                y2 = yii+boxsize+1
-                y2stamp = 2*boxsize+1
-            else:
-                y2 = ywidth
-                y2stamp = ywidth - yii + boxsize
-
-            if (y2-y1) > 0 and (x2-x1) > 0:
-                # normalize the star to desired flux
-                star = g[y1stamp:y2stamp,x1stamp:x2stamp]*flux[ii]
-
-                # add Poisson noise; convert to ADU
-                noise = np.random.normal(size=(y2stamp-y1stamp,x2stamp-x1stamp))
-                noisystar = (star + np.sqrt(star)*noise)/self.gain
-
-                # add the star to the image
-                image[y1:y2,x1:x2] += noisystar
-            else: self.logger.warning("star off image (" + str(xii) + "," + str(yii) + "); ignoring")
-
-            # simulate the exposure time, too
-            if wait:
-                    sleeptime = (datetime.datetime.utcnow() - t0).total_seconds() - exptime
-                    if sleeptime > 0: time.sleep(sleeptime)
-
-            # now convert to 16 bit int
-            self.image = image.astype(np.int16)
-            self.ready = True
-
-    def cool(self, temp=None, wait=False, settleTime=1200.0, oscillationTime=120.0, maxdiff = 1.0):
-        if not self.camera.CanSetCCDTemperature:
-            self.logger.error("Camera does not support cooling")
-            return False
-
-        if temp != None:
-            self.camera.SetCCDTemperature = temp
-
-        self.camera.CoolerOn = True
-
-        if not wait: return
-
-        t0 = datetime.datetime.utcnow()
-        elapsedTime = (datetime.datetime.utcnow() - t0).total_seconds()
-        lastTimeNotAtTemp = datetime.datetime.utcnow() - datetime.timedelta(seconds=oscillationTime)
-        elapsedTimeAtTemp = oscillationTime
-        currentTemp = self.camera.CCDTemperature
-        setTemp = self.camera.SetCCDTemperature
-
-        while elapsedTime < settleTime and ((abs(setTemp - currentTemp) > maxdiff) or elapsedTimeAtTemp < oscillationTime):
-            self.logger.info('Current temperature (' + str(currentTemp) +
-                             ') not at setpoint (' + str(setTemp) +
-                             '); waiting for CCD Temperature to stabilize (Elapsed time: '
-                             + str(elapsedTime) + ' seconds)')
-
-            # has to maintain temp within range for 1 minute
-            if (abs(setTemp - currentTemp) > self.maxdiff):
-                                lastTimeNotAtTemp = datetime.datetime.utcnow()
-            elapsedTimeAtTemp = (datetime.datetime.utcnow() - lastTimeNotAtTemp).total_seconds()
-
-            time.sleep(10)
-            #S update the temperature
-            currentTemp = self.temperature
-            elapsedTime = (datetime.datetime.utcnow() - start).total_seconds()
-
-        # Failed to reach setpoint
-        if (abs(setTemp - currentTemp)) > maxdiff:
-            self.logger.error('The camera was unable to reach its setpoint (' +
-                              str(setTemp) + ') in the elapsed time (' +
-                              str(elapsedTime) + ' seconds)')
+        if self._sim_frame is None or self._sim_frame.shape != (ywidth,xwidth):
+            self._sim_frame = np.empty((ywidth,xwidth),dtype=np.float32)
+        image = self._sim_noise.fill(self._sim_frame, background=background, noise=noise)
+
+        # convert detector coordinates to array coordinates within the ROI
+        # (pixel x1 is array index 0; see detector_coords)
+        x = x-self.x1
+        y = y-self.y1
+
+        psf = simulate.PSF(fwhm, self.platescale, profile=profile)
+        nrendered = simulate.render_stars(image, x, y, flux, psf, gain=self.gain, rng=rng)
+        if nrendered < len(x):
+            self.logger.warning(str(len(x)-nrendered) + " star(s) off image; ignoring")
+
+        # simulate the exposure time, too
+        if wait:
+            sleeptime = exptime - (datetime.datetime.utcnow() - t0).total_seconds()
+            if sleeptime > 0: time.sleep(sleeptime)
+
+        # now convert to the camera's pixel type (saturate rather than wrap)
+        info = np.iinfo(self.frame_dtype) if self.frame_dtype.kind in 'iu' else np.finfo(self.frame_dtype)
+        np.clip(image, max(info.min, 0), info.max, out=image)
+        self.image = self.frame_buffer(image.shape)
+        np.copyto(self.image, image, casting='unsafe')
+        self.ready = True
+
+    def frame_buffer(self, shape):
+        """
+        A preallocated (ny, nx) frame from the pool, (re)sized for the current ROI and binning
+
+        Return it with self.frame_pool.release(frame) (save_image does this
+        once the frame is written). In video mode, it's the next slot in the
+        video ring instead.
+        """
+        if self.video_running and self.video_ring.matches(shape, self.frame_dtype):
+            return self.video_ring.claim()
+        if self.frame_pool is None or not self.frame_pool.matches(shape, self.frame_dtype):
+            self.logger.debug("Allocating frame pool for " + str(shape) + " frames")
+            self.frame_pool = framepool.FramePool(shape, dtype=self.frame_dtype, nframes=self.frame_pool_size)
+        return self.frame_pool.acquire()
+
+    def detector_coords(self, x, y):
+        """
+        Unbinned detector coordinates of array coordinates in the current ROI
+
+        Array coordinates start at 0 (numpy indices); detector pixels start at
+        1, as in the ROI, with pixel centers at whole numbers
+        """
+        xd = (self.x1-1 + np.asarray(x))*self.xbin + 0.5*(self.xbin+1)
+        yd = (self.y1-1 + np.asarray(y))*self.ybin + 0.5*(self.ybin+1)
+        return xd, yd
+
+    def array_coords(self, xd, yd):
+        """ array coordinates in the current ROI of unbinned detector coordinates (see detector_coords) """
+        x = (np.asarray(xd) - 0.5*(self.xbin+1))/self.xbin - (self.x1-1)
+        y = (np.asarray(yd) - 0.5*(self.ybin+1))/self.ybin - (self.y1-1)
+        return x, y
+
+    def detector_section(self):
+        """ the unbinned detector pixels (x1, x2, y1, y2; inclusive) the current ROI covers """
+        return (self.x1-1)*self.xbin + 1, (self.x2-1)*self.xbin, (self.y1-1)*self.ybin + 1, (self.y2-1)*self.ybin
+
+    def center_roi(self, xd, yd, width, height=None):
+        """
+        Set the ROI to width x height unbinned pixels centered on detector coordinates xd, yd
+
+        The ROI is shifted (not shrunk) to stay on the detector. Uses the current binning.
+        """
+        if height is None: height = width
+        nx = max(int(width)//self.xbin, 1)
+        ny = max(int(height)//self.ybin, 1)
+        xmax = self.xsize//self.xbin
+        ymax = self.ysize//self.ybin
+        nx, ny = min(nx, xmax), min(ny, ymax)
+
+        # binned pixel the center falls in (starting at 1), then the corner
+        xc = int((xd - 0.5)//self.xbin) + 1
+        yc = int((yd - 0.5)//self.ybin) + 1
+        x1 = min(max(xc - nx//2, 1), xmax - nx + 1)
+        y1 = min(max(yc - ny//2, 1), ymax - ny + 1)
+        return self.set_roi(x1, x1+nx, y1, y1+ny)
+
+    def acquire_target(self, exptime, sizes=(512, 128), start_bin=4, find=None, simulate=None, timeout=60.0):
+        """
+        Find a target fast: binned full frame first, then smaller and smaller unbinned ROIs around it
+
+        Reading a small ROI is much faster than the full frame, so each step
+        re-centers on the target with a fraction of the pixels.
+
+        exptime -- seconds per frame (a number, or one per step: the binned frame, then each ROI)
+        sizes -- widths (unbinned pixels) of the square ROIs to step through
+        start_bin -- binning for the first, full frame
+        find -- find(image, x, y) returns the target's array coordinates (x, y), or None
+                if it isn't there. x, y are where it's expected (None for the first,
+                full frame). By default, the brightest star first, then the star closest
+                to where it was.
+        simulate -- as in sequence
+
+        Returns a dictionary with the target's unbinned detector coordinates (x,
+        y, or None if it wasn't found), and steps: a list with the bin, the ROI,
+        the array coordinates of the target, and the elapsed time of each step.
+        The camera is left on the last ROI.
+        """
+        if find is None: find = _find_target
+        exptimes = list(np.broadcast_to(exptime, len(sizes)+1))
+
+        t0 = time.monotonic()
+        self.set_bin(start_bin)
+        self.set_roi(full_frame=True)
+
+        xd = yd = None
+        steps = []
+        for n, exptime in enumerate(exptimes):
+            if n > 0:
+                if n == 1: self.set_bin(1)
+                self.center_roi(xd, yd, sizes[n-1])
+
+            expected = (None, None) if xd is None else self.array_coords(xd, yd)
+            t_start = time.monotonic()
+            self._start_exposure(exptime, simulate=simulate)
+            image = self._read_image(exptime, t_start, timeout, simulate=simulate)
+            if image is None:
+                self.logger.error("Timed out waiting for the acquisition image")
+                return {'x': None, 'y': None, 'steps': steps}
+            try:
+                found = find(image, *expected)
+            finally:
+                if self.frame_pool is not None: self.frame_pool.release(image)
+
+            step = {'bin': self.xbin, 'roi': (self.x1, self.x2, self.y1, self.y2), 'found': found,
+                    'elapsed': time.monotonic() - t_start}
+            steps.append(step)
+            if found is None:
+                self.logger.error("Target not found in acquisition step " + str(n+1))
+                return {'x': None, 'y': None, 'steps': steps}
+            xd, yd = (float(v) for v in self.detector_coords(*found))
+
+        self.logger.info("Acquired target at (" + '{0:.2f}'.format(xd) + ', ' + '{0:.2f}'.format(yd) +
+                         ") in " + '{0:.2f}'.format(time.monotonic()-t0) + " s")
+        return {'x': xd, 'y': yd, 'steps': steps}
+
+    def _queue_frame(self, filename, image, hdr, overwrite=False, callback=None):
+        """
+        Hand a pooled frame to the background writer (measuring it first, if image_stats is on)
+
+        Like writer.submit, this blocks while the writer's queue is full, so a
+        slow disk holds up acquisition instead of piling frames up in memory.
+        Slow statistics never do: frames that arrive while every stats worker
+        is busy, or whose stats aren't done within the budget, are written
+        without them (see imstats.ImageStats). The frame goes back to the pool
+        once it's written (and measured). Returns a future for the write.
+        """
+        pool = self.frame_pool
+        measured = None
+        if self.image_stats is not None:
+            # measured in the stats pool while the frame waits in the write queue; the writer
+            # puts the results in the header just before writing it
+            measured = self.image_stats.submit(image, platescale=getattr(self, 'platescale', None))
+
+        def release():
+            if pool is None: return
+            # a measurement that ran over the budget may still be reading the frame
+            if measured is None or measured.done(): pool.release(image)
+            else: measured.add_done_callback(lambda future: pool.release(image))
+
+        def done(future):
+            release()
+            if callback is not None: callback(future)
+
+        header = hdr
+        if measured is not None:
+            def header():
+                try:
+                    stats = self.image_stats.result(measured)
+                    if stats is not None: imstats.add_header_keys(hdr, stats)
+                except Exception as e:
+                    self.logger.error("Could not measure " + str(filename) + ": " + str(e))
+                return hdr
+
+        try:
+            return self.writer.submit(filename, image, header=header, overwrite=overwrite, callback=done)
+        except Exception:
+            # never queued, so give the frame back
+            release()
+            raise
+
+    def _start_exposure(self, exptime, simulate=None):
+        """ start an exposure on the hardware, or a simulated one in the background """
+        if simulate is None:
+            self.expose(exptime)
+            return
+
+        self.ready = False
+        self.exptime = exptime
+        self.dateobs = datetime.datetime.utcnow()
+        kwargs = dict(simulate, exptime=exptime, wait=True)
+        self._sim_thread = threading.Thread(target=self.simulate_star_image, kwargs=kwargs, name='simexpose')
+        self._sim_thread.start()
+
+    def _read_image(self, exptime, t_start, timeout, simulate=None):
+        """ wait for the current exposure and read it into a pooled buffer (None on timeout) """
+
+        # nothing to poll for until the exposure is (almost) over
+        sleeptime = t_start + exptime - time.monotonic()
+        if sleeptime > 0: time.sleep(sleeptime)
+
+        if simulate is not None:
+            self._sim_thread.join(timeout)
+            if not self.ready: return None
+            image = self.image
+            self.image = None
+            self.ready = False
+            return image
+
+        t0 = time.monotonic()
+        while not self.image_ready:
+            if time.monotonic() - t0 > timeout: return None
+            time.sleep(0.005)
+        return self.read_image()
+
+    def _capture_header(self, exptime, filter):
+        """ snapshot the header keywords for the exposure in progress """
+        from astropy.io import fits
+        hdr = fits.Header()
+        hdr['DATE-OBS'] = (self.dateobs.strftime('%Y-%m-%dT%H:%M:%S.%f'), 'Observation start, UTC')
+        hdr['EXPTIME'] = (exptime, 'Exposure time in seconds')
+        if filter is not None:
+            hdr['FILTER'] = (filter, 'Filter name')
+
+        get_header_keys = getattr(self, 'get_header_keys', None)
+        if get_header_keys is not None:
+            try:
+                hdr = get_header_keys(hdr)
+            except Exception as e:
+                self.logger.exception("Error getting header keywords: " + str(e))
+        else:
+            hdr = self.header_snapshot.snapshot(hdr)
+        return hdr
+
+    def add_header_provider(self, name, function, max_age=None, key_max_age=None):
+        """
+        Put the keywords from function(hdr) (e.g., Dome.add_header_keys) in every frame's header
+
+        name -- used in log messages
+        max_age -- seconds the keywords are reused before asking again (default: header_max_age)
+        key_max_age -- optional dictionary of per-keyword limits that override max_age
+        """
+        if max_age is None: max_age = self.header_max_age
+        return self.header_snapshot.add_provider(name, function, max_age=max_age, key_max_age=key_max_age)
+
+    def sequence(self, steps, directory, basename='image', simulate=None, overwrite=False, timeout=60.0):
+        """
+        Take a series of exposures, overlapping everything the hardware allows
+
+        While each exposure is integrating, its header is captured in the
+        background. As soon as it's read out, the next exposure starts and the
+        frame is handed to the background writer.
+
+        steps -- a list of (exptime, filter, count); filter may be None
+        directory -- where to write the images, named basename.filter.NNNN.fits
+        simulate -- None to use the hardware, or a dictionary of arguments to
+                    simulate_star_image (x, y, flux, ...) to run the same
+                    pipeline on simulated images
+        overwrite -- overwrite existing files
+        timeout -- seconds to wait for each image after its exposure time is up
+
+        Returns a list of dictionaries, one per frame, with the filename, the
+        write future, the readout time, and the overhead (the dead time between
+        the end of that exposure and the start of the next one, in seconds)
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        frames = []
+        for exptime, filter, count in steps:
+            for i in range(int(count)):
+                frames.append((float(exptime), filter))
+        if len(frames) == 0: return []
+
+        header_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix='header')
+        stats = []
+        try:
+            current_filter = None
+            exptime, filter = frames[0]
+            if filter is not None:
+                self._set_filter(filter)
+                current_filter = filter
+            t_start = time.monotonic()
+            self._start_exposure(exptime, simulate=simulate)
+            header = header_thread.submit(self._capture_header, exptime, filter)
+
+            for n in range(len(frames)):
+                exptime, filter = frames[n]
+
+                image = self._read_image(exptime, t_start, timeout, simulate=simulate)
+                t_read = time.monotonic()
+                if image is None:
+                    self.logger.error("Timed out waiting for image " + str(n+1) + " of the sequence; aborting")
+                    break
+                hdr = header.result()
+
+                # start the next exposure before we do anything else with this one
+                if n+1 < len(frames):
+                    next_exptime, next_filter = frames[n+1]
+                    if next_filter is not None and next_filter != current_filter:
+                        self._set_filter(next_filter)
+                        current_filter = next_filter
+                    t_next = time.monotonic()
+                    self._start_exposure(next_exptime, simulate=simulate)
+                    header = header_thread.submit(self._capture_header, next_exptime, next_filter)
+
+                filename = directory / (basename + '.' + str(filter) + '.' + str(n+1).zfill(4) + '.fits')
+                future = self._queue_frame(filename, image, hdr, overwrite=overwrite)
+
+                if n+1 == len(frames):
+                    t_next = time.monotonic()
+                stats.append({'filename': str(filename),
+                              'exptime': exptime,
+                              'filter': filter,
+                              'future': future,
+                              'readout': t_read - (t_start + exptime),
+                              'overhead': t_next - (t_start + exptime)})
+                t_start = t_next
+        finally:
+            header_thread.shutdown()
+
+        if len(stats) > 0:
+            overhead = np.array([s['overhead'] for s in stats])
+            self.logger.info("Took " + str(len(stats)) + " images; overhead per frame " +
+                             '{0:.4f}'.format(np.mean(overhead)) + " s (mean), " +
+                             '{0:.4f}'.format(np.max(overhead)) + " s (max)")
+        return stats
+
+    @property
+    def video_running(self):
+        return self._video_thread is not None and self._video_thread.is_alive()
+
+    def start_video(self, exptime, nframes=None, simulate=None, timeout=10.0):
+        """
+        Expose continuously into a ring buffer until stop_video is called
+
+        Each frame is read straight into the next slot of a ring of nframes
+        preallocated frames (video_frames in the config); when it's full the
+        oldest frame is overwritten. Acquisition never waits for consumers.
+        Read frames with the ring's latest() or window(), or ring.reader() to
+        see every frame in order (and count the ones you missed).
+
+        exptime -- seconds per frame
+        simulate -- None to use the hardware, or a dictionary of arguments to
+                    simulate_star_image (as in sequence)
+        timeout -- seconds to wait for each frame after its exposure time is up
+
+        Returns the ringbuffer.FrameRing
+        """
+        self.stop_video()
+        if nframes is None: nframes = self.video_frames
+
+        shape = (self.y2-self.y1, self.x2-self.x1)
+        if self.video_ring is None or not self.video_ring.matches(shape, self.frame_dtype) or \
+           self.video_ring.nframes != nframes:
+            self.logger.debug("Allocating a " + str(nframes) + " frame video ring for " + str(shape) + " frames")
+            self.video_ring = ringbuffer.FrameRing(shape, dtype=self.frame_dtype, nframes=nframes)
+
+        self.video_missed = 0
+        self._video_stop.clear()
+        self._video_thread = threading.Thread(target=self._video_loop, args=(self.video_ring, exptime, simulate, timeout),
+                                              name='video', daemon=True)
+        self._video_thread.start()
+        return self.video_ring
+
+    def stop_video(self):
+        """ stop video mode (after the frame in progress); the ring keeps the last frames """
+        if self._video_thread is None: return
+        self._video_stop.set()
+        self._video_thread.join()
+        self._video_thread = None
+        ring = self.video_ring
+        self.logger.info("Video stopped after " + str(ring.nwritten) + " frames (" + str(ring.ndropped) +
+                         " overwritten unread, " + str(self.video_missed) + " missed)")
+
+    def _video_loop(self, ring, exptime, simulate, timeout):
+        while not self._video_stop.is_set():
+            t_start = time.monotonic()
+            timestamp = time.time()
+            try:
+                self._start_exposure(exptime, simulate=simulate)
+                image = self._read_image(exptime, t_start, timeout, simulate=simulate)
+            except Exception as e:
+                self.logger.exception("Error taking video frame; stopping video: " + str(e))
+                break
+
+            if image is None:
+                self.video_missed += 1
+                self.logger.warning("Timed out waiting for video frame " + str(ring.head))
+                continue
+
+            # normally the frame was read straight into the ring; otherwise copy it in
+            slot = ring.claim()
+            ring.commit(image, timestamp=timestamp)
+            if image is not slot and self.frame_pool is not None:
+                self.frame_pool.release(image)
+
+    def start_coadd(self, exptime, directory, nstack=None, interval=None, method='xcorr', basename='stack',
+                    simulate=None, overwrite=False):
+        """
+        Take video and write shift-and-add stacks instead of every frame
+
+        Frames are registered and summed in place as they arrive (see
+        coadd.ShiftAndAdd); every nstack frames or interval seconds the
+        stack is handed to the background writer as basename.NNNN.fits
+
+        exptime -- seconds per frame
+        method -- 'xcorr' (cross-correlate whole frames) or 'centroid' (track the brightest star)
+        simulate -- as in start_video
+
+        Returns the coadd.ShiftAndAdd; stop with stop_coadd
+        """
+        self.stop_coadd()
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        def write(stack):
+            hdr = self._capture_header(exptime*stack['nframes'], None)
+            dateobs = datetime.datetime.utcfromtimestamp(stack['tstart'])
+            hdr['DATE-OBS'] = (dateobs.strftime('%Y-%m-%dT%H:%M:%S.%f'), 'Start of the first frame, UTC')
+            hdr['EXPTIME'] = (exptime*stack['nframes'], 'Total exposure time in seconds')
+            hdr['NCOMBINE'] = (stack['nframes'], 'Number of frames stacked')
+            hdr['FRAMTIME'] = (exptime, 'Exposure time of each frame in seconds')
+            hdr['COADDREG'] = (method, 'Frame registration method')
+            filename = directory / (basename + '.' + str(self.coadder.nstacks).zfill(4) + '.fits')
+            self.writer.submit(filename, stack['image'], header=hdr, overwrite=overwrite)
+
+        ring = self.start_video(exptime, simulate=simulate)
+        self.coadder = coadd.ShiftAndAdd(ring.shape, nstack=nstack, interval=interval, method=method, callback=write)
+        self.coadder.follow(ring)
+        return self.coadder
+
+    def stop_coadd(self):
+        """ stop the video and write the last (partial) stack, with every frame taken """
+        if self.coadder is None: return
+        self.stop_video()
+        self.coadder.stop(flush=True)
+        self.logger.info("Stacked " + str(self.coadder.nframes_total) + " frames into " +
+                         str(self.coadder.nstacks) + " images")
+        self.coadder = None
+
+    def _set_filter(self, filter):
+        filterwheel = getattr(self, 'filterwheel', None)
+        if filterwheel is None:
+            self.logger.warning("No filter wheel; cannot change to filter " + str(filter))
             return False
+        moved = filterwheel.move(filter)
+
+        # move to the predicted focus for the new filter (see focusmodel.FocusPredictor)
+        if moved is not False and self.focus_model is not None:
+            self.focus_model.set_filter(filter)
+        return moved
+
+    def cool(self, temp=None, wait=False, settleTime=1200.0, oscillationTime=120.0, maxdiff = 1.0, interval=None):
+        """
+        Turn on the cooler (and change the set point to temp, if given)
+
+        A background thermal.CoolingMonitor samples the temperature every
+        interval seconds (cooling_interval in the config) and decides the CCD
+        has settled once it has stayed within maxdiff of the set point for
+        oscillationTime seconds. It gives up after settleTime seconds.
+
+        If wait is True, returns whether the CCD settled (True or False), as
+        before. Otherwise returns a concurrent.futures.Future that resolves to
+        it, so other startup tasks can run while the camera cools (if the
+        camera can't cool, it's already resolved to False).
+        The HAL supplies can_set_temperature, start_cooling, temperature, and set_temperature.
+        """
+        if not self.can_set_temperature:
+            self.logger.error("Camera does not support cooling")
+            if wait: return False
+            settled = Future()
+            settled.set_result(False)
+            return settled
+
+        self.start_cooling(temp)
+
+        if interval is None: interval = self.cooling_interval
+        if self.cooling_monitor is not None: self.cooling_monitor.stop()
+        self.cooling_monitor = thermal.CoolingMonitor(lambda: self.temperature, self.set_temperature,
+                                                      interval=interval, window=oscillationTime,
+                                                      maxdiff=maxdiff, timeout=settleTime)
+        settled = self.cooling_monitor.start()
+
+        if wait: return settled.result()
+        return settled
+
+    def shutdown(self, wait=True):
+        """
+        Stop the background work and release its threads and processes
+
+        Stops video and coadding, stops following the writer and shuts down
+        the quick-look worker processes, then finishes the queued writes (if
+        wait) and stops the writer, stats, header, cooling monitor, and noise threads.
+        """
+        self.stop_coadd()
+        self.stop_video()
+        if self.quicklook is not None:
+            self.quicklook.unwatch(self.writer)
+            self.quicklook.close(wait=wait)
+        self.writer.close(wait=wait)
+        if self.image_stats is not None:
+            self.image_stats.close()
+        self.header_snapshot.close()
+        if self.cooling_monitor is not None:
+            self.cooling_monitor.stop()
+        if self._sim_noise is not None:
+            self._sim_noise.close()
+            self._sim_noise = None
+
+
+def _find_target(image, x=None, y=None):
+    """ the brightest star, or if x, y are given, the star closest to them (array coordinates) """
+    sources = imstats.detect(image, maxsources=50)
+    if len(sources) == 0: return None
+    if x is None:
+        best = np.argmax(sources['flux'])
+    else:
+        best = np.argmin((sources['x']-x)**2 + (sources['y']-y)**2)
+    return sources['x'][best], sources['y'][best]
 
-        return True
 
 def load_camera(config_file):
     with open(config_file) as f:
@@ -194,17 +761,33 @@ def load_camera(config_file):
 
         def get_header_keys(self,hdr=None):
 
+            from astropy.io import fits
             if hdr is None: hdr = fits.Header()
             hdr['DATE-OBS'] = (self.dateobs.strftime('%Y-%m-%dT%H:%M:%S.%f'), 'Observation start, UTC')
             hdr['EXPTIME'] = (self.exptime, 'Exposure time in seconds')
             hdr['CCDSUM'] = (str(self.xbin) + ' ' + str(self.ybin), 'CCD on-chip binning')
-            datasec = '[' + str(self.x1) + ':' + str(self.x2) + ',' + str(self.y1) + ':' + str(self.y2) + ']'
-            hdr['DATASEC'] = (datasec, 'Region of CCD read')
+            # the ROI in binned pixels (x2 and y2 are exclusive; FITS sections are inclusive)
+            datasec = '[' + str(self.x1) + ':' + str(self.x2-1) + ',' + str(self.y1) + ':' + str(self.y2-1) + ']'
+            hdr['DATASEC'] = (datasec, 'Region of CCD read (binned, inclusive)')
+
+            # where the ROI is on the detector (unbinned pixels), so pixel coordinates
+            # agree between frames with different ROIs and binning
+            xd1, xd2, yd1, yd2 = self.detector_section()
+            hdr['DETSEC'] = ('[' + str(xd1) + ':' + str(xd2) + ',' + str(yd1) + ':' + str(yd2) + ']',
+                             'Region of CCD read (unbinned, inclusive)')
+            # image = LTM*detector + LTV (IRAF physical coordinates)
+            hdr['LTV1'] = (0.5*(self.xbin-1)/self.xbin - (self.x1-1), 'Detector to image x offset')
+            hdr['LTV2'] = (0.5*(self.ybin-1)/self.ybin - (self.y1-1), 'Detector to image y offset')
+            hdr['LTM1_1'] = (1.0/self.xbin, 'Image to detector x scale (1/binning)')
+            hdr['LTM2_2'] = (1.0/self.ybin, 'Image to detector y scale (1/binning)')
             hdr['CCDTEMP'] = (self.temperature, 'CCD Temperature (C)')
             hdr['SETTEMP'] = (self.set_temperature, 'CCD Set Temperature (C)')
 
-            # now get hardward-specific header keywords
-            hdr = self._hal.get_header_keys(hdr)
-            return hdr
+            # now get hardware-specific header keywords, from this camera (the one that's
+            # exposing and focusing), not the separate _hal instance
+            hdr = hal_class.get_header_keys(self, hdr)
+
+            # and the keywords from the other devices
+            return self.header_snapshot.snapshot(hdr)
 
     return Camera()
@@ -0,0 +1,262 @@
+import argparse
+import logging
+import math
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+import yaml
+
+"""
+A local, tiled star catalog that answers cone and box queries from disk
+
+The sky is cut into declination bands of height ~tilesize, and each band is cut
+into RA cells of roughly the same width on the sky (an equal-area-ish tiling
+like HEALPix, but with no extra dependencies). Each tile is a .npy file of
+(ra, dec, mag) sorted brightest first, which is memory-mapped on first use and
+kept in an in-process LRU.
+
+Build one from a pre-downloaded Gaia extract (anything astropy.table can read):
+python -m robofast.catalog --input gaia.fits --output /data/gaia_tiles
+or a synthetic one for testing:
+python -m robofast.catalog --synthetic 1000000 --output /data/fake_tiles
+"""
+
+STAR_DTYPE = np.dtype([('ra', np.float64), ('dec', np.float64), ('mag', np.float32)])
+
+# column names tried (in order) when reading an extract
+RA_COLUMNS = ('RA_ICRS', 'ra', 'RAJ2000', 'RA')
+DEC_COLUMNS = ('DE_ICRS', 'dec', 'DEJ2000', 'DEC')
+MAG_COLUMNS = ('Gmag', 'phot_g_mean_mag', '__Gmag_', 'mag')
+
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """ angular separation (deg) between points given in degrees (haversine; fine at small separations) """
+    ra1, dec1, ra2, dec2 = (np.radians(a) for a in (ra1, dec1, ra2, dec2))
+    sindra = np.sin(0.5*(ra2-ra1))
+    sinddec = np.sin(0.5*(dec2-dec1))
+    a = sinddec**2 + np.cos(dec1)*np.cos(dec2)*sindra**2
+    return np.degrees(2.0*np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0))))
+
+
+def project(ra, dec, ra0, dec0):
+    """
+    Gnomonic (tangent plane) projection about (ra0, dec0)
+
+    Returns xi (toward east) and eta (toward north), in degrees
+    """
+    ra, dec = np.radians(ra), np.radians(dec)
+    ra0, dec0 = math.radians(ra0), math.radians(dec0)
+    cosc = math.sin(dec0)*np.sin(dec) + math.cos(dec0)*np.cos(dec)*np.cos(ra-ra0)
+    xi = np.cos(dec)*np.sin(ra-ra0)/cosc
+    eta = (math.cos(dec0)*np.sin(dec) - math.sin(dec0)*np.cos(dec)*np.cos(ra-ra0))/cosc
+    return np.degrees(xi), np.degrees(eta)
+
+
+class Tiling:
+    """ maps positions on the sky to (band, cell) tiles """
+
+    def __init__(self, tilesize=1.0):
+        self.tilesize = float(tilesize)
+        self.nbands = int(math.ceil(180.0/self.tilesize))
+        self.bandheight = 180.0/self.nbands
+
+        # cells in each band, so each cell is at most ~tilesize wide on the sky
+        self.ncells = np.empty(self.nbands, dtype=np.int64)
+        for band in range(self.nbands):
+            dlo = -90.0 + band*self.bandheight
+            dhi = dlo + self.bandheight
+            widest = 0.0 if dlo <= 0.0 <= dhi else min(abs(dlo), abs(dhi))
+            self.ncells[band] = max(1, int(math.ceil(360.0*math.cos(math.radians(widest))/self.bandheight)))
+
+    def band(self, dec):
+        return np.clip(np.floor((np.asarray(dec) + 90.0)/self.bandheight).astype(np.int64), 0, self.nbands-1)
+
+    def tile(self, ra, dec):
+        """ (band, cell) of each position """
+        band = self.band(dec)
+        ncells = self.ncells[band]
+        cell = np.floor(np.mod(ra, 360.0)/360.0*ncells).astype(np.int64) % ncells
+        return band, cell
+
+    def cone_tiles(self, ra, dec, radius):
+        """ all tiles that overlap a cone """
+        tiles = []
+        for band in range(int(self.band(max(dec-radius, -90.0))), int(self.band(min(dec+radius, 90.0)))+1):
+            ncells = int(self.ncells[band])
+            sinr = math.sin(math.radians(radius))
+            cosd = math.cos(math.radians(dec))
+            if dec + radius >= 90.0 or dec - radius <= -90.0 or sinr >= cosd:
+                # the cone contains a pole, so it spans all RAs
+                cells = range(ncells)
+            else:
+                dra = math.degrees(math.asin(sinr/cosd))
+                c1 = int(math.floor((ra - dra)/360.0*ncells))
+                c2 = int(math.floor((ra + dra)/360.0*ncells))
+                cells = sorted(set(c % ncells for c in range(c1, c2+1)))
+            tiles.extend((band, cell) for cell in cells)
+        return tiles
+
+
+class StarCatalog:
+    """
+    Read-only access to a tiled catalog built by StarCatalog.build
+
+    Parameters
+    ----------
+    directory : str or Path
+        Directory containing index.yaml and the tiles.
+    cache_size : int
+        Number of memory-mapped tiles to keep open.
+    """
+
+    def __init__(self, directory, cache_size=256):
+        self.logger = logging.getLogger()
+        self.directory = Path(directory)
+
+        with open(self.directory / 'index.yaml') as f:
+            self.index = yaml.safe_load(f)
+
+        self.tiling = Tiling(self.index['tilesize'])
+        self.cache_size = cache_size
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def tile_name(band, cell):
+        return '%03d_%05d.npy' % (band, cell)
+
+    @classmethod
+    def build(cls, directory, ra, dec, mag, tilesize=1.0, source=''):
+        """ split (ra, dec, mag) arrays into tiles in directory, and return the catalog """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        tiling = Tiling(tilesize)
+
+        stars = np.empty(len(ra), dtype=STAR_DTYPE)
+        stars['ra'] = np.mod(ra, 360.0)
+        stars['dec'] = dec
+        stars['mag'] = mag
+
+        band, cell = tiling.tile(stars['ra'], stars['dec'])
+        tileid = band*(int(tiling.ncells.max())+1) + cell
+
+        # group by tile, brightest first within each tile
+        order = np.lexsort((stars['mag'], tileid))
+        stars = stars[order]
+        band = band[order]
+        cell = cell[order]
+        starts = np.flatnonzero(np.r_[True, np.diff(tileid[order]) != 0])
+        ends = np.r_[starts[1:], len(stars)]
+
+        for start, end in zip(starts, ends):
+            np.save(directory / cls.tile_name(band[start], cell[start]), stars[start:end])
+
+        index = {'tilesize': float(tilesize),
+                 'nstars': int(len(stars)),
+                 'ntiles': int(len(starts)),
+                 'source': str(source)}
+        with open(directory / 'index.yaml', 'w') as f:
+            yaml.safe_dump(index, f)
+
+        return cls(directory)
+
+    @classmethod
+    def build_from_file(cls, filename, directory, tilesize=1.0):
+        """ build a catalog from a pre-downloaded extract (FITS, CSV, ECSV, ...) """
+        from astropy.table import Table
+
+        table = Table.read(filename)
+        columns = []
+        for candidates in (RA_COLUMNS, DEC_COLUMNS, MAG_COLUMNS):
+            name = next((c for c in candidates if c in table.colnames), None)
+            if name is None:
+                raise ValueError("None of " + str(candidates) + " found in " + str(filename))
+            columns.append(np.asarray(table[name], dtype=np.float64))
+
+        ra, dec, mag = columns
+        good = np.isfinite(ra) & np.isfinite(dec) & np.isfinite(mag)
+        return cls.build(directory, ra[good], dec[good], mag[good], tilesize=tilesize, source=Path(filename).name)
+
+    def _load(self, band, cell):
+        key = (band, cell)
+        with self._lock:
+            stars = self._tiles.get(key)
+            if stars is not None:
+                self._tiles.move_to_end(key)
+                return stars
+
+        filename = self.directory / self.tile_name(band, cell)
+        if filename.exists():
+            stars = np.load(filename, mmap_mode='r')
+        else:
+            stars = np.empty(0, dtype=STAR_DTYPE)
+
+        with self._lock:
+            self._tiles[key] = stars
+            while len(self._tiles) > self.cache_size:
+                self._tiles.popitem(last=False)
+        return stars
+
+    def _gather(self, ra, dec, radius):
+        tiles = [self._load(band, cell) for band, cell in self.tiling.cone_tiles(ra, dec, radius)]
+        tiles = [t for t in tiles if len(t) > 0]
+        if len(tiles) == 0:
+            return np.empty(0, dtype=STAR_DTYPE)
+        return np.concatenate(tiles)
+
+    def cone(self, ra, dec, radius, maglimit=None):
+        """ all stars within radius (deg) of (ra, dec), brightest first """
+        stars = self._gather(ra, dec, radius)
+        keep = angular_separation(ra, dec, stars['ra'], stars['dec']) <= radius
+        if maglimit is not None:
+            keep &= stars['mag'] <= maglimit
+        stars = stars[keep]
+        return stars[np.argsort(stars['mag'], kind='stable')]
+
+    def box(self, ra, dec, width, height, maglimit=None):
+        """ all stars in a width x height (deg) field centered at (ra, dec), brightest first """
+        radius = 0.5*math.hypot(width, height)
+        stars = self._gather(ra, dec, radius)
+        keep = angular_separation(ra, dec, stars['ra'], stars['dec']) <= min(radius, 89.0)
+        xi, eta = project(stars['ra'], stars['dec'], ra, dec)
+        keep &= (np.abs(xi) <= 0.5*width) & (np.abs(eta) <= 0.5*height)
+        if maglimit is not None:
+            keep &= stars['mag'] <= maglimit
+        stars = stars[keep]
+        return stars[np.argsort(stars['mag'], kind='stable')]
+
+
+def synthetic_stars(nstars, seed=None, magmin=6.0, magmax=20.0):
+    """
+    Random (ra, dec, mag) uniformly distributed on the sky
+
+    Magnitudes follow log10(N(<m)) ~ 0.3m, roughly like real star counts
+    """
+    rng = np.random.default_rng(seed)
+    ra = rng.uniform(0.0, 360.0, nstars)
+    dec = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, nstars)))
+    slope = 0.3*math.log(10.0)
+    u = rng.uniform(0.0, 1.0, nstars)
+    mag = magmax + np.log(u + (1.0-u)*math.exp(-slope*(magmax-magmin)))/slope
+    return ra, dec, mag
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a tiled star catalog for offline use')
+    parser.add_argument('--output', required=True, help='Directory to write the tiles to')
+    parser.add_argument('--input', default=None, help='Catalog extract to tile (anything astropy.table can read)')
+    parser.add_argument('--synthetic', type=int, default=0, help='Build a synthetic catalog with this many stars instead')
+    parser.add_argument('--tilesize', type=float, default=1.0, help='Approximate tile size (deg)')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for the synthetic catalog')
+    opt = parser.parse_args()
+
+    if opt.input is not None:
+        cat = StarCatalog.build_from_file(opt.input, opt.output, tilesize=opt.tilesize)
+    elif opt.synthetic > 0:
+        ra, dec, mag = synthetic_stars(opt.synthetic, seed=opt.seed)
+        cat = StarCatalog.build(opt.output, ra, dec, mag, tilesize=opt.tilesize, source='synthetic')
+    else:
+        parser.error('one of --input or --synthetic is required')
+
+    print('Wrote ' + str(cat.index['nstars']) + ' stars in ' + str(cat.index['ntiles']) + ' tiles to ' + str(opt.output))
@@ -0,0 +1,252 @@
+import logging
+import threading
+import time
+import numpy as np
+
+"""
+Streaming shift-and-add co-addition of high-cadence frames
+
+Each frame is registered to a reference frame (by FFT cross-correlation or by
+centroiding the brightest star), shifted by a whole number of pixels, and
+added in place to a running float32 sum. Every nstack frames (or interval
+seconds) the stack is emitted and the sum starts over. Only the sum, its
+coverage, and the reference are kept, so memory doesn't grow with the number
+of frames, and only the stacks need to be written to disk.
+"""
+
+
+def _boxsum3(image):
+    """ 3x3 box sum (edges excluded), to find the brightest star without tripping on hot pixels """
+    s = image[:-2] + image[1:-1] + image[2:]
+    return s[:, :-2] + s[:, 1:-1] + s[:, 2:]
+
+
+def _parabolic_peak(cm, c0, cp):
+    """ sub-pixel offset of a peak from three samples around it """
+    denom = cm - 2.0*c0 + cp
+    if denom == 0: return 0.0
+    return 0.5*(cm - cp)/denom
+
+
+class ShiftAndAdd:
+    """
+    Parameters
+    ----------
+    shape : tuple
+        (ny, nx) of the frames.
+    nstack : int
+        Emit a stack every nstack frames (None for no limit).
+    interval : float
+        Emit a stack once it spans interval seconds (None for no limit).
+    method : str
+        'xcorr' to register whole frames by FFT cross-correlation, or
+        'centroid' to track the brightest star in the reference frame.
+    box : int
+        Half width (pixels) of the box the star is tracked in ('centroid').
+    callback : function
+        callback(stack) is called with every stack (see emit).
+    """
+
+    methods = ('xcorr', 'centroid')
+
+    def __init__(self, shape, nstack=None, interval=None, method='xcorr', box=15, callback=None):
+        self.logger = logging.getLogger()
+        if method not in self.methods:
+            raise ValueError("Unknown registration method (" + str(method) + "); must be one of " + str(self.methods))
+        if nstack is None and interval is None:
+            raise ValueError("Need nstack or interval to know when to emit a stack")
+
+        self.shape = tuple(int(n) for n in shape)
+        self.nstack = nstack
+        self.interval = interval
+        self.method = method
+        self.box = int(box)
+        self.callback = callback
+
+        self.sum = np.zeros(self.shape, dtype=np.float32)
+        self.coverage = np.zeros(self.shape, dtype=np.uint32)
+        self._work = np.empty(self.shape, dtype=np.float32)
+
+        # the reference is kept across stacks, so the stacks are aligned to each other too
+        self._ref_fft = None
+        self._ref_star = None
+        self._last_star = None
+
+        self.nstacks = 0
+        self.nframes_total = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._drain = False
+        self.reset()
+
+    def reset(self, reference=False):
+        """ start a new stack (and pick a new reference frame if reference is True) """
+        self.sum.fill(0.0)
+        self.coverage.fill(0)
+        self.nframes = 0
+        self.tstart = None
+        self.tend = None
+        self.shifts = []
+        if reference:
+            self._ref_fft = None
+            self._ref_star = None
+            self._last_star = None
+
+    ################## REGISTRATION ##################
+    def _centered(self, frame):
+        np.copyto(self._work, frame, casting='unsafe')
+        self._work -= self._work.mean()
+        return self._work
+
+    def _shift_xcorr(self, frame):
+        f = np.fft.rfft2(self._centered(frame))
+        if self._ref_fft is None:
+            self._ref_fft = np.conj(f)
+            return 0.0, 0.0
+
+        cc = np.fft.irfft2(f*self._ref_fft, s=self.shape)
+        ny, nx = self.shape
+        iy, ix = np.unravel_index(np.argmax(cc), cc.shape)
+        dy = iy + _parabolic_peak(cc[iy-1, ix], cc[iy, ix], cc[(iy+1) % ny, ix])
+        dx = ix + _parabolic_peak(cc[iy, ix-1], cc[iy, ix], cc[iy, (ix+1) % nx])
+        # the correlation wraps around; shifts past halfway are negative
+        if dy > ny/2: dy -= ny
+        if dx > nx/2: dx -= nx
+        return dx, dy
+
+    def _centroid(self, frame, x0, y0):
+        ny, nx = self.shape
+        xlo, xhi = max(int(x0)-self.box, 0), min(int(x0)+self.box+1, nx)
+        ylo, yhi = max(int(y0)-self.box, 0), min(int(y0)+self.box+1, ny)
+        stamp = np.asarray(frame[ylo:yhi, xlo:xhi], dtype=np.float32)
+        stamp = stamp - np.median(stamp)
+        np.clip(stamp, 0, None, out=stamp)
+        total = stamp.sum()
+        if total <= 0: return None
+        x = (stamp.sum(axis=0)*np.arange(xlo, xhi)).sum()/total
+        y = (stamp.sum(axis=1)*np.arange(ylo, yhi)).sum()/total
+        return x, y
+
+    def _shift_centroid(self, frame):
+        if self._ref_star is None:
+            smooth = _boxsum3(np.asarray(frame, dtype=np.float32))
+            iy, ix = np.unravel_index(np.argmax(smooth), smooth.shape)
+            star = self._centroid(frame, ix+1, iy+1)
+            if star is None: return None
+            self._ref_star = self._last_star = star
+            return 0.0, 0.0
+
+        # look where we saw it last
+        star = self._centroid(frame, *self._last_star)
+        if star is None: return None
+        self._last_star = star
+        return star[0] - self._ref_star[0], star[1] - self._ref_star[1]
+
+    def measure_shift(self, frame):
+        """ (dx, dy) of frame relative to the reference (the first frame), or None if it can't be registered """
+        if self.method == 'centroid':
+            return self._shift_centroid(frame)
+        return self._shift_xcorr(frame)
+
+    ################## STACKING ##################
+    def add(self, frame, timestamp=None):
+        """
+        Register frame and add it to the stack, in place
+
+        Returns the stack if this frame completed one (see emit), otherwise None
+        """
+        if timestamp is None: timestamp = time.time()
+        shift = self.measure_shift(frame)
+        if shift is None:
+            self.logger.warning("Could not register frame; skipping it")
+            return None
+        dx, dy = shift
+        sx, sy = int(round(dx)), int(round(dy))
+
+        # sum[y, x] += frame[y+sy, x+sx] where both are on the detector
+        ny, nx = self.shape
+        if abs(sx) < nx and abs(sy) < ny:
+            dst = (slice(max(-sy, 0), ny - max(sy, 0)), slice(max(-sx, 0), nx - max(sx, 0)))
+            src = (slice(max(sy, 0), ny + min(sy, 0)), slice(max(sx, 0), nx + min(sx, 0)))
+            np.add(self.sum[dst], frame[src], out=self.sum[dst], casting='unsafe')
+            self.coverage[dst] += 1
+
+        if self.tstart is None: self.tstart = timestamp
+        self.tend = timestamp
+        self.nframes += 1
+        self.nframes_total += 1
+        self.shifts.append((dx, dy))
+
+        if (self.nstack is not None and self.nframes >= self.nstack) or \
+           (self.interval is not None and self.tend - self.tstart >= self.interval):
+            return self.emit()
+        return None
+
+    def emit(self):
+        """
+        Finish the current stack and start a new one
+
+        Returns a dictionary with the stacked image (the sum, scaled up where
+        shifts left fewer than nframes frames), the coverage (frames per pixel),
+        nframes, tstart/tend (timestamps of the first and last frames), and the
+        (dx, dy) shift of each frame. Also passes it to the callback.
+        """
+        if self.nframes == 0: return None
+
+        image = np.zeros(self.shape, dtype=np.float32)
+        covered = self.coverage > 0
+        image[covered] = self.sum[covered]*(self.nframes/self.coverage[covered])
+        stack = {'image': image,
+                 'coverage': self.coverage.copy(),
+                 'nframes': self.nframes,
+                 'tstart': self.tstart,
+                 'tend': self.tend,
+                 'shifts': np.array(self.shifts)}
+        self.nstacks += 1
+        self.reset()
+
+        if self.callback is not None:
+            try:
+                self.callback(stack)
+            except Exception as e:
+                self.logger.exception("Error in co-add callback: " + str(e))
+        return stack
+
+    ################## STREAMING ##################
+    def follow(self, ring):
+        """ stack frames from a ringbuffer.FrameRing in a background thread until stop() """
+        self._stop.clear()
+        self._drain = False
+        self._thread = threading.Thread(target=self._run, args=(ring.reader(),), name='coadd', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def _run(self, reader):
+        while not self._stop.is_set():
+            frame, seq, timestamp = reader.next(timeout=0.1)
+            if frame is None: continue
+            self.add(frame, timestamp=timestamp)
+            if not reader.ring.valid(seq):
+                self.logger.warning("Frame " + str(seq) + " was overwritten while it was being stacked")
+        # stopped with flush: stack the frames that came in before the stop, too
+        while self._drain:
+            frame, seq, timestamp = reader.next(timeout=0)
+            if frame is None: break
+            self.add(frame, timestamp=timestamp)
+        if reader.dropped > 0:
+            self.logger.warning("Co-add fell behind and skipped " + str(reader.dropped) + " frames")
+
+    def stop(self, flush=True):
+        """
+        stop following the ring, and emit what's left in the stack if flush is True
+
+        With flush, the frames still unread in the ring are stacked first
+        """
+        self._drain = flush
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if flush:
+            return self.emit()
+        return None
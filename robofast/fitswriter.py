@@ -0,0 +1,227 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+"""
+Writes FITS files in the background so the camera can start the next exposure
+
+Frames go into a bounded queue that a small pool of worker threads drains. If
+the disk falls behind and the queue fills up, submit() blocks (backpressure)
+instead of letting frames pile up in memory. Every submit() returns a Future
+that resolves to the filename once it's on disk (or raises the error), and
+callbacks can be attached to it.
+
+Frames can optionally be tile compressed (Rice for integer frames; float frames
+are quantized first). Compression happens in the workers, never on the
+control thread.
+
+Other code can follow the frames as they land on disk (e.g., quicklook.QuickLook)
+by adding functions to listeners; each is called as listener(filename, header)
+from the writer thread, so it must return quickly.
+"""
+
+# compression names allowed in the camera config -> FITS ZCMPTYPE
+COMPRESSION_TYPES = {'rice': 'RICE_1',
+                     'gzip': 'GZIP_1',
+                     'gzip2': 'GZIP_2',
+                     'hcompress': 'HCOMPRESS_1',
+                     'plio': 'PLIO_1'}
+
+
+class WriteJob:
+
+    def __init__(self, filename, data, header, overwrite):
+        self.filename = str(filename)
+        self.data = data
+        self.header = header
+        self.overwrite = overwrite
+        self.future = Future()
+        self.queued = time.monotonic()
+
+
+class FitsWriter:
+    """
+    Parameters
+    ----------
+    nworkers : int
+        Number of writer threads.
+    maxqueue : int
+        Maximum number of frames waiting to be written before submit() blocks.
+    compression : str
+        None (or 'none') to write uncompressed frames, or one of
+        COMPRESSION_TYPES to tile compress them.
+    quantize_level : float
+        For float frames, the quantization step as a fraction of the noise
+        (larger keeps more bits). 0 disables quantization, which is lossless
+        but only works with gzip.
+    """
+
+    def __init__(self, nworkers=2, maxqueue=4, compression=None, quantize_level=16.0):
+        self.logger = logging.getLogger()
+
+        if compression is not None and str(compression).lower() == 'none':
+            compression = None
+        if compression is not None and compression not in COMPRESSION_TYPES:
+            raise ValueError("Unknown compression (" + str(compression) + "); must be one of " +
+                             str(sorted(COMPRESSION_TYPES)) + " or none")
+        self.compression = compression
+        self.quantize_level = float(quantize_level)
+
+        self.nworkers = max(int(nworkers), 1)
+        self.maxqueue = max(int(maxqueue), 1)
+        self._queue = queue.Queue(maxsize=self.maxqueue)
+
+        # statistics, for monitoring the duty cycle
+        self.nwritten = 0
+        self.nfailed = 0
+        self.nbytes = 0
+        self.nbytes_written = 0
+        self.write_time = 0.0
+        self.blocked_time = 0.0
+        self._stats_lock = threading.Lock()
+
+        # called as listener(filename, header) after every frame is written
+        self.listeners = []
+
+        self._closed = False
+        self._workers = []
+        for i in range(self.nworkers):
+            worker = threading.Thread(target=self._run, name='fitswriter-' + str(i), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        # don't lose queued frames when python exits
+        atexit.register(self.close)
+
+    def submit(self, filename, data, header=None, overwrite=False, callback=None, timeout=None):
+        """
+        Queue a frame to be written to filename
+
+        The writer takes ownership of data and header: the caller must not modify
+        them after this call. header may also be a function that returns it,
+        called by the writer thread just before the frame is written (e.g., to
+        wait for keywords measured in the background). Blocks while the queue
+        is full (up to timeout seconds, forever if None).
+
+        Returns a concurrent.futures.Future that resolves to the filename once
+        it's written. callback(future) is called when it completes or fails.
+        """
+        if self._closed:
+            raise RuntimeError("FitsWriter is closed")
+
+        job = WriteJob(filename, data, header, overwrite)
+        if callback is not None:
+            job.future.add_done_callback(callback)
+
+        t0 = time.monotonic()
+        try:
+            self._queue.put(job, timeout=timeout)
+        except queue.Full:
+            self.logger.error("Timed out waiting to queue " + job.filename + "; disk is falling behind")
+            job.future.set_exception(TimeoutError("write queue full"))
+            return job.future
+
+        blocked = time.monotonic() - t0
+        if blocked > 0.01:
+            self.logger.warning("Waited " + '{0:.3f}'.format(blocked) + " s to queue " + job.filename + "; disk is falling behind")
+        with self._stats_lock:
+            self.blocked_time += blocked
+
+        return job.future
+
+    @property
+    def pending(self):
+        """ number of frames waiting to be written (approximate) """
+        return self._queue.qsize()
+
+    def _write(self, job):
+        """ write one frame; done in a worker thread """
+        if not job.overwrite and os.path.exists(job.filename):
+            raise OSError("File " + job.filename + " already exists")
+
+        from astropy.io import fits
+        if callable(job.header):
+            job.header = job.header()
+        header = job.header
+        if header is not None and not isinstance(header, fits.Header):
+            # a dictionary of values or (value, comment) tuples, like TelescopeBase.header
+            header = fits.Header()
+            for key, value in job.header.items():
+                header[key] = value
+
+        if self.compression is None:
+            hdul = fits.PrimaryHDU(job.data, header=header)
+        else:
+            hdu = fits.CompImageHDU(job.data, header=header,
+                                    compression_type=COMPRESSION_TYPES[self.compression],
+                                    quantize_level=self.quantize_level)
+            hdul = fits.HDUList([fits.PrimaryHDU(), hdu])
+
+        # write to a temporary name and rename, so nothing downstream sees a partial file
+        tmpname = job.filename + '.part'
+        try:
+            hdul.writeto(tmpname, overwrite=True)
+            os.replace(tmpname, job.filename)
+        except Exception:
+            # don't leave the partial file behind
+            if os.path.exists(tmpname): os.remove(tmpname)
+            raise
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+
+            if not job.future.set_running_or_notify_cancel():
+                self._queue.task_done()
+                continue
+
+            t0 = time.monotonic()
+            try:
+                self._write(job)
+            except Exception as e:
+                self.logger.exception("Failed to write " + job.filename + ": " + str(e))
+                with self._stats_lock:
+                    self.nfailed += 1
+                job.data = None
+                job.future.set_exception(e)
+            else:
+                elapsed = time.monotonic() - t0
+                self.logger.debug("Wrote " + job.filename + " in " + '{0:.3f}'.format(elapsed) +
+                                  " s (" + '{0:.3f}'.format(time.monotonic()-job.queued) + " s after it was queued)")
+                with self._stats_lock:
+                    self.nwritten += 1
+                    self.nbytes += getattr(job.data, 'nbytes', 0)
+                    self.nbytes_written += os.path.getsize(job.filename)
+                    self.write_time += elapsed
+                job.data = None
+                for listener in list(self.listeners):
+                    try:
+                        listener(job.filename, job.header)
+                    except Exception as e:
+                        self.logger.exception("Error in FITS writer listener: " + str(e))
+                job.future.set_result(job.filename)
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """ block until everything queued so far is written """
+        self._queue.join()
+
+    def close(self, wait=True):
+        """ finish the queued writes and stop the workers """
+        if self._closed:
+            return
+        self._closed = True
+        for worker in self._workers:
+            self._queue.put(None)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+        atexit.unregister(self.close)
@@ -0,0 +1,280 @@
+import logging
+import csv
+import datetime
+import math
+from pathlib import Path
+import numpy as np
+
+"""
+A temperature-compensated focus model, so we only run autofocus when we have to
+
+Every autofocus result (autofocus.Autofocus.run) is recorded with the
+conditions it was measured in (ambient temperature, altitude, filter, and the
+tube temperature, if there's a source for it). A small ridge regression
+
+  focus = c0 + c1*tube_temp + c2*ambient_temp + c3*sin(altitude) + offset[filter]
+
+predicts the best focus for the current conditions, and the focuser is moved
+there on every slew and filter change (set_altitude, set_filter). A full
+autofocus is only needed when the measured FWHM drifts more than
+drift_threshold above what we've achieved at best focus (needs_autofocus).
+
+Results are kept in a CSV file so the model carries over between nights.
+"""
+
+FIELDS = ('date', 'position', 'fwhm', 'tube_temp', 'ambient_temp', 'altitude', 'filter')
+TERMS = ('tube_temp', 'ambient_temp', 'altitude')
+# no device reports a tube temperature yet; add it (with a source) where one does
+DEFAULT_TERMS = ('ambient_temp', 'altitude')
+
+
+def _float(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def load_focus_model(config, move=None, sources=None):
+    """
+    A FocusPredictor from a device's config, or None if it doesn't set focus_model
+
+    focus_model -- the CSV file the records are kept in, relative to the robofast directory
+    focus_terms, focus_ridge, focus_min_move, focus_drift -- terms, ridge, min_move and
+                                                             drift_threshold (see FocusPredictor)
+    """
+    if config.get('focus_model') is None: return None
+    filename = Path(__file__).resolve().parent / config['focus_model']
+    return FocusPredictor(filename, terms=config.get('focus_terms', DEFAULT_TERMS), move=move, sources=sources,
+                          ridge=config.get('focus_ridge', 1e-2), min_move=config.get('focus_min_move', 0.0),
+                          drift_threshold=config.get('focus_drift', 0.2))
+
+
+def share_focus_model(camera, telescope, ambient_temp=None):
+    """
+    Use one FocusPredictor for a camera and the telescope it's on
+
+    The telescope's (or, if it has none, the camera's) is given to both, so
+    the camera's autofocus results (autofocus.Autofocus) are recorded with the
+    altitude of the last slew and set the focus on the next slew and filter
+    change. ambient_temp is a function that returns the ambient temperature
+    (C), e.g., from the weather or a dome's header keywords. Returns the
+    shared model (None if neither has one)
+    """
+    model = telescope.focus_model if telescope.focus_model is not None else camera.focus_model
+    if model is None: return None
+    if ambient_temp is not None: model.sources['ambient_temp'] = ambient_temp
+    camera.focus_model = model
+    telescope.focus_model = model
+    return model
+
+
+class FocusPredictor:
+    """
+    filename -- CSV file the records are kept in (None to keep them in memory)
+    terms -- which of TERMS to use in the model
+    move -- move(position) to move the focuser, for set_filter/set_altitude
+    sources -- {term: function} that returns the current value of a term (e.g.,
+               the ambient temperature from the weather feed), used when it isn't given
+    ridge -- regularization; keeps the fit sane with only a few records
+    max_points -- only the most recent records are used
+    min_move -- don't move the focuser for predicted changes smaller than this
+    drift_threshold -- fractional FWHM increase that calls for a new autofocus
+    """
+
+    def __init__(self, filename=None, terms=DEFAULT_TERMS, move=None, sources=None, ridge=1e-2,
+                 max_points=200, min_move=0.0, drift_threshold=0.2):
+        self.logger = logging.getLogger()
+        for term in terms:
+            if term not in TERMS:
+                raise ValueError("Unknown focus model term (" + str(term) + "); must be one of " + str(TERMS))
+        self.filename = None if filename is None else Path(filename)
+        self.terms = tuple(terms)
+        self.move = move
+        self.sources = {} if sources is None else dict(sources)
+        self.ridge = ridge
+        self.max_points = max_points
+        self.min_move = min_move
+        self.drift_threshold = drift_threshold
+
+        self.records = []
+        self.coeffs = None
+        self.filter = None
+        self.altitude = None
+        self.last_position = None
+        self.autofocus_needed = False
+
+        if self.filename is not None and self.filename.exists():
+            with open(self.filename, newline='') as f:
+                for row in csv.DictReader(f):
+                    self.records.append(self._clean(row))
+            self.fit()
+
+    def _clean(self, row):
+        record = {key: _float(row.get(key)) for key in FIELDS if key not in ('date', 'filter')}
+        record['date'] = row.get('date')
+        record['filter'] = row.get('filter') or None
+        return record
+
+    ################## RECORDING ##################
+    def record(self, position, fwhm=None, filter=None, tube_temp=None, ambient_temp=None, altitude=None, date=None):
+        """ add a best focus result (e.g., from autofocus.Autofocus.run) and refit """
+        self.autofocus_needed = False
+        self.last_position = position
+        if date is None: date = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
+        values = {'tube_temp': tube_temp, 'ambient_temp': ambient_temp, 'altitude': altitude}
+        record = self._clean(dict(self._current(values), date=date, position=position, fwhm=fwhm, filter=filter))
+        self.records.append(record)
+
+        if self.filename is not None:
+            new = not self.filename.exists()
+            with open(self.filename, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDS)
+                if new: writer.writeheader()
+                writer.writerow({key: '' if record[key] is None else record[key] for key in FIELDS})
+        self.fit()
+        return record
+
+    def record_from_header(self, hdr, position=None, weather=None, tube_temp_key=None):
+        """
+        record a best focus from a FITS header taken at it
+
+        position defaults to FOCPOS (the camera's or Telescope_DFM.add_header_keys),
+        the FWHM to FWHM (imstats), the altitude to ALTITUDE, the filter to FILTER,
+        the ambient temperature to outsideTemp from the weather feed
+        (Weather.get_boltwood), and the tube temperature to tube_temp_key, if
+        given. Returns None (and records nothing) if there's no position
+        """
+        if position is None: position = _float(hdr.get('FOCPOS'))
+        if position is None:
+            self.logger.error("No focus position (FOCPOS) in the header; not recording it")
+            return None
+        ambient_temp = None if weather is None else weather.get('outsideTemp')
+        tube_temp = None if tube_temp_key is None else hdr.get(tube_temp_key)
+        return self.record(position, fwhm=hdr.get('FWHM'), filter=hdr.get('FILTER'), tube_temp=tube_temp,
+                           ambient_temp=ambient_temp, altitude=hdr.get('ALTITUDE'))
+
+    def _current(self, values):
+        """ fill in values that weren't given from the sources """
+        values = dict(values)
+        for term, source in self.sources.items():
+            if values.get(term) is None:
+                try:
+                    values[term] = source()
+                except Exception as e:
+                    self.logger.exception("Error reading " + term + " for the focus model: " + str(e))
+        return values
+
+    ################## MODEL ##################
+    def _features(self, records):
+        """ the columns of the design matrix for the terms (sin(altitude) for altitude) """
+        columns = []
+        for term in self.used_terms:
+            value = np.array([np.nan if r[term] is None else r[term] for r in records], dtype=np.float64)
+            if term == 'altitude': value = np.sin(np.radians(value))
+            columns.append(value)
+        return np.array(columns).reshape(len(self.used_terms), len(records)).T
+
+    def fit(self):
+        """ refit the model; returns False if there are no records """
+        records = [r for r in self.records if r['position'] is not None][-self.max_points:]
+        if len(records) == 0:
+            self.coeffs = None
+            return False
+
+        # only the terms we have values for, and only the records that have them
+        self.used_terms = [term for term in self.terms if any(r[term] is not None for r in records)]
+        records = [r for r in records if all(r[term] is not None for term in self.used_terms)]
+        if len(records) == 0:
+            self.coeffs = None
+            return False
+
+        # the most common filter is the reference; the others get offsets from it
+        filters = [r['filter'] for r in records]
+        names = sorted(set(filters), key=lambda name: (-filters.count(name), str(name)))
+        self.reference_filter = names[0]
+        self.filters = names[1:]
+
+        features = self._features(records)
+        self._mean = features.mean(axis=0)
+        self._scale = np.where(features.std(axis=0) > 0, features.std(axis=0), 1.0)
+        X = np.hstack((np.ones((len(records), 1)), (features - self._mean)/self._scale,
+                       np.array([[r['filter'] == name for name in self.filters] for r in records],
+                                dtype=np.float64).reshape(len(records), len(self.filters))))
+        y = np.array([r['position'] for r in records])
+
+        # ridge (but not on the constant), as extra rows
+        npar = X.shape[1]
+        penalty = np.sqrt(self.ridge*len(records))*np.eye(npar)[1:]
+        A = np.vstack((X, penalty))
+        b = np.concatenate((y, np.zeros(npar-1)))
+        self.coeffs = np.linalg.lstsq(A, b, rcond=None)[0]
+
+        residuals = y - X @ self.coeffs
+        dof = max(len(records) - npar, 1)
+        self.rms = float(np.sqrt(np.sum(residuals**2)/dof)) if len(records) > npar else None
+        self.npoints = len(records)
+
+        fwhm = {}
+        for r in records:
+            if r['fwhm'] is not None: fwhm.setdefault(r['filter'], []).append(r['fwhm'])
+        self.best_fwhm = {name: float(np.median(values)) for name, values in fwhm.items()}
+        return True
+
+    def predict(self, filter=None, tube_temp=None, ambient_temp=None, altitude=None):
+        """ the predicted best focus (None if there are no records yet) """
+        if self.coeffs is None: return None
+        values = self._current({'tube_temp': tube_temp, 'ambient_temp': ambient_temp, 'altitude': altitude})
+        features = self._features([{term: _float(values.get(term)) for term in self.used_terms}])[0]
+        # unknown conditions: assume the average
+        features = np.where(np.isfinite(features), features, self._mean)
+
+        if filter is not None and filter != self.reference_filter and filter not in self.filters:
+            self.logger.warning("No focus records for filter " + str(filter) + "; using " + str(self.reference_filter))
+        onehot = [float(filter == name) for name in self.filters]
+        x = np.concatenate(([1.0], (features - self._mean)/self._scale, onehot))
+        return float(x @ self.coeffs)
+
+    def needs_autofocus(self, fwhm, filter=None):
+        """ True if the measured FWHM is more than drift_threshold worse than at best focus (or there's no model) """
+        if self.coeffs is None: return True
+        best = self.best_fwhm.get(filter, self.best_fwhm.get(self.reference_filter))
+        if best is None or fwhm is None or not math.isfinite(fwhm): return False
+        return fwhm > best*(1.0 + self.drift_threshold)
+
+    def check(self, stats):
+        """
+        set autofocus_needed if the FWHM has drifted (see needs_autofocus)
+
+        stats is the output of imstats.measure, so this can be added to the
+        camera's image_stats.callbacks to watch every frame
+        """
+        if self.needs_autofocus(stats.get('fwhm'), self.filter):
+            if not self.autofocus_needed:
+                self.logger.warning("FWHM (" + '{0:.2f}'.format(stats['fwhm']) + ") has drifted; autofocus needed")
+            self.autofocus_needed = True
+        return self.autofocus_needed
+
+    ################## HOOKS ##################
+    def refocus(self, **values):
+        """ move to the predicted best focus for the current filter and altitude; returns the position """
+        position = self.predict(filter=self.filter, altitude=self.altitude, **values)
+        if position is None or self.move is None: return position
+        if self.last_position is not None and abs(position - self.last_position) < self.min_move:
+            return self.last_position
+
+        self.logger.info("Moving focus to the predicted best focus (" + '{0:.1f}'.format(position) + ")")
+        self.move(position)
+        self.last_position = position
+        return position
+
+    def set_filter(self, filter):
+        """ call on every filter change """
+        self.filter = filter
+        return self.refocus()
+
+    def set_altitude(self, altitude):
+        """ call on every slew (altitude in degrees) """
+        self.altitude = altitude
+        return self.refocus()
@@ -0,0 +1,111 @@
+import logging
+import threading
+import numpy as np
+
+"""
+Preallocated frame buffers for the camera layer
+
+Multi-megapixel frames are allocated once, filled straight from the driver's
+ImageArray, handed to the writer, and recycled when the writer is done with
+them, instead of allocating (and converting) new arrays every frame.
+"""
+
+
+class FramePool:
+    """
+    A pool of identically shaped, preallocated frames
+
+    If every frame is in use, acquire() allocates a new one rather than
+    stalling acquisition, but the pool only keeps nframes of them around.
+
+    Parameters
+    ----------
+    shape : tuple
+        (ny, nx) of each frame.
+    dtype : numpy dtype
+        Pixel type of each frame.
+    nframes : int
+        Number of frames to preallocate (and keep).
+    """
+
+    def __init__(self, shape, dtype=np.uint16, nframes=4):
+        self.logger = logging.getLogger()
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.nframes = int(nframes)
+
+        self.nallocated = self.nframes
+        self._free = [np.empty(self.shape, dtype=self.dtype) for i in range(self.nframes)]
+        self._lock = threading.Lock()
+
+    def matches(self, shape, dtype):
+        return self.shape == tuple(int(n) for n in shape) and self.dtype == np.dtype(dtype)
+
+    def acquire(self):
+        """ a frame to fill; give it back with release() when you're done with it """
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            self.nallocated += 1
+
+        self.logger.debug("Frame pool exhausted; allocating frame " + str(self.nallocated))
+        return np.empty(self.shape, dtype=self.dtype)
+
+    def release(self, frame):
+        """ return a frame to the pool (frames from elsewhere, or extras, are dropped) """
+        if frame is None or frame.shape != self.shape or frame.dtype != self.dtype:
+            return
+        with self._lock:
+            if len(self._free) < self.nframes and not any(f is frame for f in self._free):
+                self._free.append(frame)
+
+    @property
+    def available(self):
+        return len(self._free)
+
+
+def decode_image_array(image_array, out, transpose=True):
+    """
+    Copy pixel data from a driver into a preallocated frame, in place
+
+    Parameters
+    ----------
+    image_array : array, buffer, or nested sequence
+        The pixels. numpy arrays and anything that supports the buffer protocol
+        (bytes, memoryview, array.array) are copied in a single pass; nested
+        sequences (e.g., an ASCOM SAFEARRAY through win32com) are decoded one
+        row at a time, so no full-size temporary is ever made.
+    out : numpy array, shape (ny, nx)
+        The frame to fill.
+    transpose : bool
+        True if image_array is indexed [x][y], as ASCOM's ImageArray is.
+
+    Returns
+    -------
+    out
+    """
+    dest = out.T if transpose else out
+
+    if isinstance(image_array, np.ndarray):
+        np.copyto(dest, image_array.reshape(dest.shape), casting='unsafe')
+        return out
+
+    try:
+        view = memoryview(image_array)
+    except TypeError:
+        view = None
+
+    if view is not None:
+        if view.format in ('B', 'b', 'c') and view.itemsize == 1 and len(view.shape) <= 1:
+            # raw bytes from a relay; assume they're in the frame's dtype
+            src = np.frombuffer(view, dtype=out.dtype)
+        else:
+            src = np.asarray(view)
+        np.copyto(dest, src.reshape(dest.shape), casting='unsafe')
+        return out
+
+    if len(image_array) != dest.shape[0]:
+        raise ValueError("ImageArray has " + str(len(image_array)) + " rows; expected " + str(dest.shape[0]))
+    for i, row in enumerate(image_array):
+        dest[i] = row
+    return out
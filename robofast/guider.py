@@ -0,0 +1,332 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import yaml
+import numpy as np
+
+# local imports
+from robofast import imstats
+
+"""
+Closed-loop guiding
+
+Each cycle exposes a (sub)frame on the guide camera, finds the guide stars
+(see imstats.detect), matches them to the reference positions from the first
+frame, and turns the median offset into a mount correction with a
+configurable control law. Corrections are sent in a background thread, so
+the next exposure starts right away. Frames exposed before the previous
+correction was acknowledged are not used to correct again, since they don't
+show its effect yet.
+
+Every stage of every cycle is timestamped (exposure start, readout, centroid,
+command sent, mount acknowledgement; time.monotonic()) so the end-to-end
+correction latency, which limits the tracking error, can be measured.
+
+Corrections are (east, north) in arcsec on the sky; the mount side is just
+a function send_correction(east, north). See pulse_guide_sender and
+jog_sender for Telescope_DFM and the Paramount.
+"""
+
+
+class ProportionalLaw:
+    """ correction = gain x error (each axis) """
+
+    def __init__(self, gain=0.7):
+        self.gain = gain
+
+    def update(self, error, dt):
+        return self.gain*np.asarray(error, dtype=np.float64)
+
+    def reset(self):
+        pass
+
+
+class PIDLaw:
+    """
+    A PID controller on each axis
+
+    The integral term removes steady drifts (e.g., polar misalignment); the
+    derivative term is usually best left at 0 because seeing makes it noisy.
+    """
+
+    def __init__(self, kp=0.7, ki=0.0, kd=0.0, max_integral=None):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.max_integral = max_integral
+        self.reset()
+
+    def reset(self):
+        self.integral = np.zeros(2)
+        self.last_error = None
+
+    def update(self, error, dt):
+        error = np.asarray(error, dtype=np.float64)
+        self.integral += error*dt
+        if self.max_integral is not None:
+            np.clip(self.integral, -self.max_integral, self.max_integral, out=self.integral)
+        derivative = np.zeros(2) if self.last_error is None or dt <= 0 else (error - self.last_error)/dt
+        self.last_error = error
+        return self.kp*error + self.ki*self.integral + self.kd*derivative
+
+
+CONTROL_LAWS = {'proportional': ProportionalLaw, 'pid': PIDLaw}
+
+
+def pulse_guide_sender(telescope, guide_rate):
+    """
+    send_correction for Telescope_DFM.pulse_guide
+
+    guide_rate -- the mount's guide rate (arcsec/s; see change_guide_rate)
+    """
+    def send(east, north):
+        # direction: 0=North, 1=South, 2=East, 3=West; duration in milliseconds
+        if north != 0: telescope.pulse_guide(0 if north > 0 else 1, int(round(abs(north)/guide_rate*1000.0)))
+        if east != 0: telescope.pulse_guide(2 if east > 0 else 3, int(round(abs(east)/guide_rate*1000.0)))
+    return send
+
+
+def jog_sender(telescope):
+    """ send_correction for the Paramount's jog (arcmin in a direction) """
+    def send(east, north):
+        if north != 0: telescope.jog(abs(north)/60.0, 'N' if north > 0 else 'S')
+        if east != 0: telescope.jog(abs(east)/60.0, 'E' if east > 0 else 'W')
+    return send
+
+
+class Guider:
+    """
+    Parameters
+    ----------
+    camera : Camera
+        The guide camera (see camera.load_camera); its ROI and binning are used as is.
+    send_correction : function
+        send_correction(east, north) moves the mount (arcsec); it should
+        return once the mount has acknowledged the move.
+    exptime : float
+        Seconds per guide frame.
+    control_law : str
+        'proportional' or 'pid' (see CONTROL_LAWS); gains are passed as law_kwargs.
+    angle : float
+        Position angle of the detector (deg, east of north). At 0, north is
+        +y and east is -x, as in CameraBase.starcat.
+    parity : int
+        1, or -1 if the image is flipped.
+    nstars : int
+        Number of (the brightest) stars to guide on.
+    match_radius : float
+        Stars must be within this many pixels of their reference positions.
+    min_correction, max_correction : float
+        Corrections smaller than min_correction (arcsec) aren't sent; larger
+        than max_correction are clipped.
+    history : int
+        Number of cycles of timestamps to keep.
+    """
+
+    def __init__(self, camera, send_correction, exptime=1.0, control_law='proportional', angle=0.0, parity=1,
+                 nstars=5, match_radius=10.0, min_correction=0.05, max_correction=30.0, history=1000,
+                 threshold=5.0, halfwidth=5, timeout=10.0, **law_kwargs):
+        self.logger = logging.getLogger()
+        self.camera = camera
+        self.send_correction = send_correction
+        self.exptime = exptime
+        if control_law not in CONTROL_LAWS:
+            raise ValueError("Unknown control law (" + str(control_law) + "); must be one of " + str(list(CONTROL_LAWS)))
+        self.law = CONTROL_LAWS[control_law](**law_kwargs)
+        self.angle = angle
+        self.parity = parity
+        self.nstars = nstars
+        self.match_radius = match_radius
+        self.min_correction = min_correction
+        self.max_correction = max_correction
+        self.threshold = threshold
+        self.halfwidth = halfwidth
+        self.timeout = timeout
+
+        self.reference = None
+        self.cycles = deque(maxlen=history)
+        self.ncycles = 0
+
+        self._sender = ThreadPoolExecutor(max_workers=1, thread_name_prefix='guidecmd')
+        self._inflight = None
+        self._last_ack = None
+        self._last_update = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    ################## MEASUREMENT ##################
+    def centroids(self, image):
+        """ (x, y) of the brightest nstars stars in image (array coordinates) """
+        sources = imstats.detect(image, threshold=self.threshold, halfwidth=self.halfwidth, maxsources=self.nstars)
+        order = np.argsort(sources['flux'])[::-1]
+        return sources['x'][order], sources['y'][order]
+
+    def offset(self, x, y):
+        """
+        Median (dx, dy) in pixels of the stars from their reference positions, and how many matched
+
+        Each reference star is matched to the nearest star within match_radius, all at once
+        """
+        refx, refy = self.reference
+        if len(x) == 0 or len(refx) == 0: return None, 0
+        dx = x[None, :] - refx[:, None]
+        dy = y[None, :] - refy[:, None]
+        dist2 = dx**2 + dy**2
+        nearest = np.argmin(dist2, axis=1)
+        rows = np.arange(len(refx))
+        matched = dist2[rows, nearest] <= self.match_radius**2
+        if not matched.any(): return None, 0
+        return (np.median(dx[rows, nearest][matched]), np.median(dy[rows, nearest][matched])), int(matched.sum())
+
+    def to_sky(self, dx, dy):
+        """ (east, north) arcsec of a (dx, dy) pixel offset on the detector """
+        e = -self.parity*dx*self.camera.platescale
+        n = dy*self.camera.platescale
+        pa = math.radians(self.angle)
+        return e*math.cos(pa) + n*math.sin(pa), -e*math.sin(pa) + n*math.cos(pa)
+
+    ################## THE LOOP ##################
+    def reset(self):
+        """ use the next frame as the new reference """
+        self.reference = None
+        self.law.reset()
+        self._last_update = None
+
+    def step(self):
+        """
+        One guide cycle; returns its record (see cycles), or None if the frame timed out
+
+        record keys: t_start, t_readout, t_centroid, t_sent, t_ack (time.monotonic();
+        t_sent/t_ack are filled in when the correction is sent and acknowledged),
+        dx, dy (pixels), error and correction ((east, north) arcsec), nmatched, and status
+        """
+        camera = self.camera
+        record = {'cycle': self.ncycles, 't_start': time.monotonic(), 't_readout': None, 't_centroid': None,
+                  't_sent': None, 't_ack': None, 'dx': None, 'dy': None, 'error': None, 'correction': None,
+                  'nmatched': 0, 'status': None}
+        self.ncycles += 1
+
+        camera._start_exposure(self.exptime)
+        image = camera._read_image(self.exptime, record['t_start'], self.timeout)
+        record['t_readout'] = time.monotonic()
+        if image is None:
+            self.logger.error("Timed out waiting for guide frame")
+            record['status'] = 'timeout'
+            self.cycles.append(record)
+            return record
+
+        try:
+            x, y = self.centroids(image)
+        finally:
+            if camera.frame_pool is not None: camera.frame_pool.release(image)
+        record['t_centroid'] = time.monotonic()
+
+        if self.reference is None:
+            if len(x) == 0:
+                self.logger.warning("No guide stars found")
+                record['status'] = 'nostars'
+            else:
+                self.reference = (x, y)
+                self.logger.info("Guiding on " + str(len(x)) + " star(s); brightest at " +
+                                 '({0:.2f}, {1:.2f})'.format(x[0], y[0]))
+                record['status'] = 'reference'
+            self.cycles.append(record)
+            return record
+
+        offset, record['nmatched'] = self.offset(x, y)
+        if offset is None:
+            self.logger.warning("Lost the guide star(s)")
+            record['status'] = 'lost'
+            self.cycles.append(record)
+            return record
+        record['dx'], record['dy'] = offset
+        error = self.to_sky(*offset)
+        record['error'] = error
+
+        # a frame that started before the last correction landed doesn't show it yet
+        if self._inflight is not None and not self._inflight.done():
+            record['status'] = 'busy'
+        elif self._last_ack is not None and record['t_start'] < self._last_ack:
+            record['status'] = 'stale'
+        else:
+            now = record['t_centroid']
+            dt = 0.0 if self._last_update is None else now - self._last_update
+            self._last_update = now
+            correction = np.clip(self.law.update(error, dt), -self.max_correction, self.max_correction)
+            if np.hypot(*correction) < self.min_correction:
+                record['status'] = 'deadband'
+            else:
+                record['correction'] = (float(correction[0]), float(correction[1]))
+                record['status'] = 'sent'
+                self._inflight = self._sender.submit(self._send, record)
+
+        self.cycles.append(record)
+        return record
+
+    def _send(self, record):
+        record['t_sent'] = time.monotonic()
+        try:
+            self.send_correction(*record['correction'])
+        except Exception as e:
+            self.logger.exception("Error sending guide correction: " + str(e))
+            record['status'] = 'failed'
+        record['t_ack'] = time.monotonic()
+        self._last_ack = record['t_ack']
+
+    def start(self):
+        """ guide in a background thread until stop() """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='guider', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.step()
+            except Exception as e:
+                self.logger.exception("Error in guide loop: " + str(e))
+                self._stop.wait(1.0)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._inflight is not None:
+            self._inflight.result()
+        summary = self.latency()
+        if summary:
+            self.logger.info("Guide latency (median s): " +
+                             ', '.join(key + '=' + '{0:.4f}'.format(value[0]) for key, value in summary.items()))
+
+    def close(self):
+        self.stop()
+        self._sender.shutdown()
+
+    ################## INSTRUMENTATION ##################
+    def latency(self):
+        """
+        (median, max) seconds of each stage over the cycles that sent a correction
+
+        readout: end of the exposure to image in hand; centroid; send: centroid
+        to command sent; ack: command sent to mount acknowledgement; total:
+        middle of the exposure (when the error was measured) to acknowledgement
+        """
+        cycles = [c for c in list(self.cycles) if c['t_ack'] is not None]
+        if len(cycles) == 0: return {}
+        t = {key: np.array([c[key] for c in cycles]) for key in ('t_start', 't_readout', 't_centroid', 't_sent', 't_ack')}
+        stages = {'readout': t['t_readout'] - (t['t_start'] + self.exptime),
+                  'centroid': t['t_centroid'] - t['t_readout'],
+                  'send': t['t_sent'] - t['t_centroid'],
+                  'ack': t['t_ack'] - t['t_sent'],
+                  'total': t['t_ack'] - (t['t_start'] + 0.5*self.exptime)}
+        return {key: (float(np.median(value)), float(np.max(value))) for key, value in stages.items()}
+
+
+def load_guider(config_file, camera, send_correction):
+    with open(config_file) as f:
+        config = yaml.safe_load(f)
+    return Guider(camera, send_correction, **config)
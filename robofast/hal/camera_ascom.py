@@ -2,7 +2,6 @@ import logging
 from pathlib import Path
 import win32com.client
 import win32api
-from astropy.io import fits
 import datetime
 import time
 import ipdb
@@ -10,6 +9,7 @@ import atexit
 
 # local imports
 from robofast import camera
+from robofast import framepool
 
 
 class AscomCamera:
@@ -28,6 +28,8 @@ class AscomCamera:
         self.x2 = None
         self.y1 = None
         self.y2 = None
+        self.xbin = 1
+        self.ybin = 1
 
         # if you don't know what your driver is called, use the ASCOM Chooser
         # this will give you a GUI to select it
@@ -94,6 +96,30 @@ class AscomCamera:
     def temperature(self):
         return self._driver.CCDTemperature
 
+    @property
+    def set_temperature(self):
+        return self._driver.SetCCDTemperature
+
+    @property
+    def can_set_temperature(self):
+        return self._driver.CanSetCCDTemperature
+
+    def start_cooling(self, temp=None):
+        if temp is not None:
+            self._driver.SetCCDTemperature = temp
+        self._driver.CoolerOn = True
+        return True
+
+    @property
+    def xsize(self):
+        """ detector width (unbinned pixels) """
+        return self._driver.CameraXSize
+
+    @property
+    def ysize(self):
+        """ detector height (unbinned pixels) """
+        return self._driver.CameraYSize
+
     def set_bin(self, xbin, ybin=None):
         if ybin is None:
             ybin = xbin
@@ -103,41 +129,48 @@ class AscomCamera:
                 self.logger.error('The camera cannot bin asymmetrically')
                 return False
 
+        # the ROI is in binned pixels; keep the same area of the detector
+        if self.x1 is not None:
+            x1 = (self.x1-1)*self.xbin//xbin + 1
+            y1 = (self.y1-1)*self.ybin//ybin + 1
+            nx = (self.x2-self.x1)*self.xbin//xbin
+            ny = (self.y2-self.y1)*self.ybin//ybin
+
         self._driver.BinX = xbin
         self._driver.BinY = ybin
+        self.xbin = xbin
+        self.ybin = ybin
+
+        if self.x1 is not None:
+            return self.set_roi(x1, x1+nx, y1, y1+ny)
         return True
 
     def set_roi(self, x1=None, x2=None, y1=None, y2=None, full_frame=False):
+        """
+        the ROI is [x1:x2,y1:y2) in binned pixels, starting at 1 (as in SimCamera)
+        ASCOM's StartX/StartY start at 0
+        """
 
         if full_frame:
             x1 = 1
-            x2 = self._driver.CameraXSize
+            x2 = self._driver.CameraXSize//self.xbin + 1
             y1 = 1
-            y2 = self._driver.CameraYSize
-
-        if x1 is not None:
-            self._driver.StartX = x1
-        else:
-            x1 = self._driver.StartX
-        self.x1 = x1
-
-        if x2 is not None:
-            self._driver.NumX = x2-x1
-        else:
-            x2 = self._driver.StartX+x1
-        self.x2 = x2
-
-        if y1 is not None:
-            self._driver.StartY = y1
-        else:
-            y1 = self._driver.StartY
-        self.y1 = y1
-
-        if y2 is not None:
-            self._driver.NumY = y2-y1
-        else:
-            y2 = self._driver.StartY+y1
-        self.y2 = y2
+            y2 = self._driver.CameraYSize//self.ybin + 1
+
+        if x1 is None: x1 = self._driver.StartX + 1
+        if x2 is None: x2 = x1 + self._driver.NumX
+        if y1 is None: y1 = self._driver.StartY + 1
+        if y2 is None: y2 = y1 + self._driver.NumY
+
+        if x2 <= x1 or y2 <= y1:
+            self.logger.error("Invalid ROI ([" + str(x1) + ':' + str(x2) + ',' + str(y1) + ':' + str(y2) + '])')
+            return False
+
+        self._driver.StartX = x1-1
+        self._driver.NumX = x2-x1
+        self._driver.StartY = y1-1
+        self._driver.NumY = y2-y1
+        self.x1, self.x2, self.y1, self.y2 = x1, x2, y1, y2
         return True
 
     def get_header_keys(self, hdr):
@@ -156,27 +189,55 @@ class AscomCamera:
 
         return hdr
 
-    def save_image(self, filename, timeout=10, hdr=None, overwrite=False):
+    @property
+    def image_ready(self):
+        return self.ready or self._driver.ImageReady
+
+    def read_image(self):
+        """ read the image into a pooled frame buffer (see CameraBase.frame_buffer) """
+        if self.image is not None:
+            # this is a simulated image
+            image = self.image
+            self.image = None
+            self.ready = False
+            return image
+
+        # decode straight into a pooled buffer
+        image = self.frame_buffer((self._driver.NumY, self._driver.NumX))
+        framepool.decode_image_array(self._driver.ImageArray, image)
+        return image
+
+    def save_image(self, filename, timeout=10, hdr=None, overwrite=False, wait=False, callback=None):
+        """
+        Read out the image and hand it to the background writer (see fitswriter.py)
+
+        Returns as soon as the frame is queued, so the next exposure can start
+        while it's being written. callback(future) is called when the write
+        completes or fails. If wait is True, block until the file is written
+        and return whether it succeeded.
+        """
 
         t0 = datetime.datetime.utcnow()
-        elapsed_time = (t0 - datetime.datetime.utcnow()).total_seconds()
-        while elapsed_time < timeout and not self._driver.ImageReady and not self.ready:
+        elapsed_time = (datetime.datetime.utcnow() - t0).total_seconds()
+        while elapsed_time < timeout and not self.image_ready:
             time.sleep(0.05)
-            elapsed_time = (t0 - datetime.datetime.utcnow()).total_seconds()
-        if not self._driver.ImageReady and not self.ready:
+            elapsed_time = (datetime.datetime.utcnow() - t0).total_seconds()
+        if not self.image_ready:
             return False
 
         hdr = self.get_header_keys(hdr)
 
-        if self.image is not None:
-            # this is a simulated image
-            hdu = fits.PrimaryHDU(self.image, header=hdr)
-            self.image = None
-            self.ready = False
-        else:
-            hdu = fits.PrimaryHDU(self._driver.ImageArray, header=hdr)
+        # the writer owns the image and header from here on
+        image = self.read_image()
 
-        hdu.writeto(filename, overwrite=overwrite)
+        # recycle the buffer once it's on disk
+        future = self._queue_frame(filename, image, hdr, overwrite=overwrite, callback=callback)
+
+        if wait:
+            try:
+                future.result()
+            except Exception:
+                return False
 
         return True
 
@@ -0,0 +1,263 @@
+import logging
+from pathlib import Path
+import datetime
+import threading
+import time
+import numpy as np
+
+# local imports
+from robofast import camera
+
+'''
+this is a simulated camera that runs anywhere (no drivers needed)
+images come from CameraBase.simulate_star_image with a configurable readout time,
+so the writer, sequencing, guiding, and acquisition code can be tested and profiled without hardware
+'''
+class SimCamera:
+
+    def __init__(self, config):
+
+        self.logger = logging.getLogger()
+
+        self.gain = config['gain']
+        self.unbinned_platescale = config['platescale']
+        self.platescale = self.unbinned_platescale
+
+        # detector size (unbinned pixels)
+        self.xsize = int(config.get('xsize', 2048))
+        self.ysize = int(config.get('ysize', 2048))
+
+        # seconds to read out the full, unbinned frame; scales with the number of pixels read
+        self.readout_time = float(config.get('readout_time', 0.0))
+
+        # properties of the simulated images
+        self.background = float(config.get('background', 300.0))
+        self.noise = float(config.get('readnoise', 10.0))
+        self.fwhm = float(config.get('fwhm', 2.0))
+        self.profile = config.get('profile', 'gaussian')
+
+        # a focuser: the FWHM grows as sqrt(fwhm^2 + (focus_slope*(position - best_focus))^2)
+        self.best_focus = float(config.get('best_focus', 5000.0))
+        self.focus_slope = float(config.get('focus_slope', 0.01)) # arcsec/step
+        self.focus_position = self.best_focus
+
+        # a fixed, random star field (detector coordinates), so consecutive frames see the same stars
+        # xoffset/yoffset (pixels) shift the field, e.g., to mimic pointing errors or drift
+        rng = np.random.default_rng(config.get('seed'))
+        nstars = int(config.get('nstars', 100))
+        self.star_x = rng.uniform(1, self.xsize, nstars)
+        self.star_y = rng.uniform(1, self.ysize, nstars)
+        self.star_flux = 10**rng.uniform(3.0, 5.0, nstars)  # e-/s
+        self.xoffset = 0.0
+        self.yoffset = 0.0
+
+        # or, center the field on ra/dec and use stars from the catalog (see CameraBase.starcat)
+        self.ra = config.get('ra')
+        self.dec = config.get('dec')
+
+        # a simple thermal model: the CCD approaches the set point at cooling_rate (C/s)
+        self.ambient_temperature = float(config.get('ambient_temperature', 20.0))
+        self.cooling_rate = float(config.get('cooling_rate', 1.0))
+        self._temperature = self.ambient_temperature
+        self._set_temperature = self.ambient_temperature
+        self._cooler_on = False
+        self._last_thermal_update = time.monotonic()
+
+        self.xbin = 1
+        self.ybin = 1
+        self.x1 = 1
+        self.x2 = self.xsize + 1
+        self.y1 = 1
+        self.y2 = self.ysize + 1
+
+        self.image = None
+        self.ready = False
+        self.connected = False
+        self._ready_time = None
+        self._exposure_thread = None
+
+    def initialize(self):
+        self.connect()
+        self.cool()
+        self.set_roi(full_frame=True)
+        self.set_bin(1)
+
+    def connect(self):
+        self.connected = True
+        return self.connected
+
+    def disconnect(self):
+        self.connected = False
+        return not self.connected
+
+    ################## THERMAL ##################
+    def _update_temperature(self):
+        now = time.monotonic()
+        dt = now - self._last_thermal_update
+        self._last_thermal_update = now
+
+        target = self._set_temperature if self._cooler_on else self.ambient_temperature
+        step = self.cooling_rate*dt
+        if abs(target - self._temperature) <= step:
+            self._temperature = target
+        else:
+            self._temperature += np.sign(target - self._temperature)*step
+
+    @property
+    def temperature(self):
+        self._update_temperature()
+        return self._temperature
+
+    @property
+    def set_temperature(self):
+        return self._set_temperature
+
+    @property
+    def can_set_temperature(self):
+        return True
+
+    def start_cooling(self, temp=None):
+        self._update_temperature()
+        if temp is not None:
+            self._set_temperature = float(temp)
+        self._cooler_on = True
+        return True
+
+    ################## FOCUSER ##################
+    def move_focus(self, position):
+        self.focus_position = float(position)
+        return True
+
+    def read_focuser_position(self):
+        return self.focus_position
+
+    @property
+    def focused_fwhm(self):
+        """ the FWHM (arcsec) at the current focus position """
+        return float(np.hypot(self.fwhm, self.focus_slope*(self.focus_position - self.best_focus)))
+
+    ################## GEOMETRY ##################
+    def set_bin(self, xbin, ybin=None):
+        if ybin is None:
+            ybin = xbin
+
+        # keep the same area of the detector
+        x1 = (self.x1-1)*self.xbin//xbin + 1
+        y1 = (self.y1-1)*self.ybin//ybin + 1
+        nx = (self.x2-self.x1)*self.xbin//xbin
+        ny = (self.y2-self.y1)*self.ybin//ybin
+
+        self.xbin = xbin
+        self.ybin = ybin
+        self.platescale = self.unbinned_platescale*xbin
+        self.x1, self.x2 = x1, x1+nx
+        self.y1, self.y2 = y1, y1+ny
+        return True
+
+    def set_roi(self, x1=None, x2=None, y1=None, y2=None, full_frame=False):
+        """ the ROI is in binned pixels, like ASCOM's StartX/NumX """
+
+        if full_frame:
+            x1 = 1
+            x2 = self.xsize//self.xbin + 1
+            y1 = 1
+            y2 = self.ysize//self.ybin + 1
+
+        if x1 is not None: self.x1 = int(x1)
+        if x2 is not None: self.x2 = int(x2)
+        if y1 is not None: self.y1 = int(y1)
+        if y2 is not None: self.y2 = int(y2)
+
+        if self.x2 <= self.x1 or self.y2 <= self.y1:
+            self.logger.error("Invalid ROI ([" + str(self.x1) + ':' + str(self.x2) + ',' + str(self.y1) + ':' + str(self.y2) + '])')
+            return False
+        return True
+
+    ################## EXPOSURES ##################
+    def expose(self, exptime, open_shutter=True):
+        self.exptime = exptime
+        self.dateobs = datetime.datetime.utcnow()
+        self.image = None
+        self.ready = False
+
+        npix = (self.x2-self.x1)*(self.y2-self.y1)
+        readout = self.readout_time*npix/(self.xsize*self.ysize/(self.xbin*self.ybin))
+        self._ready_time = time.monotonic() + exptime + readout
+
+        # binned detector coordinates of the stars
+        x = (self.star_x + self.xoffset - 0.5)/self.xbin + 0.5
+        y = (self.star_y + self.yoffset - 0.5)/self.ybin + 0.5
+        flux = self.star_flux*exptime if open_shutter else np.zeros(0)
+        if not open_shutter:
+            x = y = np.zeros(0)
+
+        kwargs = {'x': x, 'y': y, 'flux': flux, 'fwhm': self.focused_fwhm, 'background': self.background,
+                  'exptime': exptime, 'noise': self.noise, 'profile': self.profile}
+        if open_shutter and self.ra is not None and self.dec is not None:
+            kwargs['ra'] = self.ra
+            kwargs['dec'] = self.dec
+
+        # render the image while the "exposure" is going
+        self._exposure_thread = threading.Thread(target=self._expose, kwargs=kwargs, name='simcamera')
+        self._exposure_thread.start()
+
+    def _expose(self, **kwargs):
+        dateobs = self.dateobs
+        self.simulate_star_image(**kwargs)
+        # simulate_star_image stamps its own start time; keep the one from expose()
+        self.dateobs = dateobs
+
+    @property
+    def image_ready(self):
+        if self._ready_time is None:
+            return self.ready
+        return self.ready and time.monotonic() >= self._ready_time
+
+    def read_image(self):
+        """ the image, in a pooled frame buffer (see CameraBase.frame_buffer) """
+        if self._exposure_thread is not None:
+            self._exposure_thread.join()
+        if self._ready_time is not None:
+            sleeptime = self._ready_time - time.monotonic()
+            if sleeptime > 0: time.sleep(sleeptime)
+        image = self.image
+        self.image = None
+        self.ready = False
+        self._ready_time = None
+        return image
+
+    def save_image(self, filename, timeout=10, hdr=None, overwrite=False, wait=False, callback=None):
+        """ same as AscomCamera.save_image """
+
+        t0 = time.monotonic()
+        while time.monotonic() - t0 < timeout and not self.image_ready:
+            time.sleep(0.001)
+        if not self.image_ready:
+            return False
+
+        hdr = self.get_header_keys(hdr)
+        image = self.read_image()
+
+        # recycle the buffer once it's on disk
+        future = self._queue_frame(filename, image, hdr, overwrite=overwrite, callback=callback)
+
+        if wait:
+            try:
+                future.result()
+            except Exception:
+                return False
+
+        return True
+
+    def get_header_keys(self, hdr):
+        ''' get hardware-specific camera header keywords '''
+        hdr['SIMULATE'] = (True, 'Simulated image')
+        hdr['GAIN'] = (self.gain, 'Gain (e/ADU)')
+        hdr['FOCPOS'] = (self.focus_position, 'Focus Position (um)')
+        return hdr
+
+
+if __name__ == '__main__':
+    root_dir = Path(__file__).resolve().parent.parent
+    config_file = root_dir / "config" / "camera_sim.yaml"
+    c = camera.load_camera(config_file)
@@ -491,6 +491,12 @@ class Telescope_DFM:
 
         return coords
 
+    # the TCS command to load the pointing coefficients isn't implemented yet, so
+    # pointing models are applied in software (see ParametricPointingModel.export)
+    @property
+    def can_set_pointing_coefficients(self):
+        return False
+
     # hard to see the ultility of this without at least a read coeffs function...
     def change_pointing_coefficients(self,tbar,elevation_misalignment,\
                                      azimuth_misalignment,collimation,\
@@ -504,7 +510,7 @@ class Telescope_DFM:
                                      tube_flexure_sin, tube_flexure_tan, \
                                      fork_flexure, declination_axis_flexure):
         # hard to see the ultility of this without at least a read coeffs function...
-        pass
+        raise NotImplementedError("Loading the pointing coefficients into the TCS is not implemented")
 
     # documentation wrong? claims there is no data returned, implies the table is sent
     def read_point(self):
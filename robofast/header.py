@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+"""
+Gathers FITS header keywords from every device concurrently, with caching
+
+Each device registers a provider: a function like Dome.add_header_keys or
+Telescope_DFM.add_header_keys that fills in a header. Every provider's output
+is cached with a staleness limit (per provider, optionally per keyword). A
+snapshot only queries the providers that have gone stale, queries them all at
+once in a thread pool, and waits at most timeout seconds. A provider that
+hasn't answered in time contributes its last cached keywords and keeps
+running in the background, so the next snapshot gets its answer.
+
+Providers are called from worker threads, so they must be thread safe.
+"""
+
+
+class HeaderProvider:
+    """
+    name -- used in log messages
+    function -- function(hdr) that adds keywords to hdr (and optionally returns it)
+    max_age -- seconds the keywords can be reused before the device is queried again
+    key_max_age -- optional dictionary of per-keyword limits that override max_age
+    """
+
+    def __init__(self, name, function, max_age=0.0, key_max_age=None):
+        self.name = name
+        self.function = function
+        self.max_age = float(max_age)
+        self.key_max_age = {} if key_max_age is None else dict(key_max_age)
+
+        self.cards = {}
+        self.updated = {}
+        self.duration = None
+        self.future = None
+        self._lock = threading.Lock()
+
+    def stale(self, now=None):
+        """ True if any cached keyword is older than its limit (or nothing is cached) """
+        if now is None: now = time.monotonic()
+        with self._lock:
+            if len(self.cards) == 0: return True
+            return any(now - self.updated[key] > self.key_max_age.get(key, self.max_age) for key in self.cards)
+
+    def refresh(self):
+        """ query the device and cache its keywords; called in a worker thread """
+        t0 = time.monotonic()
+        from astropy.io import fits
+        hdr = fits.Header()
+        result = self.function(hdr)
+        if result is None: result = hdr
+
+        with self._lock:
+            for card in result.cards:
+                self.cards[card.keyword] = (card.value, card.comment)
+                # age from when we asked, to be conservative
+                self.updated[card.keyword] = t0
+            self.duration = time.monotonic() - t0
+        return self.duration
+
+    def merge(self, hdr):
+        with self._lock:
+            for key, value in self.cards.items():
+                hdr[key] = value
+        return hdr
+
+
+class HeaderSnapshot:
+    """
+    timeout -- default maximum seconds a snapshot waits for devices
+    nworkers -- maximum number of devices queried at once
+    """
+
+    def __init__(self, timeout=1.0, nworkers=8):
+        self.logger = logging.getLogger()
+        self.timeout = timeout
+        self.providers = []
+        self._pool = ThreadPoolExecutor(max_workers=nworkers, thread_name_prefix='header')
+        self._lock = threading.Lock()
+
+    def add_provider(self, name, function, max_age=0.0, key_max_age=None):
+        provider = HeaderProvider(name, function, max_age=max_age, key_max_age=key_max_age)
+        self.providers.append(provider)
+        return provider
+
+    def _run(self, provider):
+        try:
+            return provider.refresh()
+        except Exception as e:
+            self.logger.exception("Error getting header keywords from " + provider.name + ": " + str(e))
+            raise
+
+    def refresh(self, force=False):
+        """
+        Start querying every stale provider (or all of them, if force) without waiting
+
+        Call this early (e.g., when an exposure starts) so the snapshot is
+        ready by the time it's needed. Returns the futures for the queries in flight.
+        """
+        now = time.monotonic()
+        futures = []
+        with self._lock:
+            for provider in self.providers:
+                if provider.future is not None and not provider.future.done():
+                    # already being queried; don't pile up requests
+                    futures.append(provider.future)
+                elif force or provider.stale(now):
+                    provider.future = self._pool.submit(self._run, provider)
+                    futures.append(provider.future)
+        return futures
+
+    def snapshot(self, hdr=None, timeout=None):
+        """
+        A header with the keywords from all devices, in at most timeout seconds
+
+        Keywords are merged in the order the providers were added, on top of hdr
+        """
+        from astropy.io import fits
+        if hdr is None: hdr = fits.Header()
+        if timeout is None: timeout = self.timeout
+
+        futures = self.refresh()
+        if len(futures) > 0:
+            wait(futures, timeout=timeout)
+
+        for provider in self.providers:
+            future = provider.future
+            if future is not None and not future.done():
+                self.logger.warning("Header keywords from " + provider.name + " not ready in " +
+                                    str(timeout) + " s; using cached values")
+            provider.merge(hdr)
+        return hdr
+
+    def close(self):
+        self._pool.shutdown(wait=False)
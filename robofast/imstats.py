@@ -0,0 +1,290 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import numpy as np
+
+"""
+Fast, vectorized image statistics for every frame
+
+background() estimates the sky level and noise with sigma clipping on a
+sample of the pixels; detect() finds the local maxima above a threshold and
+measures all of them at once from second moments in fixed-size stamps; and
+measure() summarizes the frame (sky, star count, FWHM, ellipticity).
+ImageStats runs measure() on frames in a worker pool and hands the results to
+callbacks (autofocus, guiding, quality gating, ...) and/or the FITS header, so
+nobody has to re-read images from disk.
+
+The cost per frame is bounded: the background uses at most maxsample pixels
+and at most maxsources (the brightest) sources are measured. ImageStats
+skips frames rather than falling behind.
+"""
+
+FWHM_PER_SIGMA = 2.0*np.sqrt(2.0*np.log(2.0))
+
+SOURCE_DTYPE = np.dtype([('x', 'f8'), ('y', 'f8'), ('flux', 'f8'), ('peak', 'f8'),
+                         ('fwhm', 'f8'), ('ellipticity', 'f8')])
+
+
+def background(image, nsigma=3.0, maxiter=5, maxsample=100000):
+    """
+    Sigma-clipped sky level and noise of an image
+
+    Uses every Nth pixel, so it costs the same for any image size. The noise
+    is from the median absolute deviation, so stars barely affect it.
+
+    Returns (sky, rms)
+    """
+    flat = image.reshape(-1)
+    # an odd stride so we don't sample the same few columns
+    stride = max(1, flat.size//maxsample) | 1
+    sample = flat[::stride].astype(np.float32)
+
+    sky, rms = 0.0, 0.0
+    for i in range(maxiter):
+        sky = np.median(sample)
+        rms = 1.4826*np.median(np.abs(sample - sky))
+        if rms == 0: break
+        keep = np.abs(sample - sky) < nsigma*rms
+        if keep.all(): break
+        sample = sample[keep]
+    return float(sky), float(rms)
+
+
+def find_peaks(image, threshold, border=1):
+    """
+    (y, x) array indices of the local maxima (over their 8 neighbors) brighter than threshold
+
+    Plateaus only count once. Pixels within border of the edge are ignored.
+    """
+    ny, nx = image.shape
+    border = max(int(border), 1)
+    inner = image[border:ny-border, border:nx-border]
+    iy, ix = np.nonzero(inner > threshold)
+    iy += border
+    ix += border
+
+    values = image[iy, ix]
+    keep = np.ones(len(iy), dtype=bool)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if dy == 0 and dx == 0: continue
+            neighbor = image[iy+dy, ix+dx]
+            # strictly brighter than the neighbors before it, at least as bright as the ones after
+            if (dy, dx) < (0, 0):
+                keep &= values > neighbor
+            else:
+                keep &= values >= neighbor
+    return iy[keep], ix[keep]
+
+
+def detect(image, sky=None, rms=None, threshold=5.0, halfwidth=5, maxsources=500, saturation=None, isophote=3.0):
+    """
+    Find and measure the sources in an image
+
+    Parameters
+    ----------
+    image : 2D array
+    sky, rms : float
+        Sky level and noise (see background); estimated if not given.
+    threshold : float
+        Detection threshold, in rms above the sky.
+    halfwidth : int
+        Half width of the (square) stamps the sources are measured in; use
+        about 1.5x the FWHM (pixels).
+    maxsources : int
+        Only the brightest maxsources peaks are measured.
+    saturation : float
+        Ignore sources that peak at or above this.
+    isophote : float
+        Only pixels more than isophote*rms above the sky are used to measure
+        the sources.
+
+    Returns
+    -------
+    sources : structured array (SOURCE_DTYPE)
+        x, y (array coordinates, 0-based), flux and peak (above the sky),
+        fwhm (pixels, from the second moments) and ellipticity (1 - b/a)
+    """
+    if sky is None or rms is None:
+        sky, rms = background(image)
+
+    h = int(halfwidth)
+    iy, ix = find_peaks(image, sky + threshold*max(rms, 1e-12), border=h)
+    peaks = image[iy, ix].astype(np.float64)
+    if saturation is not None:
+        good = peaks < saturation
+        iy, ix, peaks = iy[good], ix[good], peaks[good]
+    if len(iy) > maxsources:
+        brightest = np.argsort(peaks)[::-1][:maxsources]
+        iy, ix, peaks = iy[brightest], ix[brightest], peaks[brightest]
+
+    sources = np.zeros(len(iy), dtype=SOURCE_DTYPE)
+    if len(iy) == 0: return sources
+
+    # all the stamps at once: (nsources, 2h+1, 2h+1)
+    offsets = np.arange(-h, h+1)
+    stamps = image[iy[:, None, None] + offsets[None, :, None], ix[:, None, None] + offsets[None, None, :]]
+    stamps = stamps.astype(np.float64) - sky
+    # a circular aperture, and only pixels significantly above the sky;
+    # noise far from the center would dominate the second moments of faint stars
+    aperture = (offsets[:, None]**2 + offsets[None, :]**2) <= h*h
+    stamps *= aperture
+    stamps[stamps < isophote*rms] = 0.0
+
+    flux = stamps.sum(axis=(1, 2))
+    flux[flux == 0] = np.nan
+    xc = (stamps.sum(axis=1)*offsets).sum(axis=1)/flux
+    yc = (stamps.sum(axis=2)*offsets).sum(axis=1)/flux
+    dx = offsets[None, :] - xc[:, None]
+    dy = offsets[None, :] - yc[:, None]
+    mxx = (stamps.sum(axis=1)*dx**2).sum(axis=1)/flux
+    myy = (stamps.sum(axis=2)*dy**2).sum(axis=1)/flux
+    mxy = (stamps*dy[:, :, None]*dx[:, None, :]).sum(axis=(1, 2))/flux
+
+    # dropping the pixels below the isophote shrinks the moments of a Gaussian by
+    # g = 1 - u exp(-u)/(1 - exp(-u)), where u = ln(peak/isophote); undo that
+    u = np.log(np.maximum((peaks - sky)/(isophote*max(rms, 1e-12)), 1.0 + 1e-9))
+    g = 1.0 - u*np.exp(-u)/(-np.expm1(-u))
+    mxx /= g
+    myy /= g
+    mxy /= g
+
+    # eigenvalues of the second moment matrix
+    half_trace = 0.5*(mxx + myy)
+    root = np.sqrt(np.maximum(0.25*(mxx - myy)**2 + mxy**2, 0.0))
+    major = half_trace + root
+    minor = np.maximum(half_trace - root, 0.0)
+
+    sources['x'] = ix + xc
+    sources['y'] = iy + yc
+    sources['flux'] = flux
+    sources['peak'] = peaks - sky
+    sources['fwhm'] = FWHM_PER_SIGMA*np.sqrt(half_trace)
+    sources['ellipticity'] = np.where(major > 0, 1.0 - np.sqrt(minor/np.where(major > 0, major, 1.0)), 0.0)
+    return sources[np.isfinite(sources['flux'])]
+
+
+def measure(image, platescale=None, nsigma=3.0, threshold=5.0, halfwidth=5, maxsources=500, saturation=None,
+            maxsample=100000):
+    """
+    Image quality metrics for a frame
+
+    Returns a dictionary with the sky and rms (ADU), nstars, the median fwhm
+    (pixels, and fwhm_arcsec if platescale is given), the median ellipticity,
+    the sources (see detect), and elapsed (seconds it took)
+    """
+    t0 = time.perf_counter()
+    sky, rms = background(image, nsigma=nsigma, maxsample=maxsample)
+    sources = detect(image, sky=sky, rms=rms, threshold=threshold, halfwidth=halfwidth, maxsources=maxsources,
+                     saturation=saturation)
+
+    stats = {'sky': sky,
+             'rms': rms,
+             'nstars': len(sources),
+             'fwhm': float(np.median(sources['fwhm'])) if len(sources) > 0 else np.nan,
+             'ellipticity': float(np.median(sources['ellipticity'])) if len(sources) > 0 else np.nan,
+             'sources': sources}
+    if platescale is not None:
+        stats['fwhm_arcsec'] = stats['fwhm']*platescale
+    stats['elapsed'] = time.perf_counter() - t0
+    return stats
+
+
+def add_header_keys(hdr, stats):
+    """ add the summary of measure() to a FITS header """
+    hdr['SKYLEVEL'] = (round(stats['sky'], 3), 'Sigma-clipped sky level (ADU)')
+    hdr['SKYNOISE'] = (round(stats['rms'], 3), 'Sky noise (ADU)')
+    hdr['NSTARS'] = (stats['nstars'], 'Number of sources detected')
+    if np.isfinite(stats['fwhm']):
+        hdr['FWHM'] = (round(stats['fwhm'], 3), 'Median FWHM (pixels)')
+        if 'fwhm_arcsec' in stats:
+            hdr['FWHMARC'] = (round(stats['fwhm_arcsec'], 3), 'Median FWHM (arcsec)')
+        hdr['ELLIP'] = (round(stats['ellipticity'], 3), 'Median ellipticity (1 - b/a)')
+    return hdr
+
+
+class ImageStats:
+    """
+    Measures frames in a worker pool
+
+    nworkers -- frames measured at once
+    budget -- seconds a frame may take; slower frames are logged, and result()
+              gives up on them (they're written without stats)
+    callbacks -- functions called as callback(stats) with every result (see measure)
+    the rest are passed to measure()
+    """
+
+    def __init__(self, nworkers=1, budget=1.0, **kwargs):
+        self.logger = logging.getLogger()
+        self.nworkers = nworkers
+        self.budget = budget
+        self.kwargs = kwargs
+        self.callbacks = []
+
+        self.latest = None
+        self.nmeasured = 0
+        self.nskipped = 0
+        self.nslow = 0
+
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=nworkers, thread_name_prefix='imstats')
+
+    def measure(self, image, callback=None, **kwargs):
+        stats = measure(image, **dict(self.kwargs, **kwargs))
+        if stats['elapsed'] > self.budget:
+            self.nslow += 1
+            self.logger.warning("Image statistics took " + '{0:.3f}'.format(stats['elapsed']) + " s (budget " +
+                                str(self.budget) + " s)")
+
+        self.latest = stats
+        self.nmeasured += 1
+        for cb in self.callbacks + ([callback] if callback is not None else []):
+            try:
+                cb(stats)
+            except Exception as e:
+                self.logger.exception("Error in image statistics callback: " + str(e))
+        return stats
+
+    def _measure(self, image, callback, kwargs):
+        try:
+            return self.measure(image, callback=callback, **kwargs)
+        finally:
+            with self._lock:
+                self._busy -= 1
+
+    def submit(self, image, callback=None, skip=True, **kwargs):
+        """
+        Measure image in the background; returns a future for the stats
+
+        kwargs override the arguments to measure() for this frame (e.g., platescale)
+        The image must not change until the future is done. If skip is True
+        and every worker is busy, the frame is skipped (returns None) so the
+        stats never fall behind the camera.
+        """
+        with self._lock:
+            if skip and self._busy >= self.nworkers:
+                self.nskipped += 1
+                return None
+            self._busy += 1
+        future = self._pool.submit(self._measure, image, callback, kwargs)
+        future.deadline = time.monotonic() + self.budget
+        return future
+
+    def result(self, future):
+        """
+        The stats from submit, waiting no longer than budget seconds after it was submitted
+
+        Returns None, and counts the frame as skipped, if they aren't ready by then.
+        """
+        try:
+            return future.result(timeout=max(future.deadline - time.monotonic(), 0.0))
+        except TimeoutError:
+            with self._lock:
+                self.nskipped += 1
+            self.logger.warning("Image statistics not done within the budget (" + str(self.budget) + " s); skipped")
+            return None
+
+    def close(self):
+        self._pool.shutdown(wait=True)
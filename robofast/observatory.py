@@ -3,6 +3,9 @@ from pathlib import Path
 
 from robofast import observer
 from robofast import dome
+from robofast import telescope
+from robofast import camera
+from robofast import focusmodel
 
 
 class Observatory:
@@ -21,5 +24,40 @@ class Observatory:
             d = dome.load_dome(dir / dome_config, observer=self.obs, directory=self.directory)
             self.dome[d.id] = d
 
+        # and of telescopes and cameras, by config file name
+        self.telescope = {}
+        for telescope_config in config.get("telescope", []):
+            self.telescope[Path(telescope_config).stem] = telescope.load_telescope(dir / telescope_config)
+        self.camera = {}
+        for camera_config in config.get("camera", []):
+            self.camera[Path(camera_config).stem] = camera.load_camera(dir / camera_config)
+
+        for c in self.camera.values():
+            self.add_header_providers(c)
+
+        # the cameras on a telescope (its instrument list) share its focus model, with the
+        # ambient temperature from the focus_temperature_key header keyword (e.g., AQTEMP1,
+        # a dome's enclosure temperature)
+        self.focus_temperature_key = config.get("focus_temperature_key")
+        for t in self.telescope.values():
+            for instrument in t.instruments:
+                c = self.camera.get(Path(instrument).stem)
+                if c is not None:
+                    focusmodel.share_focus_model(c, t, ambient_temp=self._header_value(c, self.focus_temperature_key))
+
+    def add_header_providers(self, cam):
+        """ put the header keywords of every dome and telescope in cam's frames """
+        devices = [("dome " + str(id), d) for id, d in self.dome.items()] + \
+                  [("telescope " + name, t) for name, t in self.telescope.items()]
+        for name, device in devices:
+            add_header_keys = getattr(device, "add_header_keys", None)
+            if add_header_keys is not None:
+                cam.add_header_provider(name, add_header_keys)
+
+    def _header_value(self, cam, key):
+        """ a function that returns the latest value of a header keyword in cam's frames (None if no key) """
+        if key is None: return None
+        return lambda: cam.header_snapshot.snapshot().get(key)
+
     def observe(self):
         pass
@@ -0,0 +1,880 @@
+import hashlib
+import logging
+import os
+import time
+from pathlib import Path
+import numpy as np
+
+"""
+Pointing models: map where a star actually is (alt, az) to where the telescope
+has to be commanded to put it in the center
+
+RBFPointingModel interpolates the pointing offsets measured at calibration
+stars (see TelescopeBase.build_pointing_model) with radial basis functions on
+the sphere. The points are unit vectors, so distances are chords and there is
+no seam at az = 0/360 or singularity at the zenith; the az offsets are
+wrapped to +/-180 deg before they're interpolated.
+
+The fit solves an N x N system (O(N^3)), so it's cached: from_file saves the
+weights next to the calibration file, keyed on a hash of its contents and the
+kernel, and reloads them in milliseconds as long as neither has changed.
+Evaluation is vectorized over any number of positions.
+
+For large point sets, neighbors=k replaces the global fit with a small fit
+around each calibration point (its k nearest neighbors; O(N k^3) in all), and
+a position is evaluated from the local fits of the few calibration points
+nearest to it, blended with weights that fall to zero before a point stops
+being one of the nearest, so the model stays continuous.
+
+Calibration points can be added and removed one at a time (add_point,
+remove_point) with O(N^2) low-rank updates of the inverse of the
+interpolation matrix instead of a refit, and the leave-one-out residual of
+every point (what the model would predict there without it) comes from one
+pass over that inverse (loo_residuals; Rippa 1999). build() uses both to run a
+pointing model: it rejects bad plate solves as they come in and stops as soon
+as the leave-one-out residuals stop improving.
+
+ParametricPointingModel is the classic TPOINT-style alternative: a sum of
+terms for the physical imperfections of the mount (index errors, collimation,
+axis non-perpendicularity and misalignment, tube and fork flexure, encoder
+eccentricity), fit by linear least squares. With 8-14 terms it needs far
+fewer calibration stars than the RBF model, and it extrapolates sensibly.
+Mounts that apply their own model (Telescope_DFM.change_pointing_coefficients)
+can be loaded with the fitted coefficients (export).
+
+The calibration file has one star per line:
+alt_actual az_actual alt_telescope az_telescope (deg)
+"""
+
+# bump when the cache format or the math changes, so old caches are refit
+CACHE_VERSION = 1
+
+
+def _thin_plate(r2, eps):
+    # r^2 log(r) = r^2 log(r^2)/2, and 0 at r = 0
+    out = np.zeros_like(r2)
+    np.log(r2, out=out, where=r2 > 0)
+    out *= r2
+    out *= 0.5
+    return out
+
+
+# phi(r^2, epsilon) for the supported kernels (the names scipy.interpolate.Rbf uses)
+# they take the squared distance, which is just 2 - 2 cos(separation) for unit vectors
+KERNELS = {'thin_plate': _thin_plate,
+           'linear': lambda r2, eps: np.sqrt(r2),
+           'cubic': lambda r2, eps: r2**1.5,
+           'quintic': lambda r2, eps: r2**2.5,
+           'multiquadric': lambda r2, eps: np.sqrt(r2/eps**2 + 1.0),
+           'inverse': lambda r2, eps: 1.0/np.sqrt(r2/eps**2 + 1.0),
+           'gaussian': lambda r2, eps: np.exp(-r2/eps**2)}
+
+
+def unit_vectors(alt, az):
+    """ (..., 3) unit vectors of alt, az (deg) """
+    alt = np.radians(np.asarray(alt, dtype=np.float64))
+    az = np.radians(np.asarray(az, dtype=np.float64))
+    return np.stack((np.cos(alt)*np.cos(az), np.cos(alt)*np.sin(az), np.sin(alt)), axis=-1)
+
+
+def wrap180(angle):
+    """ angle (deg) wrapped to [-180, 180) """
+    return (np.asarray(angle) + 180.0) % 360.0 - 180.0
+
+
+def file_hash(filename, *extra):
+    """ sha256 of a file's contents and any extra values (e.g., the kernel) """
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    for value in extra:
+        h.update(repr(value).encode())
+    return h.hexdigest()
+
+
+def altaz_to_hadec(alt, az, latitude):
+    """ hour angle and declination (deg) of alt, az (deg; az east of north) """
+    alt, az, lat = np.radians(alt), np.radians(az), np.radians(latitude)
+    dec = np.arcsin(np.clip(np.sin(lat)*np.sin(alt) + np.cos(lat)*np.cos(alt)*np.cos(az), -1.0, 1.0))
+    ha = np.arctan2(-np.cos(alt)*np.sin(az), np.sin(alt)*np.cos(lat) - np.cos(alt)*np.cos(az)*np.sin(lat))
+    return np.degrees(ha), np.degrees(dec)
+
+
+def hadec_to_altaz(ha, dec, latitude):
+    """ alt, az (deg; az east of north, 0-360) of hour angle and declination (deg) """
+    ha, dec, lat = np.radians(ha), np.radians(dec), np.radians(latitude)
+    alt = np.arcsin(np.clip(np.sin(lat)*np.sin(dec) + np.cos(lat)*np.cos(dec)*np.cos(ha), -1.0, 1.0))
+    az = np.arctan2(-np.cos(dec)*np.sin(ha), np.sin(dec)*np.cos(lat) - np.cos(dec)*np.cos(ha)*np.sin(lat))
+    return np.degrees(alt), np.degrees(az) % 360.0
+
+
+def _chord2(a, b):
+    """ squared chord lengths between unit vectors a (..., n, 3) and b (..., m, 3), (..., n, m) """
+    return np.maximum(2.0 - 2.0*(a @ np.swapaxes(b, -1, -2)), 0.0)
+
+
+def _polynomial(v):
+    """ the degree 1 polynomial terms (1, x, y, z) of unit vectors v, (..., 4) """
+    return np.concatenate((np.ones(v.shape[:-1] + (1,)), v), axis=-1)
+
+
+class RBFPointingModel:
+    """
+    function -- the kernel (see KERNELS)
+    epsilon -- the shape parameter for multiquadric, inverse, and gaussian
+               (chord length; default: half the typical spacing of the points;
+               larger values are smoother but quickly become ill conditioned)
+    smoothing -- 0 interpolates the points exactly; larger values smooth
+                 over noisy measurements (e.g., bad plate solves)
+    neighbors -- if set, and there are more points than this, use local fits
+                 to this many points instead of one global fit
+    blend -- the number of nearest local fits blended at each position
+    """
+
+    def __init__(self, function='thin_plate', epsilon=None, smoothing=0.0, neighbors=None, blend=3):
+        self.logger = logging.getLogger()
+        if function not in KERNELS:
+            raise ValueError("Unknown RBF kernel (" + str(function) + "); must be one of " + str(sorted(KERNELS)))
+        self.function = function
+        self.epsilon = epsilon
+        self.smoothing = float(smoothing)
+        self.neighbors = neighbors
+        self.blend = blend
+
+        self.alt = None
+        self.az = None
+        self.centers = None
+        self.offsets = None
+        # global fit: kernel weights (N, 2) and polynomial coefficients (4, 2)
+        self.weights = None
+        self.poly = None
+        # local fits: the neighbors of each point (N, k) and their solutions (N, k+4, 2)
+        self.local_index = None
+        self.local_solution = None
+        self._tree = None
+        # inverse of the interpolation matrix, for add_point, remove_point, and loo_residuals
+        self._inverse = None
+
+    @property
+    def npoints(self):
+        return 0 if self.centers is None else len(self.centers)
+
+    @property
+    def local(self):
+        """ True if the model is made of local fits """
+        return self.neighbors is not None and self.npoints > self.neighbors
+
+    def _kernel(self, r2):
+        return KERNELS[self.function](r2, self._epsilon)
+
+    def _system(self, centers):
+        """ the (N+4, N+4) interpolation matrix [[K + smoothing I, P], [P^T, 0]] for centers (..., N, 3) """
+        n = centers.shape[-2]
+        P = _polynomial(centers)
+        A = np.zeros(centers.shape[:-2] + (n+4, n+4))
+        A[..., :n, :n] = self._kernel(_chord2(centers, centers)) + self.smoothing*np.eye(n)
+        A[..., :n, n:] = P
+        A[..., n:, :n] = np.swapaxes(P, -1, -2)
+        return A
+
+    def fit(self, alt_actual, az_actual, alt_telescope, az_telescope):
+        """ fit the offsets (telescope - actual) at the calibration points (deg) """
+        self.alt = np.asarray(alt_actual, dtype=np.float64).ravel()
+        self.az = np.asarray(az_actual, dtype=np.float64).ravel()
+        self.centers = unit_vectors(self.alt, self.az)
+        self.offsets = np.stack((np.asarray(alt_telescope, dtype=np.float64).ravel() - self.alt,
+                                 wrap180(np.asarray(az_telescope, dtype=np.float64).ravel() - self.az)), axis=-1)
+        n = len(self.centers)
+        if n < 4:
+            raise ValueError("Need at least 4 calibration points for a pointing model; got " + str(n))
+        # half the typical spacing of n points spread over a hemisphere
+        self._epsilon = 0.5*np.sqrt(2.0*np.pi/n) if self.epsilon is None else float(self.epsilon)
+
+        self.weights, self.poly = None, None
+        self.local_index, self.local_solution = None, None
+        self._inverse = None
+
+        t0 = time.perf_counter()
+        if self.local:
+            self._fit_local()
+        else:
+            A = self._system(self.centers)
+            b = np.vstack((self.offsets, np.zeros((4, 2))))
+            solution = np.linalg.solve(A, b)
+            self.weights = solution[:n]
+            self.poly = solution[n:]
+        self.logger.debug("Fit a " + self.function + " pointing model to " + str(n) + " points in " +
+                          '{0:.3f}'.format(time.perf_counter() - t0) + " s")
+        return self
+
+    def _fit_local(self, chunk=1000):
+        from scipy.spatial import cKDTree
+        self._tree = cKDTree(self.centers)
+        k = self.neighbors
+        self.local_index = self._tree.query(self.centers, k=k)[1]
+        self.local_solution = np.empty((self.npoints, k+4, 2))
+        for i in range(0, self.npoints, chunk):
+            index = self.local_index[i:i+chunk]
+            b = np.concatenate((self.offsets[index], np.zeros((len(index), 4, 2))), axis=1)
+            self.local_solution[i:i+chunk] = np.linalg.solve(self._system(self.centers[index]), b)
+
+    ################## INCREMENTAL UPDATES ##################
+    def _refit(self):
+        self.fit(self.alt, self.az, self.alt + self.offsets[:, 0], self.az + self.offsets[:, 1])
+
+    def _ensure_inverse(self):
+        if self._inverse is None:
+            self._inverse = np.linalg.inv(self._system(self.centers))
+        return self._inverse
+
+    def _solve(self):
+        """ the weights from the inverse: [weights; poly] = inverse [offsets; 0] """
+        n = self.npoints
+        self.weights = self._inverse[:n, :n] @ self.offsets
+        self.poly = self._inverse[n:, :n] @ self.offsets
+
+    def add_point(self, alt_actual, az_actual, alt_telescope, az_telescope):
+        """
+        Add a calibration point (deg) without refitting: O(N^2)
+
+        The new point is bordered onto the inverse of the interpolation matrix
+        (block inverse with the Schur complement). epsilon stays what it was at the last fit.
+        """
+        alt_actual, az_actual = float(alt_actual), float(az_actual)
+        offset = (float(alt_telescope) - alt_actual, float(wrap180(float(az_telescope) - az_actual)))
+        if self.centers is None:
+            self.alt, self.az = np.zeros(0), np.zeros(0)
+            self.centers, self.offsets = np.zeros((0, 3)), np.zeros((0, 2))
+
+        v = unit_vectors(alt_actual, az_actual)
+        n = self.npoints
+        incremental = self.weights is not None and not self.local and n >= 4
+        if incremental:
+            M = self._ensure_inverse()
+            # the new row and column of the interpolation matrix, in the order [points, poly]
+            u = np.concatenate((self._kernel(_chord2(v[None, :], self.centers))[0], _polynomial(v)))
+            c = float(self._kernel(np.zeros(1))[0]) + self.smoothing
+            Mu = M @ u
+            schur = c - u @ Mu
+            if abs(schur) < 1e-12*max(abs(c), 1.0):
+                raise ValueError("Calibration point at alt=" + str(alt_actual) + ", az=" + str(az_actual) +
+                                 " duplicates another; use smoothing > 0 to allow that")
+            bordered = np.empty((n+5, n+5))
+            bordered[:n+4, :n+4] = M + np.outer(Mu, Mu)/schur
+            bordered[:n+4, n+4] = -Mu/schur
+            bordered[n+4, :n+4] = -Mu/schur
+            bordered[n+4, n+4] = 1.0/schur
+            # move the new point in front of the polynomial terms
+            order = np.concatenate((np.arange(n), [n+4], np.arange(n, n+4)))
+            self._inverse = bordered[np.ix_(order, order)]
+
+        self.alt = np.append(self.alt, alt_actual)
+        self.az = np.append(self.az, az_actual)
+        self.centers = np.vstack((self.centers, v))
+        self.offsets = np.vstack((self.offsets, offset))
+        if incremental:
+            self._solve()
+        elif self.npoints >= 4:
+            self._refit()
+
+    def remove_point(self, index):
+        """ remove a calibration point (by index) without refitting: O(N^2) """
+        n = self.npoints
+        keep = np.delete(np.arange(n), index)
+        incremental = self.weights is not None and not self.local and n > 4
+        if incremental:
+            # the inverse of a matrix with a row and column removed, from the inverse of the full one
+            M = self._ensure_inverse()
+            rest = np.delete(np.arange(n+4), index)
+            self._inverse = M[np.ix_(rest, rest)] - np.outer(M[rest, index], M[index, rest])/M[index, index]
+
+        self.alt, self.az = self.alt[keep], self.az[keep]
+        self.centers, self.offsets = self.centers[keep], self.offsets[keep]
+        if incremental:
+            self._solve()
+        elif self.npoints >= 4:
+            self._refit()
+        else:
+            self.weights, self.poly, self._inverse = None, None, None
+
+    def loo_offsets(self, chunk=1000):
+        """
+        (alt, az) leave-one-out residuals (deg) of every calibration point
+
+        The measured offset minus what the model fit to all the other points
+        predicts there: weight/inverse diagonal for each point (Rippa's formula).
+        For local models, each point's own local fit is used
+        """
+        n = self.npoints
+        if not self.local:
+            M = self._ensure_inverse()
+            diagonal = np.diagonal(M)[:n]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                loo = self.weights/diagonal[:, None]
+            loo[~np.isfinite(loo)] = np.inf
+            return loo[:, 0], loo[:, 1]
+
+        loo = np.empty((n, 2))
+        for i in range(0, n, chunk):
+            index = self.local_index[i:i+chunk]
+            M = np.linalg.inv(self._system(self.centers[index]))
+            # where each point is in its own neighbor list (first, unless there are duplicates)
+            rows = np.arange(len(index))
+            own = np.argmax(index == np.arange(i, i+len(index))[:, None], axis=1)
+            loo[i:i+chunk] = self.local_solution[i+rows, own]/M[rows, own, own][:, None]
+        return loo[:, 0], loo[:, 1]
+
+    def loo_residuals(self):
+        """ the on-sky leave-one-out residual (arcsec) of every calibration point (see loo_offsets) """
+        dalt, daz = self.loo_offsets()
+        return 3600.0*np.hypot(dalt, daz*np.cos(np.radians(self.alt)))
+
+    def offset(self, alt, az, chunk=1000):
+        """ the (alt, az) offsets (deg) at positions alt, az (deg; any shape) """
+        v = unit_vectors(alt, az)
+        shape = v.shape[:-1]
+        v = v.reshape(-1, 3)
+        out = np.empty((len(v), 2))
+        for i in range(0, len(v), chunk):
+            block = v[i:i+chunk]
+            out[i:i+chunk] = self._offset_local(block) if self.local else self._offset_global(block)
+        return out[:, 0].reshape(shape), out[:, 1].reshape(shape)
+
+    def _offset_global(self, v):
+        return self._kernel(_chord2(v, self.centers)) @ self.weights + _polynomial(v) @ self.poly
+
+    def _offset_local(self, v):
+        k = self.neighbors
+        m = min(self.blend, self.npoints - 1)
+        distance, nearest = self._tree.query(v, k=m+1)
+
+        # modified Shepard weights: 1/d^2, less that of the first point left out, so a local
+        # fit's weight is already zero when it drops out of the nearest m
+        d2 = np.maximum(distance**2, 1e-24)
+        w = np.maximum(1.0/d2[:, :m] - 1.0/d2[:, m:], 0.0)
+        w /= w.sum(axis=1, keepdims=True)
+
+        out = np.zeros((len(v), 2))
+        for j in range(m):
+            index = self.local_index[nearest[:, j]]
+            solution = self.local_solution[nearest[:, j]]
+            K = self._kernel(_chord2(v[:, None, :], self.centers[index])[:, 0])
+            value = np.einsum('mk,mkj->mj', K, solution[:, :k]) + np.einsum('mp,mpj->mj', _polynomial(v),
+                                                                             solution[:, k:])
+            out += w[:, j:j+1]*value
+        return out
+
+    def __call__(self, alt, az):
+        """
+        Map actual alt/az (deg) to telescope alt/az
+
+        Takes scalars (returns floats) or arrays of any shape (returns arrays)
+        """
+        dalt, daz = self.offset(alt, az)
+        alt_telescope = np.asarray(alt, dtype=np.float64) + dalt
+        az_telescope = (np.asarray(az, dtype=np.float64) + daz) % 360.0
+        if np.ndim(alt_telescope) == 0:
+            return float(alt_telescope), float(az_telescope)
+        return alt_telescope, az_telescope
+
+    ################## CACHE ##################
+    def save(self, filename, key=''):
+        """ save the fit (atomically) to a .npz file, tagged with key """
+        empty = np.zeros((0, 2))
+        tmpname = str(filename) + '.part.npz'
+        np.savez(tmpname, version=CACHE_VERSION, key=key, function=self.function, epsilon=self._epsilon,
+                 smoothing=self.smoothing, neighbors=-1 if self.neighbors is None else self.neighbors,
+                 blend=self.blend, alt=self.alt, az=self.az, offsets=self.offsets,
+                 weights=empty if self.weights is None else self.weights,
+                 poly=empty if self.poly is None else self.poly,
+                 local_index=empty if self.local_index is None else self.local_index,
+                 local_solution=empty if self.local_solution is None else self.local_solution)
+        os.replace(tmpname, filename)
+
+    @classmethod
+    def load(cls, filename, key=None):
+        """ a model saved with save(), or None if it's missing, stale (key doesn't match), or unreadable """
+        try:
+            with np.load(filename) as saved:
+                if int(saved['version']) != CACHE_VERSION: return None
+                if key is not None and str(saved['key']) != key: return None
+                neighbors = int(saved['neighbors'])
+                model = cls(function=str(saved['function']), epsilon=float(saved['epsilon']),
+                            smoothing=float(saved['smoothing']), neighbors=None if neighbors < 0 else neighbors,
+                            blend=int(saved['blend']))
+                model._epsilon = model.epsilon
+                model.alt = saved['alt']
+                model.az = saved['az']
+                model.offsets = saved['offsets']
+                model.centers = unit_vectors(model.alt, model.az)
+                if model.local:
+                    model.local_index = saved['local_index']
+                    model.local_solution = saved['local_solution']
+                else:
+                    model.weights = saved['weights']
+                    model.poly = saved['poly']
+        except (OSError, KeyError, ValueError):
+            return None
+
+        if model.local:
+            from scipy.spatial import cKDTree
+            model._tree = cKDTree(model.centers)
+        return model
+
+    @classmethod
+    def from_file(cls, pointing_file, function='thin_plate', epsilon=None, smoothing=0.0, neighbors=None, blend=3,
+                  cache=True, cache_file=None):
+        """
+        The model for a calibration file, from the cache if it's up to date
+
+        cache_file defaults to <pointing_file>.<function>.npz
+        """
+        logger = logging.getLogger()
+        key = file_hash(pointing_file, CACHE_VERSION, function, epsilon, smoothing, neighbors, blend)
+        if cache_file is None: cache_file = str(pointing_file) + '.' + function + '.npz'
+
+        if cache and Path(cache_file).exists():
+            model = cls.load(cache_file, key=key)
+            if model is not None:
+                logger.debug("Loaded the pointing model from " + str(cache_file))
+                return model
+
+        alt_actual, az_actual, alt_telescope, az_telescope = np.loadtxt(pointing_file, unpack=True, ndmin=2)
+        model = cls(function=function, epsilon=epsilon, smoothing=smoothing, neighbors=neighbors, blend=blend)
+        model.fit(alt_actual, az_actual, alt_telescope, az_telescope)
+        if cache:
+            try:
+                model.save(cache_file, key=key)
+            except OSError as e:
+                logger.warning("Could not cache the pointing model in " + str(cache_file) + ": " + str(e))
+        return model
+
+
+################## PARAMETRIC MODEL ##################
+ARCSEC = 1.0/3600.0
+
+
+def _equatorial_terms(h, d, lat):
+    """
+    {term: (dH, dDec)} for an equatorial mount at hour angle h, declination d,
+    latitude lat (radians), per arcsec of each coefficient (in arcsec)
+    """
+    sh, ch, sd, cd = np.sin(h), np.cos(h), np.sin(d), np.cos(d)
+    sl, cl = np.sin(lat), np.cos(lat)
+    secd = 1.0/np.maximum(cd, 1e-6)
+    tand = sd*secd
+    zero = np.zeros_like(h)
+    one = np.ones_like(h)
+    # sine of the altitude, for the tan(z) flexure
+    salt = np.maximum(sl*sd + cl*cd*ch, 0.05)
+    return {'IH': (-one, zero),                          # hour angle index error
+            'ID': (zero, -one),                          # declination index error
+            'CH': (-secd, zero),                         # east-west collimation error
+            'NP': (-tand, zero),                         # HA/dec axis non-perpendicularity
+            'MA': (-ch*tand, sh),                        # polar axis misalignment, east-west
+            'ME': (sh*tand, ch),                         # polar axis misalignment, in elevation
+            'TF': (cl*sh*secd, cl*ch*sd - sl*cd),        # tube flexure, proportional to sin(z)
+            'TX': (cl*sh*secd/salt, (cl*ch*sd - sl*cd)/salt),  # tube flexure, proportional to tan(z)
+            'FO': (zero, ch),                            # fork flexure
+            'DAF': (-(cl*ch + sl*tand), zero),           # declination axis flexure
+            'HCES': (sh, zero),                          # HA encoder eccentricity (sine, cosine)
+            'HCEC': (ch, zero),
+            'DCES': (zero, sd),                          # dec encoder eccentricity (sine, cosine)
+            'DCEC': (zero, cd)}
+
+
+def _altaz_terms(a, e):
+    """ {term: (dAz, dAlt)} for an alt-az mount at azimuth a, altitude e (radians), per arcsec """
+    sa, ca, se, ce = np.sin(a), np.cos(a), np.sin(e), np.cos(e)
+    sece = 1.0/np.maximum(ce, 1e-6)
+    tane = se*sece
+    zero = np.zeros_like(a)
+    one = np.ones_like(a)
+    return {'IA': (-one, zero),                          # azimuth index error
+            'IE': (zero, one),                           # elevation index error
+            'CA': (-sece, zero),                         # left-right collimation error
+            'NPAE': (-tane, zero),                       # az/el axis non-perpendicularity
+            'AN': (-sa*tane, -ca),                       # azimuth axis tilt, north-south
+            'AW': (-ca*tane, sa),                        # azimuth axis tilt, east-west
+            'TF': (zero, ce),                            # tube flexure, proportional to cos(alt)
+            'TX': (zero, ce/np.maximum(se, 0.05)),       # tube flexure, proportional to cot(alt)
+            'ACES': (sa, zero),                          # azimuth encoder eccentricity (sine, cosine)
+            'ACEC': (ca, zero),
+            'ECES': (zero, se)}                          # elevation encoder eccentricity (the cosine term is TF)
+
+
+TERMS = {'equatorial': ('IH', 'ID', 'CH', 'NP', 'MA', 'ME', 'TF', 'TX', 'FO', 'DAF', 'HCES', 'HCEC', 'DCES', 'DCEC'),
+         'altaz': ('IA', 'IE', 'CA', 'NPAE', 'AN', 'AW', 'TF', 'TX', 'ACES', 'ACEC', 'ECES')}
+
+# the index terms, which the DFM TCS model doesn't have
+NOT_EXPORTED = ('IH', 'ID')
+
+# enough to describe most mounts, and few enough to fit from ~15-20 stars
+# (DAF can't be fit together with NP and HCEC; it's the same as -cos(lat) HCEC - sin(lat) NP)
+DEFAULT_TERMS = {'equatorial': ('IH', 'ID', 'CH', 'NP', 'MA', 'ME', 'TF', 'FO'),
+                 'altaz': ('IA', 'IE', 'CA', 'NPAE', 'AN', 'AW', 'TF')}
+
+
+class ParametricPointingModel:
+    """
+    mount -- 'equatorial' (the model is in hour angle and declination) or 'altaz'
+    latitude -- of the site (deg), for equatorial mounts
+    terms -- which of TERMS[mount] to fit (default: DEFAULT_TERMS[mount])
+
+    The coefficients are in arcsec. Like RBFPointingModel, calling the model
+    maps actual alt/az (deg) to the alt/az to command.
+    """
+
+    def __init__(self, mount='equatorial', latitude=None, terms=None):
+        self.logger = logging.getLogger()
+        if mount not in TERMS:
+            raise ValueError("Unknown mount type (" + str(mount) + "); must be one of " + str(sorted(TERMS)))
+        if mount == 'equatorial' and latitude is None:
+            raise ValueError("The latitude is required for an equatorial pointing model")
+        self.mount = mount
+        self.latitude = latitude
+        self.terms = DEFAULT_TERMS[mount] if terms is None else tuple(terms)
+        for term in self.terms:
+            if term not in TERMS[mount]:
+                raise ValueError("Unknown " + mount + " pointing term (" + str(term) + "); must be one of " +
+                                 str(TERMS[mount]))
+
+        self.coefficients = None
+        self.sigma = None
+        self.rms = None
+        self._coeffs = None
+        self._design_matrix = None
+        self._residuals = None
+        self.alt = np.zeros(0)
+        self.az = np.zeros(0)
+        self.alt_telescope = np.zeros(0)
+        self.az_telescope = np.zeros(0)
+
+    @property
+    def npoints(self):
+        return len(self.alt)
+
+    def _mount_coords(self, alt, az):
+        """ (x, y) mount axes (deg): (ha, dec) or (az, alt) """
+        if self.mount == 'equatorial':
+            return altaz_to_hadec(alt, az, self.latitude)
+        return np.asarray(az, dtype=np.float64), np.asarray(alt, dtype=np.float64)
+
+    def _sky_coords(self, x, y):
+        if self.mount == 'equatorial':
+            return hadec_to_altaz(x, y, self.latitude)
+        return y, x % 360.0
+
+    def design(self, x, y):
+        """ (dx, dy) basis matrices, (..., nterms), in deg per arcsec of each coefficient, at mount coordinates x, y (deg) """
+        x, y = np.radians(np.asarray(x, dtype=np.float64)), np.radians(np.asarray(y, dtype=np.float64))
+        if self.mount == 'equatorial':
+            basis = _equatorial_terms(x, y, np.radians(self.latitude))
+        else:
+            basis = _altaz_terms(x, y)
+        dx = np.stack([basis[term][0] for term in self.terms], axis=-1)*ARCSEC
+        dy = np.stack([basis[term][1] for term in self.terms], axis=-1)*ARCSEC
+        return dx, dy
+
+    def fit(self, alt_actual, az_actual, alt_telescope, az_telescope):
+        """ least squares fit of the coefficients to the calibration points (deg) """
+        self.alt = np.asarray(alt_actual, dtype=np.float64).ravel()
+        self.az = np.asarray(az_actual, dtype=np.float64).ravel()
+        self.alt_telescope = np.asarray(alt_telescope, dtype=np.float64).ravel()
+        self.az_telescope = np.asarray(az_telescope, dtype=np.float64).ravel()
+        x, y = self._mount_coords(self.alt, self.az)
+        xt, yt = self._mount_coords(self.alt_telescope, self.az_telescope)
+        n = len(x)
+        if 2*n < len(self.terms):
+            raise ValueError("Need at least " + str((len(self.terms)+1)//2) + " calibration points for " +
+                             str(len(self.terms)) + " terms; got " + str(n))
+
+        # the x axis residuals are weighted by cos(y), so all residuals are on the sky
+        w = np.cos(np.radians(y))
+        dx, dy = self.design(x, y)
+        A = np.vstack((dx*w[:, None], dy))
+        b = np.concatenate((wrap180(xt - x)*w, yt - y))
+
+        coeffs, _, rank, _ = np.linalg.lstsq(A, b, rcond=None)
+        if rank < len(self.terms):
+            self.logger.warning("The pointing model terms are degenerate for these calibration points (rank " +
+                                str(rank) + " of " + str(len(self.terms)) + "); use fewer terms or more of the sky")
+
+        residuals = (b - A @ coeffs)/ARCSEC
+        dof = max(len(b) - len(self.terms), 1)
+        self.coefficients = dict(zip(self.terms, (float(c) for c in coeffs)))
+        # the rms on-sky distance of the stars from the model
+        self.rms = float(np.sqrt(np.sum(residuals**2)/n))
+        covariance = np.linalg.pinv(A.T @ A)*ARCSEC**2*np.sum(residuals**2)/dof
+        self.sigma = dict(zip(self.terms, (float(s) for s in np.sqrt(np.diag(covariance)))))
+        self._coeffs = coeffs
+        self._design_matrix = A
+        self._residuals = b - A @ coeffs
+        self.logger.debug("Fit a " + str(len(self.terms)) + " term " + self.mount + " pointing model to " + str(n) +
+                          " points; rms " + '{0:.2f}'.format(self.rms) + '"')
+        return self
+
+    ################## INCREMENTAL UPDATES ##################
+    def _refit(self):
+        # wait for enough points that every one can be left out
+        if 2*(self.npoints - 1) >= len(self.terms):
+            self.fit(self.alt, self.az, self.alt_telescope, self.az_telescope)
+        else:
+            self.coefficients = None
+            self._coeffs = None
+            self._design_matrix = None
+            self._residuals = None
+
+    def _fitted(self):
+        """ the coefficients as an array; ValueError if the model hasn't been fit """
+        if self._coeffs is None:
+            raise ValueError("The pointing model hasn't been fit (" + str(self.npoints) + " points)")
+        return self._coeffs
+
+    def add_point(self, alt_actual, az_actual, alt_telescope, az_telescope):
+        """ add a calibration point (deg) and refit (a few terms is cheap to refit; see RBFPointingModel.add_point) """
+        self.alt = np.append(self.alt, float(alt_actual))
+        self.az = np.append(self.az, float(az_actual))
+        self.alt_telescope = np.append(self.alt_telescope, float(alt_telescope))
+        self.az_telescope = np.append(self.az_telescope, float(az_telescope))
+        self._refit()
+
+    def remove_point(self, index):
+        """ remove a calibration point (by index) and refit """
+        self.alt, self.az = np.delete(self.alt, index), np.delete(self.az, index)
+        self.alt_telescope = np.delete(self.alt_telescope, index)
+        self.az_telescope = np.delete(self.az_telescope, index)
+        self._refit()
+
+    def loo_residuals(self):
+        """
+        the on-sky leave-one-out residual (arcsec) of every calibration point
+
+        From the hat matrix: each star's two residuals r divided by (I - H),
+        with H its 2x2 block, all at once
+        """
+        self._fitted()
+        A = self._design_matrix
+        n = self.npoints
+        rows = np.stack((np.arange(n), np.arange(n, 2*n)), axis=1)
+        Ai = A[rows]
+        H = Ai @ np.linalg.pinv(A.T @ A) @ np.swapaxes(Ai, 1, 2)
+        r = self._residuals[rows]
+        loo = np.full(n, np.inf)
+        det = np.linalg.det(np.eye(2) - H)
+        ok = np.abs(det) > 1e-9
+        loo[ok] = np.hypot(*np.linalg.solve(np.eye(2) - H[ok], r[ok][:, :, None])[:, :, 0].T)/ARCSEC
+        return loo
+
+    def offset(self, alt, az):
+        """ the (x, y) mount axis corrections (deg) at actual alt, az (deg) """
+        x, y = self._mount_coords(alt, az)
+        coeffs = self._fitted()
+        dx, dy = self.design(x, y)
+        return dx @ coeffs, dy @ coeffs
+
+    def __call__(self, alt, az):
+        """ Map actual alt/az (deg) to telescope alt/az; scalars (returns floats) or arrays """
+        coeffs = self._fitted()
+        x, y = self._mount_coords(alt, az)
+        dx, dy = self.design(x, y)
+        alt_telescope, az_telescope = self._sky_coords(x + dx @ coeffs, y + dy @ coeffs)
+        if np.ndim(alt_telescope) == 0:
+            return float(alt_telescope), float(az_telescope)
+        return alt_telescope, az_telescope
+
+    def residuals(self, alt_actual, az_actual, alt_telescope, az_telescope):
+        """ on-sky (x, y) residuals (arcsec) of calibration points from the model """
+        x, y = self._mount_coords(alt_actual, az_actual)
+        xt, yt = self._mount_coords(alt_telescope, az_telescope)
+        px, py = self.offset(alt_actual, az_actual)
+        return wrap180(xt - x - px)*np.cos(np.radians(y))/ARCSEC, (yt - y - py)/ARCSEC
+
+    ################## EXPORT ##################
+    def dfm_coefficients(self, tbar=0.0):
+        """
+        The fit as keyword arguments for Telescope_DFM.change_pointing_coefficients (arcsec, deg)
+
+        The index terms (IH, ID) aren't part of the TCS model; they stay in
+        software (see index_model).
+        """
+        if self.mount != 'equatorial':
+            raise ValueError("The DFM TCS only takes equatorial pointing coefficients")
+        c = {term: self.coefficients.get(term, 0.0) for term in TERMS['equatorial']}
+        return {'tbar': tbar,
+                'elevation_misalignment': c['ME'],
+                'azimuth_misalignment': c['MA'],
+                'collimation': c['CH'],
+                'non_perpendicularity': c['NP'],
+                'ha_encoder_eccentricity': float(np.hypot(c['HCES'], c['HCEC'])),
+                'ha_encoder_eccentricity_phase_angle': float(np.degrees(np.arctan2(c['HCEC'], c['HCES']))),
+                'ha_encoder_eccentricity_x4': 0.0,
+                'dec_encoder_eccentricity': float(np.hypot(c['DCES'], c['DCEC'])),
+                'dec_encoder_eccentricity_phase_angle': float(np.degrees(np.arctan2(c['DCEC'], c['DCES']))),
+                'dec_encoder_eccentricity_x4': 0.0,
+                'dec_encoder_eccentricity_phase_angle_x4': 0.0,
+                'tube_flexure_sin': c['TF'],
+                'tube_flexure_tan': c['TX'],
+                'fork_flexure': c['FO'],
+                'declination_axis_flexure': c['DAF']}
+
+    def index_model(self):
+        """
+        A model of just the terms the mount doesn't take (IH, ID), to apply in
+        software after export; None if the fit has none
+        """
+        terms = tuple(term for term in self.terms if term in NOT_EXPORTED)
+        if len(terms) == 0: return None
+        model = ParametricPointingModel(mount=self.mount, latitude=self.latitude, terms=terms)
+        model.coefficients = {term: self.coefficients[term] for term in terms}
+        model._coeffs = np.array([self.coefficients[term] for term in terms])
+        return model
+
+    def export(self, telescope):
+        """
+        Load the coefficients into a mount that applies its own model and turn it on
+
+        The mount must have can_set_pointing_coefficients. Returns False if it
+        doesn't (then the model has to be applied in software, as
+        TelescopeBase.slew does). The index terms are left to index_model.
+        """
+        if self.mount != 'equatorial' or not getattr(telescope, 'can_set_pointing_coefficients', False):
+            self.logger.warning("This mount can't apply the pointing model itself")
+            return False
+        self._fitted()
+        telescope.change_pointing_coefficients(**self.dfm_coefficients())
+        telescope.apply_mount_corrections(1)
+        self.logger.info("Loaded the pointing model into the mount: " +
+                         ', '.join(term + '=' + '{0:.2f}'.format(value) for term, value in self.coefficients.items()
+                                   if term not in NOT_EXPORTED))
+        return True
+
+    @classmethod
+    def from_file(cls, pointing_file, mount='equatorial', latitude=None, terms=None):
+        """ fit a calibration file (see RBFPointingModel.from_file; no cache is needed) """
+        alt_actual, az_actual, alt_telescope, az_telescope = np.loadtxt(pointing_file, unpack=True, ndmin=2)
+        model = cls(mount=mount, latitude=latitude, terms=terms).fit(alt_actual, az_actual, alt_telescope, az_telescope)
+        model.logger.info("Fit a " + str(len(model.terms)) + " term " + mount + " pointing model to " +
+                          str(model.npoints) + " points; rms " + '{0:.2f}'.format(model.rms) + '"')
+        return model
+
+
+################## BUILDING A MODEL ##################
+def sky_positions(npoints, min_alt=25.0, max_alt=85.0):
+    """
+    (alt, az) (deg) of npoints positions spread evenly over the sky
+
+    They're in a low-discrepancy order (the R2 sequence; Roberts 2018), so any
+    first few cover the sky about as well as possible, and a run can stop early
+    """
+    k = np.arange(npoints)
+    # the plastic number: x^3 = x + 1
+    g = 1.32471795724474602596
+    u = (0.5 + k/g) % 1.0
+    v = (0.5 + k/g**2) % 1.0
+    # uniform in sin(alt), so equal areas
+    z0, z1 = np.sin(np.radians(min_alt)), np.sin(np.radians(max_alt))
+    alt = np.degrees(np.arcsin(z0 + (z1 - z0)*u))
+    return alt, 360.0*v
+
+
+def build(model, measure, positions, nsigma=4.0, min_points=None, tolerance=0.05, patience=5, callback=None):
+    """
+    Run a pointing model: measure positions, reject outliers, and stop once the model has converged
+
+    Parameters
+    ----------
+    model : RBFPointingModel or ParametricPointingModel
+        Points are added to it (it may already have some).
+    measure : function
+        measure(alt, az) slews near alt, az and returns (alt_actual,
+        az_actual, alt_telescope, az_telescope) in deg (e.g., from a plate
+        solve), or None if it failed.
+    positions : iterable
+        (alt, az) pairs to try, in order (e.g., zip(*sky_positions(100))).
+    nsigma : float
+        A point whose leave-one-out residual is more than nsigma times the
+        typical (1.4826 x median) one is rejected, if the other points'
+        leave-one-out residuals are smaller without it.
+    min_points : int
+        Points before outliers and convergence are checked (default: 10, or
+        twice the number of terms).
+    tolerance, patience : float, int
+        Stop once the rms leave-one-out residual has changed by less than
+        tolerance (fractional) over the last patience points.
+
+    Returns
+    -------
+    summary : dict
+        npoints, rejected (the points, as measured), failed (count), rms
+        (the final rms leave-one-out residual, arcsec), converged, and
+        history (rms after each point)
+    """
+    logger = logging.getLogger()
+    if min_points is None:
+        min_points = 2*len(model.terms) if hasattr(model, 'terms') else 10
+    summary = {'rejected': [], 'failed': 0, 'history': [], 'rms': None, 'converged': False}
+
+    for alt, az in positions:
+        try:
+            point = measure(alt, az)
+        except Exception as e:
+            logger.exception("Error measuring the pointing at alt=" + str(alt) + ", az=" + str(az) + ": " + str(e))
+            point = None
+        if point is None:
+            summary['failed'] += 1
+            continue
+
+        model.add_point(*point)
+        if model.npoints < min_points: continue
+
+        loo = model.loo_residuals()
+        worst = int(np.argmax(loo))
+        typical = 1.4826*np.median(loo)
+        if loo[worst] > nsigma*typical:
+            # a bad plate solve (or a bad point from earlier that stands out now) also spoils the
+            # predictions of its neighbors; a good point far from the others (where the model
+            # extrapolates) doesn't, so it's kept if the others are predicted worse without it
+            suspect = _measured_point(model, worst)
+            model.remove_point(worst)
+            without = model.loo_residuals()
+            if np.sqrt(np.mean(without**2)) < np.sqrt(np.mean(np.delete(loo, worst)**2)):
+                summary['rejected'].append(suspect)
+                logger.warning("Rejected the pointing at alt=" + '{0:.2f}'.format(suspect[0]) + ", az=" +
+                               '{0:.2f}'.format(suspect[1]) + " (leave-one-out residual " +
+                               '{0:.1f}'.format(loo[worst]) + '" vs typical ' + '{0:.1f}'.format(typical) + '")')
+                loo = without
+                if model.npoints < min_points: continue
+            else:
+                model.add_point(*suspect)
+                loo = model.loo_residuals()
+
+        rms = float(np.sqrt(np.mean(loo**2)))
+        summary['history'].append(rms)
+        logger.info("Pointing model: " + str(model.npoints) + " points, rms leave-one-out residual " +
+                    '{0:.2f}'.format(rms) + '"')
+        if callback is not None: callback(model, rms)
+
+        history = summary['history']
+        if len(history) > patience and abs(history[-1] - history[-1-patience]) <= tolerance*history[-1]:
+            summary['converged'] = True
+            break
+
+    summary['npoints'] = model.npoints
+    summary['rms'] = summary['history'][-1] if summary['history'] else None
+    return summary
+
+
+def _measured_point(model, index):
+    """ (alt_actual, az_actual, alt_telescope, az_telescope) of a calibration point """
+    if hasattr(model, 'offsets'):
+        return (float(model.alt[index]), float(model.az[index]), float(model.alt[index] + model.offsets[index, 0]),
+                float((model.az[index] + model.offsets[index, 1]) % 360.0))
+    return (float(model.alt[index]), float(model.az[index]), float(model.alt_telescope[index]),
+            float(model.az_telescope[index]))
+
+
+def calibration_points(model):
+    """ (alt_actual, az_actual, alt_telescope, az_telescope) arrays of a model's points, to save """
+    return np.array([_measured_point(model, i) for i in range(model.npoints)]).reshape(-1, 4).T
@@ -0,0 +1,247 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+from astropy.io import fits
+
+# local imports
+from robofast import imstats
+
+"""
+Quick-look reduction of every frame as it lands on disk
+
+QuickLook follows a fitswriter.FitsWriter (watch) and hands each new frame to
+a process pool, which subtracts the master bias and dark (scaled by EXPTIME),
+divides by the master flat, measures the result (imstats.measure), and writes
+a reduced copy and/or a thumbnail. The results go to callbacks.
+
+The masters (from calibration.py) are converted once to .npy files in
+cache_dir and memory-mapped by every worker when it starts, so they're shared
+through the page cache instead of being reloaded (or copied) per frame.
+
+Acquisition never waits for the quick look: submit() only queues a frame if
+fewer than maxpending are in flight, otherwise the frame is skipped (and
+counted), so a slow reduction drops frames instead of backing up the writer.
+"""
+
+# the masters, memory-mapped once per worker process (see _init_worker)
+_masters = {}
+
+
+def cache_master(filename, cache_dir=None):
+    """
+    The master frame in filename as a float32 .npy file, for memory mapping
+
+    The .npy file is only rewritten when the master is newer. Returns its path
+    """
+    filename = Path(filename)
+    if filename.suffix == '.npy': return filename
+    cache_dir = filename.parent if cache_dir is None else Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    cached = cache_dir / (filename.name + '.npy')
+    if not cached.exists() or cached.stat().st_mtime < filename.stat().st_mtime:
+        data = fits.getdata(filename).astype(np.float32)
+        tmpname = cached.with_name(cached.name + '.part.npy')
+        np.save(tmpname, data)
+        os.replace(tmpname, cached)
+    return cached
+
+
+def _init_worker(masters):
+    _masters.clear()
+    for name, filename in masters.items():
+        if filename is not None:
+            _masters[name] = np.load(filename, mmap_mode='r')
+
+
+def _section(master, shape, hdr):
+    """
+    The part of a (full frame, unbinned) master that matches a frame
+
+    Uses DETSEC (CameraBase.get_header_keys) for subframes; returns None if the
+    frame is binned differently or doesn't fit
+    """
+    if master.shape == shape: return master
+    if hdr.get('CCDSUM', '1 1').split() != ['1', '1'] or 'DETSEC' not in hdr: return None
+    x, y = hdr['DETSEC'].strip('[]').split(',')
+    x1, x2 = (int(v) for v in x.split(':'))
+    y1, y2 = (int(v) for v in y.split(':'))
+    section = master[y1-1:y2, x1-1:x2]
+    return section if section.shape == shape else None
+
+
+def thumbnail(image, size=256):
+    """ image block-averaged down so its longest side is at most size pixels """
+    factor = max(1, -(-max(image.shape)//size))
+    ny, nx = image.shape[0]//factor, image.shape[1]//factor
+    return image[:ny*factor, :nx*factor].reshape(ny, factor, nx, factor).mean(axis=(1, 3), dtype=np.float32)
+
+
+def reduce_frame(filename, output_dir=None, write_reduced=True, thumbnail_size=256, overwrite=True,
+                 stats_kwargs=None):
+    """
+    Calibrate, measure, and write the quick look of one frame; runs in a worker process
+
+    Returns a dictionary with the stats (see imstats.measure, without the
+    sources), the masters applied, and the reduced and thumbnail filenames
+    """
+    t0 = time.perf_counter()
+    filename = Path(filename)
+    with fits.open(filename) as hdulist:
+        hdu = hdulist[1] if isinstance(hdulist[-1], fits.CompImageHDU) else hdulist[0]
+        hdr = hdu.header.copy()
+        image = hdu.data.astype(np.float32)
+
+    applied = []
+    for name in ('bias', 'dark', 'flat'):
+        if name not in _masters: continue
+        master = _section(_masters[name], image.shape, hdr)
+        if master is None: continue
+        if name == 'bias':
+            image -= master
+        elif name == 'dark':
+            image -= master*np.float32(hdr.get('EXPTIME', 0.0))
+        else:
+            np.divide(image, master, out=image, where=master > 0)
+        applied.append(name)
+
+    stats = imstats.measure(image, **({} if stats_kwargs is None else stats_kwargs))
+    stats.pop('sources')
+
+    output_dir = filename.parent if output_dir is None else Path(output_dir)
+    stem = filename.name[:-len('.fits')] if filename.name.endswith('.fits') else filename.stem
+    result = {'filename': str(filename), 'reduced': None, 'thumbnail': None, 'applied': applied}
+
+    hdr['QLCALIB'] = (','.join(applied) if applied else 'none', 'Quick-look masters applied')
+    imstats.add_header_keys(hdr, stats)
+    for key in ('BZERO', 'BSCALE'):
+        if key in hdr: del hdr[key]
+    if write_reduced:
+        result['reduced'] = str(output_dir / (stem + '.ql.fits'))
+        fits.PrimaryHDU(image, header=hdr).writeto(result['reduced'], overwrite=overwrite)
+    if thumbnail_size:
+        result['thumbnail'] = str(output_dir / (stem + '.thumb.fits'))
+        fits.PrimaryHDU(thumbnail(image, thumbnail_size), header=hdr).writeto(result['thumbnail'], overwrite=overwrite)
+
+    stats['elapsed'] = time.perf_counter() - t0
+    result.update(stats)
+    return result
+
+
+class QuickLook:
+    """
+    Parameters
+    ----------
+    bias, dark, flat : str
+        Master frames (see calibration.py); any can be None. The dark is in ADU/s.
+    output_dir : str
+        Where the reduced frames and thumbnails go (default: next to the frame).
+    nworkers : int
+        Worker processes.
+    maxpending : int
+        Frames in flight (queued or being reduced) before new ones are skipped
+        (default: 2 per worker).
+    write_reduced : bool
+        Write the calibrated frame as <name>.ql.fits.
+    thumbnail_size : int
+        Write a block-averaged <name>.thumb.fits at most this big (0 for none).
+    cache_dir : str
+        Where the memory-mappable copies of the masters go (default: next to them).
+    the rest are passed to imstats.measure
+    """
+
+    def __init__(self, bias=None, dark=None, flat=None, output_dir=None, nworkers=1, maxpending=None,
+                 write_reduced=True, thumbnail_size=256, cache_dir=None, **stats_kwargs):
+        self.logger = logging.getLogger()
+        self.output_dir = None if output_dir is None else Path(output_dir)
+        if self.output_dir is not None:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.nworkers = max(int(nworkers), 1)
+        self.maxpending = 2*self.nworkers if maxpending is None else max(int(maxpending), 1)
+        self.write_reduced = write_reduced
+        self.thumbnail_size = thumbnail_size
+        self.stats_kwargs = stats_kwargs
+        self.callbacks = []
+
+        masters = {}
+        for name, filename in (('bias', bias), ('dark', dark), ('flat', flat)):
+            masters[name] = None if filename is None else str(cache_master(filename, cache_dir))
+        self.masters = masters
+
+        self.latest = None
+        self.nreduced = 0
+        self.nskipped = 0
+        self.nfailed = 0
+
+        self._pending = 0
+        self._lock = threading.Lock()
+        # the camera has threads running, which fork doesn't copy safely
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self._pool = ProcessPoolExecutor(max_workers=self.nworkers, mp_context=context,
+                                         initializer=_init_worker, initargs=(masters,))
+        self._closed = False
+
+    def watch(self, writer):
+        """ reduce every frame writer (a fitswriter.FitsWriter) writes """
+        writer.listeners.append(self._written)
+
+    def unwatch(self, writer):
+        if self._written in writer.listeners:
+            writer.listeners.remove(self._written)
+
+    def _written(self, filename, header=None):
+        self.submit(filename)
+
+    def submit(self, filename, callback=None):
+        """
+        Reduce filename in the background; returns a future for the result (see reduce_frame)
+
+        Never blocks: if maxpending frames are already in flight, the frame is
+        skipped and None is returned
+        """
+        with self._lock:
+            if self._closed: return None
+            if self._pending >= self.maxpending:
+                self.nskipped += 1
+                self.logger.debug("Quick look is busy; skipping " + str(filename))
+                return None
+            self._pending += 1
+
+        future = self._pool.submit(reduce_frame, str(filename), output_dir=self.output_dir,
+                                   write_reduced=self.write_reduced, thumbnail_size=self.thumbnail_size,
+                                   stats_kwargs=self.stats_kwargs)
+        future.add_done_callback(lambda f: self._done(f, callback))
+        return future
+
+    def _done(self, future, callback):
+        with self._lock:
+            self._pending -= 1
+        if future.cancelled(): return
+        if future.exception() is not None:
+            self.nfailed += 1
+            self.logger.error("Quick look failed: " + str(future.exception()))
+            return
+
+        result = future.result()
+        self.latest = result
+        self.nreduced += 1
+        for cb in self.callbacks + ([callback] if callback is not None else []):
+            try:
+                cb(result)
+            except Exception as e:
+                self.logger.exception("Error in quick look callback: " + str(e))
+
+    @property
+    def pending(self):
+        """ frames queued or being reduced """
+        return self._pending
+
+    def close(self, wait=True):
+        with self._lock:
+            self._closed = True
+        self._pool.shutdown(wait=wait)
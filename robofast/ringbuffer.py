@@ -0,0 +1,205 @@
+import logging
+import threading
+import time
+import numpy as np
+
+"""
+A fixed-size ring of preallocated frames for high-cadence (video) acquisition
+
+The frames live in one contiguous (nframes, ny, nx) array that is allocated
+once. The camera fills the next slot in place and commits it; when the ring
+is full the oldest frame is overwritten. The producer never waits for
+consumers, so a slow consumer loses frames (and counts them) rather than
+stalling acquisition.
+
+Consumers get views into the ring, not copies. A view stays valid until the
+producer comes back around to its slot, nframes-1 frames later; check with
+valid(seq) after using a frame if that matters, or copy it.
+"""
+
+
+class FrameRing:
+    """
+    Parameters
+    ----------
+    shape : tuple
+        (ny, nx) of each frame.
+    dtype : numpy dtype
+        Pixel type of each frame.
+    nframes : int
+        Number of frames in the ring (at least 2).
+    """
+
+    def __init__(self, shape, dtype=np.uint16, nframes=32):
+        self.logger = logging.getLogger()
+        if nframes < 2:
+            raise ValueError("A frame ring needs at least 2 frames")
+
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.nframes = int(nframes)
+
+        self.frames = np.empty((self.nframes,) + self.shape, dtype=self.dtype)
+        # sequence number (-1 = empty), timestamp, and whether anyone read each slot
+        self.seqs = np.full(self.nframes, -1, dtype=np.int64)
+        self.timestamps = np.zeros(self.nframes)
+        self._read = np.zeros(self.nframes, dtype=bool)
+
+        # the sequence number of the next frame to be written
+        self.head = 0
+        # frames committed, and frames overwritten before anyone read them
+        self.nwritten = 0
+        self.ndropped = 0
+
+        self._claimed = False
+        self._cond = threading.Condition()
+
+    def matches(self, shape, dtype):
+        return self.shape == tuple(int(n) for n in shape) and self.dtype == np.dtype(dtype)
+
+    ################## PRODUCER ##################
+    def claim(self):
+        """
+        The slot to fill with the next frame (the same one until it's committed)
+
+        The slot is taken out of circulation right away, so the frame that
+        was there is no longer valid
+        """
+        with self._cond:
+            slot = self.head % self.nframes
+            if not self._claimed:
+                self._claimed = True
+                if self.seqs[slot] >= 0 and not self._read[slot]:
+                    self.ndropped += 1
+                self.seqs[slot] = -1
+            return self.frames[slot]
+
+    def commit(self, frame=None, timestamp=None):
+        """
+        Publish the claimed slot as the newest frame
+
+        frame -- if given and it isn't the claimed slot, it's copied in
+        timestamp -- e.g., the exposure start (time.time()); defaults to now
+
+        Returns the frame's sequence number
+        """
+        slot_frame = self.claim()
+        if frame is not None and frame is not slot_frame:
+            np.copyto(slot_frame, frame, casting='unsafe')
+        if timestamp is None: timestamp = time.time()
+
+        with self._cond:
+            seq = self.head
+            slot = seq % self.nframes
+            self.seqs[slot] = seq
+            self.timestamps[slot] = timestamp
+            self._read[slot] = False
+            self.head += 1
+            self.nwritten += 1
+            self._claimed = False
+            self._cond.notify_all()
+        return seq
+
+    ################## CONSUMERS ##################
+    @property
+    def oldest(self):
+        """ sequence number of the oldest valid frame """
+        with self._cond:
+            return self._oldest()
+
+    def _oldest(self):
+        oldest = self.head - self.nframes + (1 if self._claimed else 0)
+        return max(oldest, 0)
+
+    def valid(self, seq):
+        """ True if frame seq is still in the ring (i.e., a view of it hasn't been overwritten) """
+        with self._cond:
+            return self._oldest() <= seq < self.head
+
+    def get(self, seq):
+        """ (frame, timestamp) for sequence number seq, or (None, None) if it isn't in the ring """
+        with self._cond:
+            if not self._oldest() <= seq < self.head:
+                return None, None
+            slot = seq % self.nframes
+            self._read[slot] = True
+            return self.frames[slot], self.timestamps[slot]
+
+    def latest(self, timeout=None, after=-1):
+        """
+        The newest frame as (frame, seq, timestamp)
+
+        after -- wait (up to timeout seconds) for a frame newer than this sequence number
+        Returns (None, None, None) if there isn't one
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.head-1 > after, timeout=timeout):
+                return None, None, None
+            seq = self.head - 1
+            slot = seq % self.nframes
+            self._read[slot] = True
+            return self.frames[slot], seq, self.timestamps[slot]
+
+    def window(self, n):
+        """
+        The newest n frames (fewer if the ring doesn't have them), oldest first
+
+        Returns (frames, seqs, timestamps). frames is one (n, ny, nx) view if
+        the frames are contiguous in the ring, otherwise a list of views
+        """
+        with self._cond:
+            first = max(self.head - int(n), self._oldest())
+            seqs = np.arange(first, self.head)
+            if len(seqs) == 0:
+                return [], seqs, np.zeros(0)
+            slots = seqs % self.nframes
+            self._read[slots] = True
+            timestamps = self.timestamps[slots]
+            if slots[-1] >= slots[0]:
+                return self.frames[slots[0]:slots[-1]+1], seqs, timestamps
+            return [self.frames[slot] for slot in slots], seqs, timestamps
+
+    def reader(self, start=None):
+        """ a cursor that returns every frame in order (see RingReader) """
+        return RingReader(self, start=start)
+
+
+class RingReader:
+    """
+    Reads every frame from a FrameRing in order, counting the ones it missed
+
+    start -- the first sequence number to read (default: the next new frame)
+    """
+
+    def __init__(self, ring, start=None):
+        self.ring = ring
+        self.cursor = ring.head if start is None else int(start)
+        self.nread = 0
+        self.dropped = 0
+
+    def next(self, timeout=None):
+        """
+        The next frame as (frame, seq, timestamp), or (None, None, None) after timeout seconds
+
+        If the ring has already overwritten the next frame, skip ahead to the
+        oldest one still there (and count the ones we lost in dropped)
+        """
+        ring = self.ring
+        with ring._cond:
+            if not ring._cond.wait_for(lambda: ring.head > self.cursor, timeout=timeout):
+                return None, None, None
+            oldest = ring._oldest()
+            if self.cursor < oldest:
+                self.dropped += oldest - self.cursor
+                self.cursor = oldest
+            seq = self.cursor
+            slot = seq % ring.nframes
+            ring._read[slot] = True
+            self.cursor += 1
+            self.nread += 1
+            return ring.frames[slot], seq, ring.timestamps[slot]
+
+    @property
+    def behind(self):
+        """ number of frames waiting to be read """
+        return self.ring.head - self.cursor
@@ -0,0 +1,342 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+"""
+Vectorized helpers for simulating star fields
+
+These are used by CameraBase.simulate_star_image (and anything else that needs
+fake images, like guiding and acquisition tests) so every star in a frame is
+placed in a single numpy pass instead of one python loop iteration per star.
+"""
+
+# convert a gaussian FWHM to sigma
+FWHM_TO_SIGMA = 1.0/(2.0*math.sqrt(2.0*math.log(2.0)))
+
+
+def gaussian_stamps(dx, dy, sigma, halfwidth):
+    """
+    Build normalized gaussian stamps for many stars at once
+
+    Parameters
+    ----------
+    dx, dy : array
+        Sub-pixel offset of each star from the center pixel of its stamp (pixels).
+    sigma : float
+        Gaussian sigma (pixels).
+    halfwidth : int
+        The stamps are (2*halfwidth+1) pixels on a side.
+
+    Returns
+    -------
+    stamps : array, shape (nstars, 2*halfwidth+1, 2*halfwidth+1)
+        Each stamp sums to 1 (before any truncation at the edge of the image).
+    """
+    k = np.arange(-halfwidth, halfwidth+1, dtype=np.float64)
+
+    # the gaussian is separable, so we only need two 1D profiles per star
+    gx = np.exp(-0.5*((k[None, :] - dx[:, None])/sigma)**2)
+    gy = np.exp(-0.5*((k[None, :] - dy[:, None])/sigma)**2)
+    gx /= gx.sum(axis=1, keepdims=True)
+    gy /= gy.sum(axis=1, keepdims=True)
+
+    return gy[:, :, None]*gx[:, None, :]
+
+
+class PSFStampCache:
+    """
+    A thread-safe LRU cache of normalized PSF stamps, bounded by memory
+
+    The fwhm and platescale almost never change during a run, so there is no
+    reason to rebuild the same stamps every frame.
+    """
+
+    def __init__(self, maxbytes=64*1024*1024):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._stamps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        """ return the stamp for key, calling build() to make it if it's not cached """
+        with self._lock:
+            stamp = self._stamps.get(key)
+            if stamp is not None:
+                self._stamps.move_to_end(key)
+                self.hits += 1
+                return stamp
+
+        stamp = build()
+        stamp.setflags(write=False)
+
+        with self._lock:
+            self.misses += 1
+            if key not in self._stamps:
+                self._stamps[key] = stamp
+                self.nbytes += stamp.nbytes
+            while self.nbytes > self.maxbytes and len(self._stamps) > 1:
+                oldkey, old = self._stamps.popitem(last=False)
+                self.nbytes -= old.nbytes
+        return stamp
+
+    def clear(self):
+        with self._lock:
+            self._stamps.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._stamps)
+
+
+# shared by all PSFs unless one is given explicitly
+stamp_cache = PSFStampCache()
+
+
+class PSF:
+    """
+    A point spread function that hands out cached, normalized stamps
+
+    Parameters
+    ----------
+    fwhm : float
+        FWHM of the PSF (arcsec).
+    platescale : float
+        Plate scale (arcsec/pixel).
+    profile : str
+        'gaussian' or 'moffat'.
+    beta : float
+        Moffat power index (ignored for gaussians).
+    oversample : int
+        Number of sub-pixel phases per pixel. Centroids are quantized to
+        1/oversample pixels, so this sets both the accuracy and the number of
+        stamps that are cached per PSF.
+    halfwidth : int
+        Half width of the stamp (pixels). By default, large enough to contain
+        everything brighter than ~1e-5 of the peak.
+    cache : PSFStampCache
+        Where to keep the stamps. Defaults to the module-level stamp_cache.
+    """
+
+    profiles = ('gaussian', 'moffat')
+
+    def __init__(self, fwhm, platescale, profile='gaussian', beta=4.765, oversample=16, halfwidth=None, cache=None):
+
+        if profile not in self.profiles:
+            raise ValueError("Unknown PSF profile (" + str(profile) + "); must be one of " + str(self.profiles))
+
+        self.fwhm = float(fwhm)
+        self.platescale = float(platescale)
+        self.profile = profile
+        self.beta = float(beta)
+        self.oversample = int(oversample)
+        self.cache = stamp_cache if cache is None else cache
+
+        fwhm_pix = self.fwhm/self.platescale
+        if profile == 'gaussian':
+            self.sigma = fwhm_pix*FWHM_TO_SIGMA
+            radius = 5.0*self.sigma
+        else:
+            self.alpha = fwhm_pix/(2.0*math.sqrt(2.0**(1.0/self.beta) - 1.0))
+            radius = self.alpha*math.sqrt(1e-5**(-1.0/self.beta) - 1.0)
+
+        if halfwidth is None:
+            halfwidth = int(math.ceil(radius))
+        self.halfwidth = int(halfwidth)
+
+    def _key(self, xphase, yphase):
+        return (self.profile, self.beta, self.fwhm, self.platescale,
+                self.halfwidth, self.oversample, xphase, yphase)
+
+    def _build(self, xphase, yphase):
+        # the center of each sub-pixel bin
+        dx = (xphase + 0.5)/self.oversample - 0.5
+        dy = (yphase + 0.5)/self.oversample - 0.5
+
+        k = np.arange(-self.halfwidth, self.halfwidth+1, dtype=np.float64)
+        r2 = (k[None, :] - dx)**2 + (k[:, None] - dy)**2
+
+        if self.profile == 'gaussian':
+            stamp = np.exp(-0.5*r2/self.sigma**2)
+        else:
+            stamp = (1.0 + r2/self.alpha**2)**(-self.beta)
+
+        return stamp/stamp.sum()
+
+    def quantize(self, offset):
+        """ sub-pixel offset(s) in [-0.5, 0.5) to phase index(es) """
+        phase = np.floor((np.asarray(offset) + 0.5)*self.oversample).astype(np.int64)
+        return np.clip(phase, 0, self.oversample-1)
+
+    def stamp(self, xphase, yphase):
+        """ the (read-only) normalized stamp for a single sub-pixel phase """
+        xphase = int(xphase)
+        yphase = int(yphase)
+        return self.cache.get(self._key(xphase, yphase), lambda: self._build(xphase, yphase))
+
+    def stamps(self, dx, dy):
+        """ stamps for many stars at once, given their sub-pixel offsets """
+        code = self.quantize(dy)*self.oversample + self.quantize(dx)
+        codes, inverse = np.unique(code, return_inverse=True)
+        bank = np.stack([self.stamp(c % self.oversample, c // self.oversample) for c in codes])
+        return bank[inverse.reshape(-1)]
+
+
+def render_stars(image, x, y, flux, psf, gain=1.0, halfwidth=None, rng=None, poisson=True, chunksize=4096):
+    """
+    Add stars to an image in place
+
+    Parameters
+    ----------
+    image : 2D float array
+        The image to add the stars to (ADU). Modified in place.
+    x, y : array
+        Centroids of the stars in array coordinates (0-indexed, sub-pixel allowed).
+    flux : array
+        Total flux of each star (e-).
+    psf : PSF or float
+        The PSF to use. A float is taken as the sigma (pixels) of an exact,
+        uncached gaussian.
+    gain : float
+        Gain (e-/ADU) used to convert the stars to ADU.
+    halfwidth : int
+        Half width of the stamp (pixels). Defaults to 5 sigma, or to the
+        halfwidth of the PSF.
+    rng : numpy.random.Generator
+        Random number generator for the Poisson noise.
+    poisson : bool
+        Add Poisson noise to the stars.
+    chunksize : int
+        Maximum number of stars rendered at once (bounds the temporary memory).
+
+    Returns
+    -------
+    nrendered : int
+        The number of stars that landed (at least partially) on the image.
+    """
+    x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+    y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+    flux = np.broadcast_to(np.asarray(flux, dtype=np.float64), x.shape)
+
+    if isinstance(psf, PSF):
+        halfwidth = psf.halfwidth
+    elif halfwidth is None:
+        halfwidth = int(math.ceil(5.0*psf))
+    if rng is None:
+        rng = np.random.default_rng()
+
+    if not image.flags.c_contiguous:
+        raise ValueError("image must be C-contiguous so it can be updated in place")
+
+    ywidth, xwidth = image.shape
+    k = np.arange(-halfwidth, halfwidth+1)
+
+    # nearest pixel to each centroid, and the sub-pixel offset from it
+    xc = np.floor(x + 0.5).astype(np.int64)
+    yc = np.floor(y + 0.5).astype(np.int64)
+
+    # skip stars whose stamps miss the image entirely
+    onimage = ((xc + halfwidth >= 0) & (xc - halfwidth < xwidth) &
+               (yc + halfwidth >= 0) & (yc - halfwidth < ywidth))
+    good = np.flatnonzero(onimage)
+
+    flat = image.reshape(-1)
+    for i0 in range(0, len(good), chunksize):
+        ndx = good[i0:i0+chunksize]
+
+        if isinstance(psf, PSF):
+            stamps = psf.stamps(x[ndx] - xc[ndx], y[ndx] - yc[ndx])
+        else:
+            stamps = gaussian_stamps(x[ndx] - xc[ndx], y[ndx] - yc[ndx], psf, halfwidth)
+        stamps *= flux[ndx, None, None]
+        if poisson:
+            stamps = rng.poisson(stamps).astype(np.float64)
+        if gain != 1.0:
+            stamps /= gain
+
+        # pixel coordinates of every stamp pixel, clipped at the edges of the image
+        ix = xc[ndx, None] + k[None, :]
+        iy = yc[ndx, None] + k[None, :]
+        inside = (((iy >= 0) & (iy < ywidth))[:, :, None] &
+                  ((ix >= 0) & (ix < xwidth))[:, None, :])
+        pixel = iy[:, :, None]*xwidth + ix[:, None, :]
+
+        # np.add.at accumulates correctly where stamps overlap
+        np.add.at(flat, pixel[inside], stamps[inside])
+
+    return len(good)
+
+
+class NoiseGenerator:
+    """
+    Fills frames with background + gaussian read noise in parallel
+
+    The frame is split into row chunks, each with its own independent
+    np.random.Generator stream (spawned from one SeedSequence), and the chunks
+    are filled in place by a thread pool. numpy releases the GIL while it fills
+    arrays, so this scales with the number of cores. The streams belong to the
+    chunks rather than the threads, so a given seed always gives the same
+    frames regardless of nthreads.
+
+    Parameters
+    ----------
+    seed : int
+        Seed for the random streams (None for fresh entropy).
+    nthreads : int
+        Number of worker threads. Defaults to the number of cores.
+    nchunks : int
+        Number of row chunks (and random streams) each frame is split into.
+    """
+
+    def __init__(self, seed=None, nthreads=None, nchunks=32):
+        if nthreads is None:
+            nthreads = os.cpu_count() or 1
+        self.nthreads = max(int(nthreads), 1)
+        self.nchunks = max(int(nchunks), 1)
+
+        self.seed(seed)
+
+        self._pool = None
+        if self.nthreads > 1:
+            self._pool = ThreadPoolExecutor(max_workers=self.nthreads, thread_name_prefix='noise')
+
+    def seed(self, seed=None):
+        """ restart the random streams from seed (None for fresh entropy), keeping the threads """
+        streams = np.random.SeedSequence(seed).spawn(self.nchunks)
+        self._rngs = [np.random.Generator(np.random.PCG64(s)) for s in streams]
+
+    def _fill_chunk(self, rng, chunk, background, noise):
+        rng.standard_normal(out=chunk, dtype=chunk.dtype)
+        chunk *= noise
+        chunk += background
+
+    def fill(self, out, background=0.0, noise=1.0):
+        """
+        Overwrite out (a float32 or float64 array) with background + N(0, noise), in place
+
+        Returns out
+        """
+        if out.dtype not in (np.float32, np.float64):
+            raise ValueError("Noise can only be generated in float32 or float64 (got " + str(out.dtype) + ")")
+        if not out.flags.c_contiguous:
+            raise ValueError("out must be C-contiguous so it can be filled in place")
+
+        chunks = [c for c in np.array_split(out.reshape(out.shape[0], -1), self.nchunks) if c.size > 0]
+        if self._pool is None:
+            for rng, chunk in zip(self._rngs, chunks):
+                self._fill_chunk(rng, chunk, background, noise)
+        else:
+            futures = [self._pool.submit(self._fill_chunk, rng, chunk, background, noise)
+                       for rng, chunk in zip(self._rngs, chunks)]
+            for future in futures:
+                future.result()
+        return out
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
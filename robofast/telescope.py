@@ -1,11 +1,10 @@
 import importlib
 import yaml
-from scipy.interpolate import Rbf
-from astropy.coordinates import SkyCoord, AltAz, ICRS, EarthLocation
-from astropy.time import Time
-from astropy import units as u
 import numpy as np
 
+# local imports
+from robofast import pointingmodel
+
 class TelescopeBase:
 
     def __init__(self, config):
@@ -21,21 +20,62 @@ class TelescopeBase:
 
         self.pointing_model_file = config["pointing_model"]
 
+        # 'rbf' interpolates the calibration points; 'parametric' fits the physical
+        # terms of the mount (pointing_terms; see pointingmodel.ParametricPointingModel).
+        # If pointing_model_in_mount is True, the parametric model is loaded into a mount
+        # that can apply it itself (Telescope_DFM) instead of being applied in software
+        self.pointing_model_type = config.get("pointing_model_type", "rbf")
+        self.mount_type = config.get("mount_type", "equatorial")
+        self.latitude = config.get("latitude", config.get("SITELAT"))
+        self.pointing_terms = config.get("pointing_terms")
+        self.pointing_model_in_mount = config.get("pointing_model_in_mount", False)
+
+        # the cameras and spectrographs on this telescope
+        self.instruments = config.get("instrument", [])
+
+        # a focusmodel.FocusPredictor, kept in focus_model (a CSV file); if set, the focus
+        # follows the altitude on every slew. Observatory shares it with the cameras on the
+        # telescope (see focusmodel.share_focus_model), so it learns from their autofocus runs
+        self.focus_model = None
+        if config.get("focus_model") is not None:
+            from robofast import focusmodel
+            self.focus_model = focusmodel.load_focus_model(config, move=self._move_focus)
+
+        # the site, for ICRS <-> AltAz (see transforms.AltAzTransform). With fast_transforms,
+        # the astrometry context is interpolated every transform_resolution seconds
+        self.longitude = config.get("longitude", config.get("SITELONG"))
+        self.elevation = config.get("elevation", config.get("SITEELEV", 0.0))
+        self.fast_transforms = config.get("fast_transforms", False)
+        self.transform_resolution = config.get("transform_resolution", 300.0)
+        self._transform = None
+
+    def _move_focus(self, position):
+        # looked up when it's used, since the hardware is set up after TelescopeBase
+        move = getattr(self, "move_focus_and_check", None)
+        if move is None: move = self.move_focus
+        return move(position)
+
     def initialize(self, pointing_model_file='config/pointing_model.yaml'):
         self.pointing_model = self.compute_pointing_model(self.pointing_model_file)
         self.header["P_MODEL"] = (pointing_model_file,'Pointing model file')
 
     def slew(self, ra_icrs, dec_icrs, epoch="J2000"):
+        from robofast import transforms
+
         # convert to alt/az
-        altaz = self.icrs_to_altaz(ra_icrs, dec_icrs)
+        obstime = transforms.to_time()
+        altaz = self.icrs_to_altaz(ra_icrs, dec_icrs, obstime)
 
         # feed it through the pointing model
-        telescope_altaz = self.pointing_model(altaz)
+        telescope_altaz = self.pointing_model(*altaz)
 
         # convert to ra/dec
-        telescope_icrs = self.altaz_to_icrs(telescope_altaz)
+        telescope_icrs = self.altaz_to_icrs(*telescope_altaz, obstime)
 
-        self.slew(telescope_icrs)
+        self._hal.slew(telescope_icrs[0]/15.0, telescope_icrs[1])
+
+        if self.focus_model is not None:
+            self.focus_model.set_altitude(altaz[0])
 
         # update the header with new information
         self.header["ALT"] = (altaz[0], "Commanded altitude [deg]")
@@ -52,78 +92,125 @@ class TelescopeBase:
         self.header["RA_TEL"] = (telescope_icrs[0], "RA without pointing model correction [deg]")
         self.header["DE_TEL"] = (telescope_icrs[1], "Dec without pointing model correction [deg]")
 
-    def icrs_to_altaz(ra_icrs, dec_icrs, obstime, location):
-        if not isinstance(obstime, Time):
-            obstime = Time(obstime)
+    @property
+    def transform(self):
+        """ the site's transforms.AltAzTransform, made on first use """
+        if self._transform is None:
+            # astropy takes most of a second to import, so only when it's needed
+            from robofast import transforms
+            if self.latitude is None or self.longitude is None:
+                raise ValueError("The site's latitude and longitude must be configured to convert coordinates")
+            self._transform = transforms.AltAzTransform(self.latitude, self.longitude, self.elevation,
+                                                        fast=self.fast_transforms,
+                                                        time_resolution=self.transform_resolution)
+        return self._transform
+
+    def icrs_to_altaz(self, ra_icrs, dec_icrs, obstime=None, fast=None):
+        """
+        Convert ICRS (RA, Dec) to (alt, az).
+
+        Parameters
+        ----------
+        ra_icrs, dec_icrs : float or array
+            RA and Dec (ICRS) in degrees.
+        obstime : str, astropy.time.Time, or array of either
+            Observation time(s) (default: now); broadcast against the
+            coordinates, so many targets at many times take one call
+            (e.g., ra_icrs[:, None] and obstime[None, :]).
+        fast : bool
+            Interpolate the precession/nutation/aberration (see transforms.py;
+            default: the fast_transforms config).
 
-        icrs = SkyCoord(ra=(ra_icrs * u.deg), dec=(dec_icrs * u.deg), frame="icrs")
-        altaz = icrs.transform_to(AltAz(obstime=obstime, location=location))
-        return altaz
+        Returns
+        -------
+        alt, az : float or array
+            Altitude and azimuth in degrees.
+        """
+        return self.transform.icrs_to_altaz(ra_icrs, dec_icrs, obstime, fast=fast)
 
-    def altaz_to_icrs(alt, az, obstime, location):
+    def altaz_to_icrs(self, alt, az, obstime=None, fast=None):
         """
         Convert AltAz coordinates to ICRS (RA, Dec).
 
         Parameters
         ----------
-        alt : float or Quantity
-            Altitude in degrees (or astropy Quantity with angle units).
-        az : float or Quantity
-            Azimuth in degrees (or astropy Quantity with angle units).
-        obstime : str or astropy.time.Time
-            Observation time (e.g., '2025-09-04 12:00:00').
-        location : astropy.coordinates.EarthLocation
-            Observer's location on Earth.
+        alt : float or array
+            Altitude in degrees.
+        az : float or array
+            Azimuth in degrees.
+        obstime : str, astropy.time.Time, or array of either
+            Observation time(s) (default: now; see icrs_to_altaz).
+        fast : bool
+            See icrs_to_altaz.
 
         Returns
         -------
-        icrs_coord : astropy.coordinates.SkyCoord
-            Sky coordinate in ICRS frame (RA, Dec).
+        ra, dec : float or array
+            RA and Dec (ICRS) in degrees.
         """
-        if not isinstance(obstime, Time):
-            obstime = Time(obstime)
-
-        altaz = SkyCoord(
-            alt=alt * u.deg,
-            az=az * u.deg,
-            frame=AltAz(obstime=obstime, location=location)
-        )
+        return self.transform.altaz_to_icrs(alt, az, obstime, fast=fast)
 
-        return altaz.icrs
-
-    def compute_pointing_model(self, pointing_file_name, function='thin_plate'):
+    def compute_pointing_model(self, pointing_file_name, function='thin_plate', neighbors=None, cache=True,
+                               model=None):
         """
         This computes the pointing model correction function given calibration points (generated by build_pointing_model)
-        """
-
-        alt_actual, az_actual, alt_telescope, az_telescope = np.loadtxt(pointing_file_name, unpack=True)
-
-        x = np.cos(alt_actual) * np.cos(az_actual)
-        y = np.cos(alt_actual) * np.sin(az_actual)
-        z = np.sin(alt_actual)
-
-        rbf_alt = Rbf(x, y, z, alt_telescope, function=function)
-        rbf_az  = Rbf(z, y, z, az_telescope, function=function)
-
-        def f(alt, az):
-            """Map an actual alt/az to telescope alt/az."""
 
-            x = np.cos(alt) * np.cos(az)
-            y = np.cos(alt) * np.sin(az)
-            z = np.sin(alt)
-
-            return float(rbf_alt(x,y,z)), float(rbf_az(x,y,z))
-
-        return f
-
-    def build_pointing_model(self, center_brightest=False):
+        The returned function maps actual alt/az (deg; scalars or arrays) to telescope alt/az.
+        model is 'rbf' or 'parametric' (default: pointing_model_type).
+        An rbf fit is cached next to the calibration file and only redone when the
+        file or kernel changes (see pointingmodel.RBFPointingModel). With neighbors
+        set, each position only uses that many of the nearest points.
+        """
+        if model is None: model = self.pointing_model_type
+        if model == 'parametric':
+            pointing_model = pointingmodel.ParametricPointingModel.from_file(pointing_file_name, mount=self.mount_type,
+                                                                             latitude=self.latitude,
+                                                                             terms=self.pointing_terms)
+            if self.pointing_model_in_mount and pointing_model.export(self):
+                # the mount applies it now, except for the index terms; don't apply the rest twice
+                index_model = pointing_model.index_model()
+                if index_model is None: return lambda alt, az: (alt, az)
+                return index_model
+            return pointing_model
+        if model != 'rbf':
+            raise ValueError("Unknown pointing model type (" + str(model) + "); must be rbf or parametric")
+        return pointingmodel.RBFPointingModel.from_file(pointing_file_name, function=function, neighbors=neighbors,
+                                                        cache=cache)
+
+    def build_pointing_model(self, measure, positions=None, pointing_file_name=None, model=None, npoints=100,
+                             min_alt=25.0, **kwargs):
         """
         This builds a pointing model using a pointing model software
 
-        If center_brightest is True, it slews to random bright stars, centers them, and uses their coordinates to compute the actual and observed coordinates. Otherwise, it will slew to a grid of RA/dec, platesolve, and use the center coordinates.
-        """
+        measure(alt, az) slews near alt, az and returns the actual and telescope
+        (alt_actual, az_actual, alt_telescope, az_telescope) in deg, or None if it
+        failed; e.g., it slews to a random bright star and centers it, or it slews
+        to a grid position, plate solves, and uses the center coordinates.
 
-        self.pointing_model = self.compute_pointing_model()
+        Points go to the positions (default: npoints spread evenly over the sky above
+        min_alt, see pointingmodel.sky_positions) until the model converges. Bad plate
+        solves are rejected as they come in (see pointingmodel.build for kwargs).
+        The accepted points are written to pointing_file_name (default: the configured
+        pointing_model file) and the model is used from then on.
+        """
+        if model is None: model = self.pointing_model_type
+        if model == 'parametric':
+            pointing_model = pointingmodel.ParametricPointingModel(mount=self.mount_type, latitude=self.latitude,
+                                                                   terms=self.pointing_terms)
+        elif model == 'rbf':
+            pointing_model = pointingmodel.RBFPointingModel(smoothing=kwargs.pop('smoothing', 0.0))
+        else:
+            raise ValueError("Unknown pointing model type (" + str(model) + "); must be rbf or parametric")
+        if positions is None:
+            positions = zip(*pointingmodel.sky_positions(npoints, min_alt=min_alt))
+
+        summary = pointingmodel.build(pointing_model, measure, positions, **kwargs)
+
+        if pointing_file_name is None: pointing_file_name = self.pointing_model_file
+        np.savetxt(pointing_file_name, np.transpose(pointingmodel.calibration_points(pointing_model)), fmt='%.6f',
+                   header='alt_actual az_actual alt_telescope az_telescope (deg)')
+        self.pointing_model = pointing_model
+        return summary
 
 
 def load_telescope(config_file):
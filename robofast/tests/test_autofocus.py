@@ -0,0 +1,79 @@
+from pathlib import Path
+import numpy as np
+import yaml
+
+# local imports
+from robofast import autofocus
+from robofast import camera
+from robofast import focusmodel
+from robofast.telescope import TelescopeBase
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_autofocus.py
+
+root_dir = Path(__file__).resolve().parent.parent
+config_file = root_dir / "config" / "camera_sim.yaml"
+
+# ----- Tests -----
+
+
+def test_focus_model():
+    rng = np.random.default_rng(3)
+    model = autofocus.FocusModel('hyperbola', fwhm_noise=0.05)
+    for p in (4800.0, 5000.0, 5200.0, 4900.0, 5100.0):
+        model.add(p, np.hypot(2.0, 0.02*(p - 5030.0)) + rng.normal(0, 0.05))
+    best, sigma = model.best
+    assert abs(best - 5030.0) < 3*sigma and sigma < 10.0
+    # more leverage comes from the slopes than the bottom
+    assert abs(model.next_position(np.linspace(4500, 5500, 101)) - best) > 100
+
+
+class FakeMount:
+    def __init__(self):
+        self.slews = []
+
+    def slew(self, ra, dec):
+        self.slews.append((ra, dec))
+
+
+def test_autofocus_sim(tmp_path):
+    # with a focus model, so the result is recorded in it
+    with open(config_file) as f:
+        config = yaml.safe_load(f)
+    config['focus_model'] = str(tmp_path / 'focus.csv')
+    with open(tmp_path / 'camera.yaml', 'w') as f:
+        yaml.safe_dump(config, f)
+
+    cam = camera.load_camera(tmp_path / 'camera.yaml')
+    try:
+        # the camera is on a telescope, which shares its focus model
+        tel = TelescopeBase({'pointing_model': None, 'latitude': 31.680407, 'longitude': -110.878977,
+                             'elevation': 2316.0})
+        tel._hal = FakeMount()
+        tel.pointing_model = lambda alt, az: (alt, az)
+        assert focusmodel.share_focus_model(cam, tel, ambient_temp=lambda: 10.0) is tel.focus_model
+        tel.slew(150.0, 30.0)
+
+        cam.set_roi(full_frame=True)
+        cam.set_bin(2)
+        cam.best_focus = 5137.0
+        af = autofocus.Autofocus(cam, cam.move_focus, guess=5000.0, step=150.0, min_position=4000.0,
+                                 max_position=6000.0, exptime=0.1, tolerance=10.0, max_exposures=12)
+        best, sigma = af.run()
+        assert best is not None
+        assert abs(best - 5137.0) < 30.0
+        assert cam.focus_position == best
+        assert len(af.history) < 12
+
+        record = tel.focus_model.records[-1]
+        assert record['position'] == best and record['ambient_temp'] == 10.0
+        assert record['altitude'] == tel.focus_model.altitude
+        assert (tmp_path / 'focus.csv').exists()
+
+        # the next slew moves the focuser to the new best focus
+        cam.move_focus(4000.0)
+        tel.slew(160.0, 35.0)
+        assert len(tel._hal.slews) == 2
+        assert np.isclose(cam.focus_position, best)
+    finally:
+        cam.shutdown()
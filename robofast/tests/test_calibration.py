@@ -0,0 +1,70 @@
+import numpy as np
+from astropy.io import fits
+
+# local imports
+from robofast import calibration
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_calibration.py
+
+# ----- Tests -----
+
+
+def write_frames(directory, n, level, noise, exptime=0.0, dtype=np.uint16, seed=5, shape=(40, 30), compressed=False):
+    rng = np.random.default_rng(seed)
+    filenames = []
+    for i in range(n):
+        data = level + rng.normal(0, noise, shape)
+        # a cosmic ray
+        data[i, 2*i] += 5000
+        filename = directory / ('frame' + str(i) + '.fits')
+        hdr = fits.Header()
+        hdr['EXPTIME'] = exptime
+        if compressed:
+            # as fitswriter.FitsWriter writes them
+            fits.HDUList([fits.PrimaryHDU(), fits.CompImageHDU(data.astype(dtype), header=hdr,
+                                                                compression_type='RICE_1')]).writeto(filename)
+        else:
+            fits.PrimaryHDU(data.astype(dtype), header=hdr).writeto(filename)
+        filenames.append(filename)
+    return filenames
+
+
+def test_bias_in_blocks(tmp_path):
+    filenames = write_frames(tmp_path, 15, 1000.0, 10.0)
+    # a tiny budget forces many blocks
+    master, noise, ncombine = calibration.master_bias(filenames, tmp_path / 'bias.fits', memory_budget=15*30*4*2*3,
+                                                      nworkers=2)
+    assert abs(np.median(master) - 1000.0) < 2.0
+    # the cosmic rays were clipped
+    assert master.max() < 1100 and ncombine.min() < 15
+    assert abs(np.median(noise) - 10.0) < 1.5
+
+    hdulist = fits.open(tmp_path / 'bias.fits')
+    assert hdulist['NOISE'].data.shape == (40, 30)
+    assert hdulist[0].header['NCOMBINE'] == 15
+
+
+def test_dark_and_flat(tmp_path):
+    (tmp_path / 'dark').mkdir()
+    (tmp_path / 'flat').mkdir()
+    bias = np.full((40, 30), 1000.0, dtype=np.float32)
+    darks = write_frames(tmp_path / 'dark', 5, 1100.0, 1.0, exptime=10.0)
+    dark, noise, n = calibration.master_dark(darks, tmp_path / 'dark.fits', bias=bias, method='mean')
+    assert abs(np.median(dark) - 10.0) < 0.5
+
+    flats = write_frames(tmp_path / 'flat', 5, 21100.0, 1.0, exptime=10.0, dtype=np.float32)
+    flat, noise, n = calibration.master_flat(flats, bias=bias, dark=tmp_path / 'dark.fits')
+    assert abs(np.median(flat) - 1.0) < 1e-6
+
+
+def test_compressed_uint16(tmp_path):
+    # unsigned 16 bit data is stored with BZERO = 32768, which must be applied to the tiles too
+    filenames = write_frames(tmp_path, 5, 40000.0, 10.0, compressed=True)
+    reader = calibration.FrameReader(filenames[0])
+    assert reader.compressed
+    assert abs(np.median(reader.sample()) - 40000.0) < 10.0
+    reader.close()
+
+    master, noise, ncombine = calibration.combine(filenames, memory_budget=5*30*4*8)
+    assert abs(np.median(master) - 40000.0) < 5.0
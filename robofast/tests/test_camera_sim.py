@@ -0,0 +1,250 @@
+from pathlib import Path
+import time
+import threading
+import numpy as np
+from astropy.io import fits
+
+# local imports
+from robofast import camera
+from robofast import fitswriter
+from robofast import imstats
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_camera_sim.py
+
+root_dir = Path(__file__).resolve().parent.parent
+config_file = root_dir / "config" / "camera_sim.yaml"
+
+# ----- Tests -----
+
+
+def test_expose_and_save(tmp_path):
+    c = camera.load_camera(config_file)
+    try:
+        c.initialize()
+        c.set_roi(101, 301, 51, 151)
+        c.expose(0.01)
+        assert c.save_image(tmp_path / 'sim.fits', wait=True)
+        data = fits.getdata(tmp_path / 'sim.fits')
+        hdr = fits.getheader(tmp_path / 'sim.fits')
+        assert data.shape == (100, 200)
+        assert hdr['DATASEC'] == '[101:300,51:150]'
+        assert hdr['SIMULATE']
+    finally:
+        c.shutdown()
+
+
+def test_header_follows_focus():
+    c = camera.load_camera(config_file)
+    try:
+        c.move_focus(c.best_focus + 300)
+        c.expose(0.0)
+        hdr = c.get_header_keys()
+        assert hdr['FOCPOS'] == c.best_focus + 300
+        c.read_image()
+    finally:
+        c.shutdown()
+
+
+def test_device_keywords_in_frames(tmp_path):
+    c = camera.load_camera(config_file)
+    try:
+        queries = []
+
+        def dome_keys(hdr):
+            # like Dome.add_header_keys
+            queries.append(time.monotonic())
+            hdr['AQTEMP1'] = (12.5, 'Enclosure temperature (C)')
+            return hdr
+
+        c.add_header_provider('dome 1', dome_keys, max_age=60.0)
+        for i in range(2):
+            c.expose(0.0)
+            assert c.save_image(tmp_path / ('sim' + str(i) + '.fits'), wait=True)
+            assert fits.getheader(tmp_path / ('sim' + str(i) + '.fits'))['AQTEMP1'] == 12.5
+        # the second frame reused the cached keywords
+        assert len(queries) == 1
+    finally:
+        c.shutdown()
+
+
+def test_binning_keeps_field():
+    c = camera.load_camera(config_file)
+    try:
+        c.set_roi(full_frame=True)
+        c.set_bin(2)
+        c.expose(0.0)
+        image = c.read_image()
+        assert image.shape == (1024, 1024)
+        assert c.platescale == 1.0
+    finally:
+        c.shutdown()
+
+
+def test_seeded_frames_reuse_noise_threads():
+    c = camera.load_camera(config_file)
+    try:
+        c.set_roi(1, 65, 1, 65)
+        frames = []
+        for i in range(2):
+            c.simulate_star_image([10.0], [20.0], [1e4], seed=7)
+            image = c.read_image()
+            frames.append(image.copy())
+            c.frame_pool.release(image)
+            if i == 0: noise = c._sim_noise
+        # reseeded, not rebuilt
+        assert c._sim_noise is noise
+        assert np.array_equal(frames[0], frames[1])
+    finally:
+        c.shutdown()
+
+
+def test_cool_and_wait():
+    c = camera.load_camera(config_file)
+    try:
+        c.cooling_rate = 100.0
+        settled = c.cool(temp=-10.0, oscillationTime=0.05, interval=0.01)
+        # doesn't block
+        assert not settled.done()
+        assert settled.result(timeout=5)
+        assert np.isclose(c.temperature, -10.0)
+        # waiting gives whether it settled
+        assert c.cool(wait=True, oscillationTime=0.05, interval=0.01) is True
+
+        # a camera without a cooler returns the same kinds of results
+        type(c).can_set_temperature = False
+        settled = c.cool()
+        assert settled.done() and settled.result() is False
+        assert c.cool(wait=True) is False
+    finally:
+        c.shutdown()
+
+
+def test_hardware_sequence(tmp_path):
+    c = camera.load_camera(config_file)
+    try:
+        c.set_roi(1, 257, 1, 257)
+        stats = c.sequence([(0.0, None, 5)], tmp_path)
+        c.writer.flush()
+        assert len(stats) == 5
+        assert all(fits.getdata(s['future'].result()).shape == (256, 256) for s in stats)
+    finally:
+        c.shutdown()
+
+
+def test_video():
+    c = camera.load_camera(config_file)
+    try:
+        c.set_roi(1, 65, 1, 33)
+        ring = c.start_video(0.002, nframes=4)
+        reader = ring.reader(start=0)
+        frames = [reader.next(timeout=5) for i in range(3)]
+        c.stop_video()
+        assert [seq for frame, seq, t in frames] == [0, 1, 2]
+        assert frames[0][0].shape == (32, 64)
+        # frames are views into the ring, not copies
+        assert np.shares_memory(frames[0][0], ring.frames)
+        image, seq, t = ring.latest()
+        assert seq == ring.head - 1
+        assert image.mean() > 0
+    finally:
+        c.shutdown()
+
+
+def test_coadd(tmp_path):
+    c = camera.load_camera(config_file)
+    try:
+        c.set_roi(1, 65, 1, 65)
+        stacker = c.start_coadd(0.002, tmp_path, nstack=3)
+        while stacker.nstacks < 2:
+            time.sleep(0.01)
+        c.stop_coadd()
+        assert c.coadder is None
+        # every frame taken is in a stack
+        assert stacker.nframes_total == c.video_ring.nwritten
+        c.writer.flush()
+        hdr = fits.getheader(tmp_path / 'stack.0001.fits')
+        assert hdr['NCOMBINE'] == 3
+    finally:
+        c.shutdown()
+
+
+def test_stats_in_header(tmp_path):
+    c = camera.load_camera(config_file)
+    try:
+        c.image_stats = imstats.ImageStats(halfwidth=6)
+        c.set_roi(full_frame=True)
+        c.set_bin(4)
+        c.expose(0.1)
+        assert c.save_image(tmp_path / 'sim.fits', wait=True)
+        hdr = fits.getheader(tmp_path / 'sim.fits')
+        assert hdr['NSTARS'] > 0
+        assert abs(hdr['FWHMARC'] - c.fwhm) < 0.5
+    finally:
+        c.shutdown()
+
+
+def test_slow_stats_keep_cadence(tmp_path):
+    c = camera.load_camera(config_file)
+    try:
+        c.writer.close()
+        c.writer = fitswriter.FitsWriter(nworkers=1, maxqueue=1)
+        c.image_stats = imstats.ImageStats(budget=0.05, halfwidth=6)
+        measure = c.image_stats.measure
+        finish = threading.Event()
+        def slow(image, **kwargs):
+            finish.wait(10.0)
+            return measure(image, **kwargs)
+        c.image_stats.measure = slow
+        c.set_roi(1, 129, 1, 129)
+
+        # frames are written without the stats they'd wait too long for, instead of holding up the camera
+        t0 = time.monotonic()
+        for i in range(8):
+            c.expose(0.0)
+            assert c.save_image(tmp_path / ('sim' + str(i) + '.fits'))
+        c.writer.flush()
+        assert time.monotonic() - t0 < 2.0
+        assert c.image_stats.nskipped == 8
+        assert 'NSTARS' not in fits.getheader(tmp_path / 'sim0.fits')
+
+        # a frame the writer won't take goes back to the pool
+        c.writer.close()
+        c.expose(0.0)
+        try:
+            c.save_image(tmp_path / 'closed.fits')
+        except RuntimeError:
+            pass
+        # and the one still being measured, once it's done
+        finish.set()
+        c.image_stats.close()
+        assert c.frame_pool.available == c.frame_pool.nframes
+    finally:
+        c.shutdown()
+
+
+def test_acquire_target(tmp_path):
+    c = camera.load_camera(config_file)
+    try:
+        c.star_x[0], c.star_y[0], c.star_flux[0] = 1000.3, 700.8, 1e7
+        result = c.acquire_target(0.01, sizes=(256, 64), start_bin=4)
+        assert [step['bin'] for step in result['steps']] == [4, 1, 1]
+        assert c.x2 - c.x1 == 64
+        assert abs(result['x'] - 1000.3) < 0.3 and abs(result['y'] - 700.8) < 0.3
+
+        # the header maps the ROI back to the detector
+        c.expose(0.0)
+        hdr = c.get_header_keys()
+        xd1, xd2, yd1, yd2 = c.detector_section()
+        assert hdr['DETSEC'] == '[' + str(xd1) + ':' + str(xd2) + ',' + str(yd1) + ':' + str(yd2) + ']'
+        assert xd1 + hdr['LTV1'] == 1
+        c.read_image()
+
+        # unbinned, DATASEC and DETSEC agree
+        c.set_roi(full_frame=True)
+        c.expose(0.0)
+        hdr = c.get_header_keys()
+        assert hdr['DATASEC'] == hdr['DETSEC'] == '[1:2048,1:2048]'
+        c.read_image()
+    finally:
+        c.shutdown()
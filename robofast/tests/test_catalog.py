@@ -0,0 +1,42 @@
+import numpy as np
+
+# local imports
+from robofast import catalog
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_catalog.py
+
+# ----- Tests -----
+
+
+def make_catalog(tmp_path, nstars=200000):
+    ra, dec, mag = catalog.synthetic_stars(nstars, seed=1)
+    cat = catalog.StarCatalog.build(tmp_path / 'tiles', ra, dec, mag, tilesize=2.0, source='synthetic')
+    return cat, ra, dec, mag
+
+
+def test_cone_matches_brute_force(tmp_path):
+    cat, ra, dec, mag = make_catalog(tmp_path)
+    # includes an RA wrap and a pole
+    for ra0, dec0, radius in ((10.0, 20.0, 3.0), (359.5, -5.0, 2.5), (123.0, 88.5, 4.0)):
+        stars = cat.cone(ra0, dec0, radius)
+        truth = catalog.angular_separation(ra0, dec0, ra, dec) <= radius
+        assert len(stars) == truth.sum()
+        assert np.all(np.diff(stars['mag']) >= 0)
+
+
+def test_box_and_maglimit(tmp_path):
+    cat, ra, dec, mag = make_catalog(tmp_path)
+    stars = cat.box(200.0, -30.0, 2.0, 1.0, maglimit=18.0)
+    xi, eta = catalog.project(stars['ra'], stars['dec'], 200.0, -30.0)
+    assert len(stars) > 0
+    assert np.all(np.abs(xi) <= 1.0) and np.all(np.abs(eta) <= 0.5)
+    assert np.all(stars['mag'] <= 18.0)
+
+
+def test_reload_from_disk(tmp_path):
+    cat, ra, dec, mag = make_catalog(tmp_path, nstars=10000)
+    reloaded = catalog.StarCatalog(tmp_path / 'tiles', cache_size=2)
+    assert reloaded.index['nstars'] == 10000
+    assert np.array_equal(reloaded.cone(45.0, 45.0, 5.0), cat.cone(45.0, 45.0, 5.0))
+    assert len(reloaded._tiles) <= 2
@@ -0,0 +1,54 @@
+import numpy as np
+
+# local imports
+from robofast import coadd
+from robofast import simulate
+from robofast import ringbuffer
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_coadd.py
+
+# ----- Tests -----
+
+
+def star_frame(x, y, shape=(64, 80), seed=0):
+    image = np.full(shape, 100.0, dtype=np.float32)
+    simulate.render_stars(image, [x, 20.0], [y, 45.0], [20000.0, 5000.0], 1.5, poisson=False)
+    image += np.random.default_rng(seed).normal(0, 1, shape).astype(np.float32)
+    return image
+
+
+def test_measure_shift():
+    for method in ('xcorr', 'centroid'):
+        stacker = coadd.ShiftAndAdd((64, 80), nstack=10, method=method)
+        stacker.add(star_frame(40.0, 30.0))
+        dx, dy = stacker.measure_shift(star_frame(43.0, 28.0, seed=1))
+        assert abs(dx - 3.0) < 0.3 and abs(dy + 2.0) < 0.3
+
+
+def test_stack_every_n():
+    stacks = []
+    stacker = coadd.ShiftAndAdd((64, 80), nstack=3, callback=stacks.append)
+    for i in range(7):
+        stacker.add(star_frame(40.0 + i, 30.0, seed=i), timestamp=float(i))
+    assert len(stacks) == 2 and stacker.nframes == 1
+    stack = stacks[1]
+    assert stack['nframes'] == 3 and stack['tstart'] == 3.0
+    # the stars line up with the reference
+    reference = star_frame(40.0, 30.0)
+    assert np.argmax(stack['image']) == np.argmax(reference)
+    assert stack['coverage'].min() == 0 and stack['coverage'].max() == 3
+    assert stacker.stop().get('nframes') == 1
+
+
+def test_stop_stacks_unread_frames():
+    stacks = []
+    ring = ringbuffer.FrameRing((64, 80), dtype=np.float32, nframes=8)
+    stacker = coadd.ShiftAndAdd((64, 80), nstack=10, callback=stacks.append)
+    stacker.follow(ring)
+    for i in range(5):
+        ring.commit(star_frame(40.0, 30.0, seed=i), timestamp=float(i))
+    # stopped right away, but every frame the ring took is in the last stack
+    stacker.stop(flush=True)
+    assert stacker.nframes_total == 5
+    assert len(stacks) == 1 and stacks[0]['nframes'] == 5
@@ -0,0 +1,77 @@
+import threading
+import numpy as np
+from astropy.io import fits
+
+# local imports
+from robofast import fitswriter
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_fitswriter.py
+
+# ----- Tests -----
+
+
+def test_background_write(tmp_path):
+    writer = fitswriter.FitsWriter(nworkers=2, maxqueue=2)
+    done = []
+    futures = []
+    for i in range(5):
+        data = np.full((64, 32), i, dtype=np.uint16)
+        futures.append(writer.submit(tmp_path / ('frame' + str(i) + '.fits'), data,
+                                     header={'EXPTIME': (1.0, 'Exposure time in seconds')},
+                                     callback=done.append))
+    writer.close()
+
+    assert len(done) == 5
+    assert writer.nwritten == 5 and writer.nfailed == 0
+    for i, future in enumerate(futures):
+        filename = future.result()
+        assert np.all(fits.getdata(filename) == i)
+        assert fits.getheader(filename)['EXPTIME'] == 1.0
+    assert not list(tmp_path.glob('*.part'))
+
+
+def test_failure_reported(tmp_path):
+    filename = tmp_path / 'exists.fits'
+    filename.write_text('')
+    writer = fitswriter.FitsWriter(nworkers=1)
+    future = writer.submit(filename, np.zeros((4, 4)))
+    assert isinstance(future.exception(timeout=10), OSError)
+
+    # a write that fails after the temporary file is made doesn't leave it behind
+    directory = tmp_path / 'directory.fits'
+    directory.mkdir()
+    future = writer.submit(directory, np.zeros((4, 4)), overwrite=True)
+    assert isinstance(future.exception(timeout=10), OSError)
+    assert not list(tmp_path.glob('*.part'))
+    writer.close()
+    assert writer.nfailed == 2
+
+
+def test_backpressure(tmp_path):
+    writer = fitswriter.FitsWriter(nworkers=1, maxqueue=1)
+    release = threading.Event()
+    original = writer._write
+    writer._write = lambda job: (release.wait(), original(job))
+
+    # one frame being written and one queued; the third can't get in
+    writer.submit(tmp_path / 'a.fits', np.zeros((4, 4)))
+    writer.submit(tmp_path / 'b.fits', np.zeros((4, 4)))
+    future = writer.submit(tmp_path / 'c.fits', np.zeros((4, 4)), timeout=0.2)
+    assert isinstance(future.exception(), TimeoutError)
+
+    release.set()
+    writer.close()
+    assert writer.nwritten == 2
+
+
+def test_rice_lossless_for_integers(tmp_path):
+    data = np.random.default_rng(1).poisson(300.0, size=(128, 96)).astype(np.uint16)
+    writer = fitswriter.FitsWriter(nworkers=1, compression='rice')
+    filename = writer.submit(tmp_path / 'frame.fits.fz', data.copy(), header={'EXPTIME': 1.0}).result()
+    writer.close()
+    with fits.open(filename) as hdul:
+        assert isinstance(hdul[1], fits.CompImageHDU)
+        assert np.array_equal(hdul[1].data, data)
+        assert hdul[1].header['EXPTIME'] == 1.0
+    assert writer.nbytes_written < writer.nbytes
@@ -0,0 +1,60 @@
+import numpy as np
+
+# local imports
+from robofast import focusmodel
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_focusmodel.py
+
+# ----- Tests -----
+
+
+def true_focus(temp, alt, filter):
+    return 5000.0 - 12.0*temp + 30.0*np.sin(np.radians(alt)) + {'V': 0.0, 'R': 25.0}[filter]
+
+
+def test_fit_and_persist(tmp_path):
+    rng = np.random.default_rng(4)
+    filename = tmp_path / 'focus.csv'
+    model = focusmodel.FocusPredictor(filename, terms=('tube_temp', 'altitude'), ridge=1e-4)
+    for i in range(30):
+        temp, alt, filter = rng.uniform(-5, 20), rng.uniform(30, 90), ('V', 'V', 'R')[i % 3]
+        model.record(true_focus(temp, alt, filter) + rng.normal(0, 2.0), fwhm=2.0 + 0.1*rng.random(),
+                     filter=filter, tube_temp=temp, altitude=alt)
+
+    assert abs(model.predict('R', tube_temp=8.0, altitude=50.0) - true_focus(8.0, 50.0, 'R')) < 5.0
+    assert model.rms < 4.0
+
+    # read back from the file
+    reloaded = focusmodel.FocusPredictor(filename, terms=('tube_temp', 'altitude'), ridge=1e-4)
+    assert reloaded.npoints == 30
+    assert np.isclose(reloaded.predict('V', tube_temp=0.0, altitude=60.0), model.predict('V', tube_temp=0.0, altitude=60.0))
+
+    assert not model.needs_autofocus(2.2, 'V')
+    model.filter = 'V'
+    assert model.check({'fwhm': 2.8}) and model.autofocus_needed
+
+
+def test_hooks():
+    moves = []
+    model = focusmodel.FocusPredictor(terms=('tube_temp', 'altitude'), move=moves.append,
+                                      sources={'tube_temp': lambda: 10.0}, min_move=1.0)
+    for temp, alt, filter in ((0.0, 40.0, 'V'), (10.0, 60.0, 'V'), (20.0, 80.0, 'V'), (5.0, 50.0, 'R')):
+        model.record(true_focus(temp, alt, filter), filter=filter, tube_temp=temp, altitude=alt)
+    model.set_altitude(70.0)
+    model.set_filter('R')
+    assert len(moves) == 2 and moves[1] > moves[0]
+    # too small a change to bother
+    model.set_altitude(70.1)
+    assert len(moves) == 2
+
+
+def test_record_from_header():
+    model = focusmodel.FocusPredictor()
+    assert model.terms == ('ambient_temp', 'altitude')
+    record = model.record_from_header({'FOCPOS': 5010.0, 'FWHM': 2.1, 'FILTER': 'V', 'ALTITUDE': 55.0},
+                                      weather={'outsideTemp': 8.0})
+    assert record['position'] == 5010.0 and record['ambient_temp'] == 8.0 and record['tube_temp'] is None
+    # frames without a focus position (e.g., no telescope keywords) are skipped
+    assert model.record_from_header({'FWHM': 2.1}) is None
+    assert len(model.records) == 1
@@ -0,0 +1,46 @@
+import array
+import numpy as np
+
+# local imports
+from robofast import framepool
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_framepool.py
+
+# ----- Tests -----
+
+
+def test_decode_ascom_order():
+    # ASCOM's ImageArray is indexed [x][y]
+    truth = np.arange(12, dtype=np.uint16).reshape(3, 4)
+    nested = tuple(tuple(int(v) for v in column) for column in truth.T)
+    out = np.zeros((3, 4), dtype=np.uint16)
+    assert framepool.decode_image_array(nested, out) is out
+    assert np.array_equal(out, truth)
+
+    out[:] = 0
+    framepool.decode_image_array(truth.T.astype(np.int32), out)
+    assert np.array_equal(out, truth)
+
+    out[:] = 0
+    framepool.decode_image_array(array.array('i', truth.T.ravel()), out)
+    assert np.array_equal(out, truth)
+
+    out[:] = 0
+    framepool.decode_image_array(truth.tobytes(), out, transpose=False)
+    assert np.array_equal(out, truth)
+
+
+def test_pool_recycles():
+    pool = framepool.FramePool((8, 6), nframes=2)
+    a = pool.acquire()
+    b = pool.acquire()
+    c = pool.acquire()  # exhausted; allocates rather than stalling
+    assert pool.nallocated == 3
+    for frame in (a, b, c):
+        pool.release(frame)
+    assert pool.available == 2
+    recycled = pool.acquire()
+    assert any(recycled is frame for frame in (a, b, c))
+    pool.release(np.empty((4, 4), dtype=np.uint16))
+    assert pool.available == 1
@@ -0,0 +1,57 @@
+from pathlib import Path
+import time
+import numpy as np
+
+# local imports
+from robofast import camera
+from robofast import guider
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_guider.py
+
+root_dir = Path(__file__).resolve().parent.parent
+config_file = root_dir / "config" / "camera_sim.yaml"
+
+# ----- Tests -----
+
+
+def test_pid_law():
+    law = guider.PIDLaw(kp=0.5, ki=1.0)
+    assert np.allclose(law.update((1.0, -2.0), 0.0), (0.5, -1.0))
+    # the integral keeps growing with a steady error
+    assert np.allclose(law.update((1.0, -2.0), 1.0), (1.5, -3.0))
+
+
+def test_guide_loop():
+    cam = camera.load_camera(config_file)
+    try:
+        cam.set_roi(full_frame=True)
+        cam.set_bin(4)
+
+        # the simulated mount: moving the telescope moves the stars the other way
+        def send_correction(east, north):
+            time.sleep(0.01)
+            cam.xoffset += east/cam.unbinned_platescale
+            cam.yoffset -= north/cam.unbinned_platescale
+
+        g = guider.load_guider(root_dir / "config" / "guider_sim.yaml", cam, send_correction)
+        g.exptime = 0.01
+        assert g.step()['status'] == 'reference'
+
+        # the star drifts 1.5 binned pixels in x (3" west)
+        cam.xoffset += 6.0
+        record = g.step()
+        assert np.isclose(record['dx'], 1.5, atol=0.2)
+        assert record['error'][0] < -2.5
+        assert record['status'] == 'sent'
+
+        for i in range(10):
+            record = g.step()
+        assert abs(cam.xoffset) < 1.0
+        g.close()
+
+        latency = g.latency()
+        assert latency['ack'][0] >= 0.01
+        assert latency['total'][0] > latency['ack'][0]
+    finally:
+        cam.shutdown()
@@ -0,0 +1,71 @@
+import time
+
+# local imports
+from robofast import header
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_header.py
+
+# ----- Tests -----
+
+
+class FakeDevice:
+    """ counts how often it's queried, and takes delay seconds to answer """
+
+    def __init__(self, keyword, delay=0.0):
+        self.keyword = keyword
+        self.delay = delay
+        self.calls = 0
+
+    def add_header_keys(self, hdr):
+        self.calls += 1
+        time.sleep(self.delay)
+        hdr[self.keyword] = (self.calls, 'number of queries')
+        hdr['SLOWKEY'] = (self.calls, 'number of queries')
+        # like Telescope_DFM.add_header_keys, return nothing
+
+
+def test_concurrent_and_cached():
+    snapshot = header.HeaderSnapshot(timeout=5.0)
+    devices = [FakeDevice('DEV' + str(i), delay=0.2) for i in range(4)]
+    for device in devices:
+        snapshot.add_provider(device.keyword, device.add_header_keys, max_age=60.0)
+
+    t0 = time.monotonic()
+    hdr = snapshot.snapshot()
+    # queried at the same time, not one after the other
+    assert time.monotonic() - t0 < 0.6
+    assert all(hdr[d.keyword] == 1 for d in devices)
+
+    # cached the second time
+    hdr = snapshot.snapshot()
+    assert all(d.calls == 1 for d in devices)
+    snapshot.close()
+
+
+def test_per_keyword_age():
+    snapshot = header.HeaderSnapshot()
+    device = FakeDevice('FAST')
+    snapshot.add_provider('fast', device.add_header_keys, max_age=60.0, key_max_age={'FAST': 0.0})
+    snapshot.snapshot()
+    time.sleep(0.01)
+    hdr = snapshot.snapshot()
+    assert device.calls == 2 and hdr['FAST'] == 2
+    snapshot.close()
+
+
+def test_bounded_time():
+    snapshot = header.HeaderSnapshot(timeout=0.1)
+    device = FakeDevice('SLOW', delay=0.5)
+    provider = snapshot.add_provider('slow', device.add_header_keys)
+
+    t0 = time.monotonic()
+    hdr = snapshot.snapshot()
+    assert time.monotonic() - t0 < 0.3
+    assert 'SLOW' not in hdr
+
+    # the query kept going in the background; its answer is used next time
+    provider.future.result()
+    hdr = snapshot.snapshot(timeout=0.0)
+    assert hdr['SLOW'] == 1
+    snapshot.close()
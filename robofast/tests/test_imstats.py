@@ -0,0 +1,47 @@
+import numpy as np
+
+# local imports
+from robofast import imstats
+from robofast import simulate
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_imstats.py
+
+# ----- Tests -----
+
+
+def star_field(fwhm=3.0, nstars=30, shape=(200, 300), seed=2):
+    rng = np.random.default_rng(seed)
+    image = np.empty(shape, dtype=np.float32)
+    simulate.NoiseGenerator(seed=seed, nthreads=1).fill(image, background=500.0, noise=5.0)
+    x = 20 + 260*rng.random(nstars)
+    y = 20 + 160*rng.random(nstars)
+    simulate.render_stars(image, x, y, np.full(nstars, 2e4), fwhm*simulate.FWHM_TO_SIGMA, poisson=False)
+    return image, x, y
+
+
+def test_background():
+    image, x, y = star_field()
+    sky, rms = imstats.background(image)
+    assert abs(sky - 500.0) < 0.5
+    assert abs(rms - 5.0) < 0.3
+
+
+def test_measure():
+    image, x, y = star_field(nstars=30)
+    stats = imstats.measure(image, platescale=0.5, halfwidth=6)
+    # a few stars may have landed on top of each other
+    assert 27 <= stats['nstars'] <= 30
+    assert abs(stats['fwhm'] - 3.0) < 0.3
+    assert abs(stats['fwhm_arcsec'] - 1.5) < 0.15
+    assert stats['ellipticity'] < 0.1
+
+    hdr = imstats.add_header_keys({}, stats)
+    assert hdr['NSTARS'][0] == stats['nstars']
+
+
+def test_peaks_plateau():
+    image = np.zeros((5, 5))
+    image[2, 2] = image[2, 3] = 10.0
+    iy, ix = imstats.find_peaks(image, 1.0)
+    assert len(iy) == 1
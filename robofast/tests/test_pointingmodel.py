@@ -0,0 +1,210 @@
+import numpy as np
+import pytest
+
+# local imports
+from robofast import pointingmodel
+from robofast.telescope import TelescopeBase
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_pointingmodel.py
+
+# ----- Tests -----
+
+
+def true_offsets(alt, az):
+    dalt = 0.05*np.cos(np.radians(az)) + 0.01*np.sin(np.radians(alt))
+    daz = 0.02*np.sin(np.radians(2.0*az)) + 0.01/np.cos(np.radians(alt))
+    return dalt, daz
+
+
+def calibration_points(npoints, seed=1):
+    rng = np.random.default_rng(seed)
+    alt = rng.uniform(20.0, 85.0, npoints)
+    az = rng.uniform(0.0, 360.0, npoints)
+    dalt, daz = true_offsets(alt, az)
+    return alt, az, alt + dalt, (az + daz) % 360.0
+
+
+def test_interpolates_and_vectorizes():
+    alt, az, alt_tel, az_tel = calibration_points(150)
+    model = pointingmodel.RBFPointingModel().fit(alt, az, alt_tel, az_tel)
+
+    # exact at the calibration points, including across az = 0/360
+    a, z = model(alt, az)
+    assert np.allclose(a, alt_tel, atol=1e-9)
+    assert np.allclose(pointingmodel.wrap180(z - az_tel), 0.0, atol=1e-9)
+
+    # a grid in one call matches one position at a time
+    qalt, qaz = np.meshgrid(np.linspace(30, 80, 7), np.linspace(0, 350, 8))
+    a, z = model(qalt, qaz)
+    assert a.shape == qalt.shape
+    single = model(float(qalt[3, 2]), float(qaz[3, 2]))
+    assert isinstance(single[0], float)
+    assert np.allclose(single, (a[3, 2], z[3, 2]))
+
+    dalt, daz = true_offsets(qalt, qaz)
+    assert np.abs(a - qalt - dalt).max() < 0.01
+    assert np.abs(pointingmodel.wrap180(z - qaz - daz)).max() < 0.02
+
+
+def test_local_matches_global():
+    alt, az, alt_tel, az_tel = calibration_points(300)
+    full = pointingmodel.RBFPointingModel().fit(alt, az, alt_tel, az_tel)
+    local = pointingmodel.RBFPointingModel(neighbors=30).fit(alt, az, alt_tel, az_tel)
+    assert local.local and local.weights is None
+
+    a, z = local(alt, az)
+    assert np.allclose(a, alt_tel, atol=1e-9)
+
+    rng = np.random.default_rng(3)
+    qalt, qaz = rng.uniform(30, 80, 500), rng.uniform(0, 360, 500)
+    assert np.abs(local(qalt, qaz)[0] - full(qalt, qaz)[0]).max() < 0.005
+
+
+def test_cache(tmp_path):
+    filename = tmp_path / 'pointing.dat'
+    np.savetxt(filename, np.transpose(calibration_points(60)))
+    model = pointingmodel.RBFPointingModel.from_file(filename)
+    cache_file = tmp_path / 'pointing.dat.thin_plate.npz'
+    assert cache_file.exists()
+
+    cached = pointingmodel.RBFPointingModel.from_file(filename)
+    assert np.array_equal(cached.weights, model.weights)
+    assert np.allclose(cached(45.0, 123.0), model(45.0, 123.0))
+
+    # a changed file (or kernel) is refit
+    alt, az, alt_tel, az_tel = calibration_points(60)
+    np.savetxt(filename, np.transpose((alt, az, alt_tel + 0.1, az_tel)))
+    refit = pointingmodel.RBFPointingModel.from_file(filename)
+    assert not np.allclose(refit(45.0, 123.0), model(45.0, 123.0))
+    assert pointingmodel.RBFPointingModel.load(cache_file, key='stale') is None
+
+
+def test_parametric_recovers_terms():
+    rng = np.random.default_rng(4)
+    npoints = 20
+    alt = np.degrees(np.arcsin(rng.uniform(np.sin(np.radians(25.0)), 0.98, npoints)))
+    az = rng.uniform(0.0, 360.0, npoints)
+    for mount in ('equatorial', 'altaz'):
+        terms = pointingmodel.DEFAULT_TERMS[mount]
+        truth = pointingmodel.ParametricPointingModel(mount, latitude=31.68)
+        truth.coefficients = {term: rng.normal(0.0, 60.0) for term in terms}
+        truth._coeffs = np.array([truth.coefficients[term] for term in terms])
+        alt_tel, az_tel = truth(alt, az)
+
+        model = pointingmodel.ParametricPointingModel(mount, latitude=31.68).fit(alt, az, alt_tel, az_tel)
+        for term in terms:
+            assert abs(model.coefficients[term] - truth.coefficients[term]) < 0.01
+        assert model.rms < 0.01
+        qalt, qaz = rng.uniform(20, 85, 100), rng.uniform(0, 360, 100)
+        assert np.allclose(model(qalt, qaz), truth(qalt, qaz), atol=1e-6)
+        assert np.allclose(model(45.0, 30.0), truth(45.0, 30.0), atol=1e-6)
+
+
+def test_parametric_unfitted():
+    model = pointingmodel.ParametricPointingModel('altaz', terms=('IA', 'IE'))
+    with pytest.raises(ValueError):
+        model(45.0, 30.0)
+    with pytest.raises(ValueError):
+        model.offset(45.0, 30.0)
+
+    # fit, then drop below the points the terms need: the old fit goes too
+    rng = np.random.default_rng(6)
+    for alt, az in zip(rng.uniform(25, 85, 4), rng.uniform(0, 360, 4)):
+        model.add_point(alt, az, alt + 0.01, az)
+    assert model.coefficients is not None
+    model.remove_point([0, 1, 2])
+    assert model.coefficients is None and model._design_matrix is None
+    with pytest.raises(ValueError):
+        model(45.0, 30.0)
+
+
+def test_parametric_export(tmp_path):
+    class Mount(TelescopeBase):
+        can_set_pointing_coefficients = True
+
+        def change_pointing_coefficients(self, **coeffs):
+            self.coeffs = coeffs
+
+        def apply_mount_corrections(self, on):
+            self.on = on
+
+    rng = np.random.default_rng(5)
+    alt, az = rng.uniform(25, 85, 30), rng.uniform(0, 360, 30)
+    model = pointingmodel.ParametricPointingModel('equatorial', latitude=31.68, terms=('IH', 'ID', 'CH', 'ME', 'HCES',
+                                                                                       'HCEC'))
+    model.coefficients = {'IH': -380.0, 'ID': 0.0, 'CH': 30.0, 'ME': -20.0, 'HCES': 3.0, 'HCEC': 4.0}
+    model._coeffs = np.array(list(model.coefficients.values()))
+    filename = tmp_path / 'pointing.txt'
+    np.savetxt(filename, np.transpose((alt, az) + model(alt, az)))
+
+    mount = Mount({'pointing_model': filename, 'pointing_model_type': 'parametric', 'latitude': 31.68,
+                   'pointing_terms': model.terms, 'pointing_model_in_mount': True})
+    pointing = mount.compute_pointing_model(filename)
+    assert mount.on == 1
+    assert abs(mount.coeffs['collimation'] - 30.0) < 1e-6
+    assert abs(mount.coeffs['elevation_misalignment'] + 20.0) < 1e-6
+    assert abs(mount.coeffs['ha_encoder_eccentricity'] - 5.0) < 1e-6
+    assert mount.coeffs['fork_flexure'] == 0.0
+    # the index terms, which the mount doesn't take, are still applied in software
+    assert pointing.terms == ('IH', 'ID')
+    assert abs(pointing.coefficients['IH'] + 380.0) < 1e-3
+    assert not np.allclose(pointing(45.0, 30.0), (45.0, 30.0))
+
+    # a mount that can't (like Telescope_DFM, until the TCS command is implemented) keeps the whole model
+    assert not model.export(object())
+    Mount.can_set_pointing_coefficients = False
+    assert mount.compute_pointing_model(filename).terms == model.terms
+
+
+def brute_loo(make, alt, az, alt_tel, az_tel, i):
+    """ the on-sky residual (arcsec) of point i from a model fit to all the others """
+    others = np.arange(len(alt)) != i
+    model = make().fit(alt[others], az[others], alt_tel[others], az_tel[others])
+    if hasattr(model, 'terms'):
+        return np.hypot(*model.residuals(alt[i], az[i], alt_tel[i], az_tel[i]))
+    a, z = model(alt[i], az[i])
+    return 3600.0*np.hypot(alt_tel[i] - a, pointingmodel.wrap180(az_tel[i] - z)*np.cos(np.radians(alt[i])))
+
+
+def test_add_remove_and_loo():
+    alt, az, alt_tel, az_tel = calibration_points(40)
+    for make in (pointingmodel.RBFPointingModel,
+                 lambda: pointingmodel.ParametricPointingModel('equatorial', latitude=31.68)):
+        model = make().fit(alt[:30], az[:30], alt_tel[:30], az_tel[:30])
+        for i in range(30, 40):
+            model.add_point(alt[i], az[i], alt_tel[i], az_tel[i])
+        model.remove_point(5)
+
+        # the same as fitting from scratch
+        keep = np.arange(40) != 5
+        a, z, at, zt = alt[keep], az[keep], alt_tel[keep], az_tel[keep]
+        full = make().fit(a, z, at, zt)
+        qalt, qaz = np.linspace(30, 80, 20), np.linspace(0, 350, 20)
+        assert np.allclose(model(qalt, qaz), full(qalt, qaz), atol=1e-8)
+
+        loo = model.loo_residuals()
+        for i in (0, 17, 38):
+            assert abs(loo[i] - brute_loo(make, a, z, at, zt, i)) < 1e-4
+
+
+def test_build_rejects_outliers():
+    rng = np.random.default_rng(6)
+    bad = {7, 31}
+
+    def measure(alt, az):
+        measure.count += 1
+        if measure.count == 12: return None
+        dalt, daz = true_offsets(alt, az)
+        noise = rng.normal(0.0, 1.0/3600.0, 2)
+        if measure.count in bad:
+            noise[0] += 60.0/3600.0
+            measure.bad.append(alt)
+        return alt, az, alt + dalt + noise[0], az + daz + noise[1]/np.cos(np.radians(alt))
+    measure.count, measure.bad = 0, []
+
+    model = pointingmodel.RBFPointingModel()
+    summary = pointingmodel.build(model, measure, zip(*pointingmodel.sky_positions(150)))
+    assert summary['failed'] == 1
+    assert summary['converged'] and summary['npoints'] < 149
+    assert sorted(point[0] for point in summary['rejected']) == sorted(measure.bad)
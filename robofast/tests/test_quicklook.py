@@ -0,0 +1,95 @@
+from pathlib import Path
+import numpy as np
+import yaml
+from astropy.io import fits
+
+# local imports
+from robofast import camera
+from robofast import fitswriter
+from robofast import quicklook
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_quicklook.py
+
+# ----- Tests -----
+
+
+def make_masters(tmp_path, shape=(64, 96)):
+    bias = np.full(shape, 100.0, dtype=np.float32)
+    dark = np.full(shape, 2.0, dtype=np.float32)
+    flat = np.ones(shape, dtype=np.float32)
+    flat[:, shape[1]//2:] = 0.5
+    filenames = {}
+    for name, data in (('bias', bias), ('dark', dark), ('flat', flat)):
+        filenames[name] = tmp_path / ('master_' + name + '.fits')
+        fits.PrimaryHDU(data).writeto(filenames[name])
+    return filenames
+
+
+def test_reduce_written_frames(tmp_path):
+    masters = make_masters(tmp_path)
+    ql = quicklook.QuickLook(output_dir=tmp_path / 'ql', thumbnail_size=32, **masters)
+    results = []
+    ql.callbacks.append(results.append)
+
+    writer = fitswriter.FitsWriter(nworkers=1)
+    try:
+        ql.watch(writer)
+        # 100 (bias) + 2*10 (dark) + 300*flat
+        raw = np.full((64, 96), 420, dtype=np.uint16)
+        raw[:, 48:] = 270
+        writer.submit(tmp_path / 'frame.fits', raw, header={'EXPTIME': 10.0}).result()
+    finally:
+        writer.close()
+        ql.close()
+
+    assert ql.nreduced == 1 and ql.nfailed == 0
+    assert results[0]['applied'] == ['bias', 'dark', 'flat']
+    reduced = fits.getdata(results[0]['reduced'])
+    assert np.allclose(reduced, 300.0)
+    assert fits.getheader(results[0]['reduced'])['QLCALIB'] == 'bias,dark,flat'
+    assert fits.getdata(results[0]['thumbnail']).shape == (21, 32)
+    assert abs(results[0]['sky'] - 300.0) < 1e-3
+
+
+def test_subframe_and_skip(tmp_path):
+    masters = make_masters(tmp_path)
+    ql = quicklook.QuickLook(maxpending=1, write_reduced=False, thumbnail_size=0, bias=masters['bias'])
+    hdr = fits.Header()
+    hdr['CCDSUM'] = '1 1'
+    hdr['DETSEC'] = '[11:20,5:12]'
+    filename = tmp_path / 'sub.fits'
+    fits.PrimaryHDU(np.full((8, 10), 150, dtype=np.int32), header=hdr).writeto(filename)
+
+    try:
+        futures = [ql.submit(filename) for i in range(5)]
+        assert futures[0] is not None
+        # only one frame may be in flight, so the rest are skipped rather than queued
+        assert ql.nskipped == 4 and futures[1:] == [None]*4
+        result = futures[0].result(timeout=60)
+    finally:
+        ql.close()
+    assert result['applied'] == ['bias']
+    assert abs(result['sky'] - 50.0) < 1e-3
+
+
+def test_camera_shutdown(tmp_path):
+    with open(Path(__file__).resolve().parent.parent / 'config' / 'camera_sim.yaml') as f:
+        config = yaml.safe_load(f)
+    config.update(quicklook=True, quicklook_dir=str(tmp_path / 'ql'), quicklook_thumbnail=16)
+    config_file = tmp_path / 'camera.yaml'
+    config_file.write_text(yaml.safe_dump(config))
+
+    c = camera.load_camera(config_file)
+    try:
+        c.set_roi(1, 65, 1, 65)
+        c.expose(0.0)
+        assert c.save_image(tmp_path / 'frame.fits', wait=True)
+        processes = list(c.quicklook._pool._processes.values())
+
+        c.shutdown()
+        assert c.quicklook._written not in c.writer.listeners
+        assert all(not process.is_alive() for process in processes)
+        assert (tmp_path / 'ql' / 'frame.thumb.fits').exists()
+    finally:
+        c.shutdown()
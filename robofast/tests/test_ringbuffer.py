@@ -0,0 +1,50 @@
+import numpy as np
+
+# local imports
+from robofast import ringbuffer
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_ringbuffer.py
+
+# ----- Tests -----
+
+
+def fill(ring, n):
+    for i in range(n):
+        ring.claim()[:] = ring.head
+        ring.commit(timestamp=float(i))
+
+
+def test_overwrite_and_window():
+    ring = ringbuffer.FrameRing((2, 3), nframes=4)
+    fill(ring, 6)
+    assert ring.nwritten == 6
+    assert ring.ndropped == 2
+    assert ring.oldest == 2 and not ring.valid(1)
+
+    frame, seq, t = ring.latest()
+    assert seq == 5 and np.all(frame == 5) and t == 5.0
+
+    # wrapped around the end of the ring
+    frames, seqs, timestamps = ring.window(3)
+    assert list(seqs) == [3, 4, 5]
+    assert [f[0, 0] for f in frames] == [3, 4, 5]
+
+    # contiguous: one view
+    frames, seqs, timestamps = ring.window(2)
+    assert frames.shape == (2, 2, 3) and np.shares_memory(frames, ring.frames)
+
+
+def test_slow_reader_drops():
+    ring = ringbuffer.FrameRing((2, 2), nframes=3)
+    reader = ring.reader()
+    fill(ring, 5)
+    frame, seq, t = reader.next(timeout=0)
+    # frames 0 and 1 were overwritten before the reader got to them
+    assert seq == 2 and reader.dropped == 2
+    assert reader.behind == 2
+    # the producer never waits; claiming a slot invalidates the oldest frame
+    ring.claim()
+    assert not ring.valid(2)
+    assert reader.next(timeout=0)[1] == 3
+    assert ring.latest(timeout=0.01, after=4) == (None, None, None)
@@ -0,0 +1,33 @@
+from astropy.io import fits
+
+# local imports
+from robofast import camera
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_sequence.py
+
+# ----- Tests -----
+
+
+def test_simulated_sequence(tmp_path):
+    cam = camera.CameraBase({'writer_threads': 1})
+    cam.x1, cam.x2, cam.y1, cam.y2 = 1, 65, 1, 49
+    cam.gain = 1.0
+    cam.platescale = 0.5
+    simulate = {'x': [20.0], 'y': [30.0], 'flux': [1e5], 'noise': 1.0}
+
+    try:
+        stats = cam.sequence([(0.01, 'V', 2), (0.02, None, 1)], tmp_path, simulate=simulate)
+    finally:
+        cam.shutdown()
+
+    assert len(stats) == 3
+    assert all(s['overhead'] >= 0.0 for s in stats)
+    for s in stats:
+        filename = s['future'].result()
+        data = fits.getdata(filename)
+        assert data.shape == (48, 64)
+        assert fits.getheader(filename)['EXPTIME'] == s['exptime']
+    assert 'FILTER' not in fits.getheader(stats[2]['filename'])
+    # every buffer came back to the pool
+    assert cam.frame_pool.available == cam.frame_pool.nframes
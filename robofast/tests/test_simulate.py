@@ -0,0 +1,91 @@
+import numpy as np
+
+# local imports
+from robofast import simulate
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_simulate.py
+
+# ----- Tests -----
+
+
+def test_flux_conserved():
+    image = np.zeros((100, 100))
+    simulate.render_stars(image, [30.0, 60.0], [40.0, 70.0], [1000.0, 2000.0], 2.0, poisson=False)
+    assert np.isclose(image.sum(), 3000.0)
+
+
+def test_subpixel_centroid():
+    image = np.zeros((64, 64))
+    simulate.render_stars(image, [31.3], [20.75], [1e5], 2.0, poisson=False)
+    yy, xx = np.indices(image.shape)
+    assert np.isclose((image*xx).sum()/image.sum(), 31.3, atol=1e-3)
+    assert np.isclose((image*yy).sum()/image.sum(), 20.75, atol=1e-3)
+
+
+def test_edge_clipping():
+    image = np.zeros((50, 50))
+    nrendered = simulate.render_stars(image, [0.0, -100.0], [25.0, 25.0], [1000.0, 1000.0], 2.0, poisson=False)
+    # the first star is half on the image, the second misses entirely
+    assert nrendered == 1
+    assert 450.0 < image.sum() < 600.0
+
+
+def test_poisson_noise_reproducible():
+    image1 = np.zeros((50, 50))
+    image2 = np.zeros((50, 50))
+    simulate.render_stars(image1, [25.0], [25.0], [1e4], 2.0, rng=np.random.default_rng(1))
+    simulate.render_stars(image2, [25.0], [25.0], [1e4], 2.0, rng=np.random.default_rng(1))
+    assert np.array_equal(image1, image2)
+    assert np.all(image1 == np.round(image1))
+
+
+def test_psf_stamps_normalized_and_cached():
+    cache = simulate.PSFStampCache()
+    for profile in simulate.PSF.profiles:
+        psf = simulate.PSF(1.5, 0.3, profile=profile, cache=cache)
+        stamps = psf.stamps(np.array([0.1, 0.1, -0.4]), np.array([0.2, 0.2, 0.0]))
+        assert stamps.shape == (3, 2*psf.halfwidth+1, 2*psf.halfwidth+1)
+        assert np.allclose(stamps.sum(axis=(1, 2)), 1.0)
+        psf.stamps(np.array([-0.4]), np.array([0.0]))
+    # two distinct phases per profile were built, the next frame reused them
+    assert cache.misses == 4
+    assert cache.hits == 2
+
+
+def test_psf_cache_bounded():
+    psf = simulate.PSF(1.0, 0.3, cache=simulate.PSFStampCache(maxbytes=1))
+    psf.stamp(0, 0)
+    psf.stamp(1, 0)
+    assert len(psf.cache) == 1
+    assert psf.cache.nbytes == psf.stamp(1, 0).nbytes
+
+
+def test_psf_fwhm():
+    for profile in simulate.PSF.profiles:
+        psf = simulate.PSF(3.0, 1.0, profile=profile, oversample=1)
+        stamp = psf.stamp(0, 0)
+        c = psf.halfwidth
+        # half maximum is reached 1.5 pixels from the center
+        profile1d = stamp[c, :]
+        halfmax = np.interp(0.5*profile1d[c], profile1d[c:][::-1], np.arange(c, -1, -1))
+        assert np.isclose(halfmax, 1.5, atol=0.1)
+
+
+def test_noise_in_place_and_seedable():
+    frame1 = np.empty((200, 100), dtype=np.float32)
+    frame2 = np.empty((200, 100), dtype=np.float32)
+    noise1 = simulate.NoiseGenerator(seed=3, nthreads=1)
+    noise2 = simulate.NoiseGenerator(seed=3, nthreads=4)
+    assert noise1.fill(frame1, background=300.0, noise=10.0) is frame1
+    noise2.fill(frame2, background=300.0, noise=10.0)
+    # same seed, same frame, regardless of the number of threads
+    assert np.array_equal(frame1, frame2)
+    # and again after reseeding, with the same threads
+    pool = noise2._pool
+    noise2.seed(3)
+    assert np.array_equal(noise2.fill(np.empty_like(frame2), background=300.0, noise=10.0), frame1)
+    assert noise2._pool is pool
+    noise2.close()
+    assert abs(frame1.mean() - 300.0) < 1.0
+    assert abs(frame1.std() - 10.0) < 0.5
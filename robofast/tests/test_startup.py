@@ -0,0 +1,18 @@
+import pytest
+
+# local imports
+from robofast.benchmarks import bench_startup
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_startup.py
+
+# ----- Tests -----
+
+
+@pytest.mark.parametrize('module', bench_startup.DAEMON_MODULES)
+def test_daemon_imports_are_light(module):
+    # a daemon restarting after a crash has to get back to its loop quickly, so astropy,
+    # scipy and astroquery (most of a second each) may only be imported when first used;
+    # the import times themselves are in benchmarks/bench_startup.py
+    report = bench_startup.import_report(module)
+    assert report['heavy'] == []
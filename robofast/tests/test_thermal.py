@@ -0,0 +1,32 @@
+import math
+import time
+
+# local imports
+from robofast import thermal
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_thermal.py
+
+# ----- Tests -----
+
+
+def test_timeout():
+    monitor = thermal.CoolingMonitor(lambda: 0.0, -20.0, interval=0.01, window=0.05, timeout=0.1)
+    assert monitor.start().result(timeout=5) is False
+
+
+def test_oscillation_detected():
+    t0 = time.monotonic()
+    # swings 3 C either side of the setpoint with a 0.1 s period
+    monitor = thermal.CoolingMonitor(lambda: -20.0 + 3.0*math.sin(2*math.pi*(time.monotonic()-t0)/0.1),
+                                     -20.0, interval=0.005, window=0.2, timeout=0.5)
+    assert monitor.start().result(timeout=5) is False
+    assert monitor.oscillating
+    assert monitor.status()['std'] > 1.0
+
+
+def test_stop():
+    monitor = thermal.CoolingMonitor(lambda: 0.0, -20.0, interval=0.01)
+    settled = monitor.start()
+    monitor.stop()
+    assert settled.result(timeout=1) is False
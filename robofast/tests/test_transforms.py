@@ -0,0 +1,60 @@
+import numpy as np
+from astropy.coordinates import SkyCoord, AltAz
+from astropy.time import Time
+from astropy import units as u
+
+# local imports
+from robofast import transforms
+from robofast.telescope import TelescopeBase
+
+# to run the actual unit tests, from the robofast directory, type:
+# pytest tests/test_transforms.py
+
+# ----- Tests -----
+
+
+def targets(n, seed=1):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(0.0, 360.0, n), np.degrees(np.arcsin(rng.uniform(-0.5, 1.0, n)))
+
+
+def separation_mas(lon1, lat1, lon2, lat2):
+    return 3.6e6*SkyCoord(lon1*u.deg, lat1*u.deg).separation(SkyCoord(lon2*u.deg, lat2*u.deg)).deg
+
+
+def test_matches_astropy_and_broadcasts():
+    ra, dec = targets(50)
+    night = Time('2026-10-18T03:00:00') + np.linspace(0.0, 8.0, 30)*u.hour
+    telescope = TelescopeBase({'pointing_model': None, 'latitude': 31.680407, 'longitude': -110.878977,
+                               'elevation': 2316.0})
+
+    # every target at every time in one call
+    alt, az = telescope.icrs_to_altaz(ra[:, None], dec[:, None], night[None, :])
+    assert alt.shape == (50, 30)
+    reference = SkyCoord(ra=ra[:, None]*u.deg, dec=dec[:, None]*u.deg).transform_to(
+        AltAz(obstime=night[None, :], location=telescope.transform.location))
+    assert separation_mas(az, alt, reference.az.deg, reference.alt.deg).max() < 1e-3
+
+    # and back
+    r, d = telescope.altaz_to_icrs(alt, az, night[None, :])
+    assert separation_mas(r, d, ra[:, None], dec[:, None]).max() < 1e-3
+
+    # scalars give floats, and the context for a time is reused
+    single = telescope.icrs_to_altaz(float(ra[3]), float(dec[3]), night[7])
+    assert isinstance(single[0], float)
+    assert np.allclose(single, (alt[3, 7], az[3, 7]))
+    assert telescope.icrs_to_altaz(float(ra[3]), float(dec[3]), night[7]) == single
+    assert len(telescope.transform._cache) == 2
+    assert transforms.site_location(31.680407, -110.878977, 2316.0) is telescope.transform.location
+
+
+def test_fast_path_accuracy():
+    ra, dec = targets(200, seed=2)
+    times = Time('2026-10-18T03:00:00') + np.sort(np.random.default_rng(3).uniform(0.0, 10.0, 200))*u.hour
+    transform = transforms.AltAzTransform(31.680407, -110.878977, 2316.0, fast=True)
+    alt, az = transform.icrs_to_altaz(ra, dec, times)
+    exact_alt, exact_az = transform.icrs_to_altaz(ra, dec, times, fast=False)
+    # the bound in the module docstring, for the default 300 s
+    assert separation_mas(az, alt, exact_az, exact_alt).max() < 0.1
+    # one exact context per 300 s, however many times
+    assert len(transform._grid) <= 10*3600/300 + 2
@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+
+"""
+Watches the CCD temperature in the background while it cools
+
+Instead of blocking the camera thread until the CCD settles, a
+CoolingMonitor samples the temperature at a fixed rate and resolves its
+settled future (True once settled, False if it never does) so startup can
+cool the camera in parallel with opening the dome, homing the telescope, etc.
+Use settled.result(), settled.add_done_callback(...), or
+await asyncio.wrap_future(settled).
+"""
+
+
+class CoolingMonitor:
+    """
+    read_temperature -- function that returns the current CCD temperature (C)
+    setpoint -- the target temperature (C)
+    interval -- seconds between samples
+    window -- seconds the temperature must stay within maxdiff of the setpoint to be settled
+    maxdiff -- allowed deviation from the setpoint (C)
+    timeout -- seconds to wait for it to settle before giving up
+    """
+
+    def __init__(self, read_temperature, setpoint, interval=10.0, window=120.0, maxdiff=1.0, timeout=1200.0):
+        self.logger = logging.getLogger()
+        self.read_temperature = read_temperature
+        self.setpoint = float(setpoint)
+        self.interval = float(interval)
+        self.window = float(window)
+        self.maxdiff = float(maxdiff)
+        self.timeout = float(timeout)
+
+        self.settled = Future()
+        self.oscillating = False
+        self.samples = deque()
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.settled.set_running_or_notify_cancel()
+        self._t0 = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='coolingmonitor', daemon=True)
+        self._thread.start()
+        return self.settled
+
+    def stop(self):
+        """ stop sampling; an unresolved settled future is cancelled (resolves to False) """
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        if not self.settled.done():
+            self.settled.set_result(False)
+
+    def status(self):
+        """ summary of the samples in the window """
+        with self._lock:
+            t = np.array([s[0] for s in self.samples])
+            temp = np.array([s[1] for s in self.samples])
+        if len(temp) == 0:
+            return {'temperature': None, 'setpoint': self.setpoint, 'settled': self.settled.done() and self.settled.result(),
+                    'oscillating': self.oscillating}
+
+        # rate of change over the window (C/s)
+        slope = np.polyfit(t - t[0], temp, 1)[0] if len(temp) > 2 and t[-1] > t[0] else 0.0
+        return {'temperature': temp[-1],
+                'setpoint': self.setpoint,
+                'mean': temp.mean(),
+                'std': temp.std(),
+                'slope': slope,
+                'settled': self.settled.done() and self.settled.result(),
+                'oscillating': self.oscillating}
+
+    def _check(self, now):
+        """ the rolling window test. Returns True if settled """
+        with self._lock:
+            temp = np.array([s[1] for s in self.samples])
+            span = now - self._t0
+
+        diff = temp - self.setpoint
+
+        # crossing back and forth over the setpoint by more than maxdiff means the control loop is oscillating
+        big = diff[np.abs(diff) > self.maxdiff]
+        ncrossings = np.count_nonzero(np.diff(np.sign(big)) != 0)
+        oscillating = ncrossings >= 2
+        if oscillating and not self.oscillating:
+            self.logger.warning("CCD temperature is oscillating around the setpoint (" + str(self.setpoint) +
+                                "); range " + str(temp.min()) + " to " + str(temp.max()))
+        self.oscillating = oscillating
+
+        # every sample in a full window is within maxdiff of the setpoint
+        return span >= self.window and len(diff) > 0 and np.all(np.abs(diff) <= self.maxdiff)
+
+    def _run(self):
+        while True:
+            try:
+                temp = float(self.read_temperature())
+            except Exception as e:
+                self.logger.exception("Error reading the CCD temperature: " + str(e))
+                temp = None
+
+            now = time.monotonic()
+            if temp is not None:
+                with self._lock:
+                    self.samples.append((now, temp))
+                    while self.samples and self.samples[0][0] < now - self.window:
+                        self.samples.popleft()
+
+                if self._check(now):
+                    self.logger.info("CCD temperature settled at " + str(temp) + " (setpoint " + str(self.setpoint) +
+                                     ") after " + '{0:.1f}'.format(now - self._t0) + " seconds")
+                    self.settled.set_result(True)
+                    return
+
+            if now - self._t0 > self.timeout:
+                self.logger.error('The camera was unable to reach its setpoint (' + str(self.setpoint) +
+                                  ') in the elapsed time (' + '{0:.1f}'.format(now - self._t0) + ' seconds)')
+                self.settled.set_result(False)
+                return
+
+            if self._stop.wait(self.interval):
+                return
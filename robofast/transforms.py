@@ -0,0 +1,173 @@
+import functools
+import logging
+from collections import OrderedDict
+import numpy as np
+import erfa
+from astropy.coordinates import AltAz, EarthLocation
+from astropy.coordinates.erfa_astrom import ErfaAstrom
+from astropy.time import Time
+from astropy import units as u
+
+"""
+Fast ICRS <-> AltAz transforms for many targets and times
+
+Astropy's SkyCoord(...).transform_to(AltAz(...)) spends milliseconds per call
+setting up the frame and the astrometry context (precession-nutation,
+aberration, Earth rotation; erfa.apco) before the few microseconds of work on
+the coordinates themselves. AltAzTransform does the same calculation with the
+same ERFA routines, but
+
+- takes arrays of targets and times (broadcast against each other) in one call,
+- builds the EarthLocation once per site (site_location), and
+- caches the astrometry context for each time it has seen, so checking
+  thousands of targets at one time (or the same times again) costs one setup.
+
+With fast=True, the context is computed exactly only every time_resolution
+seconds (on a fixed grid, cached) and linearly interpolated in between; the
+Earth rotation angle, which moves 15"/s, is advanced exactly from the grid
+point instead. The interpolation error grows with the square of
+time_resolution (mostly the diurnal aberration and nutation): compared to
+astropy, it's under 0.1 mas at the default 300 s and under 5 mas at 3600 s
+(see benchmarks/bench_transforms.py), far below any mount's pointing. The
+exact path agrees with astropy to ~1e-7 mas.
+
+Stars are treated as infinitely distant (no parallax or proper motion), and
+the Sun's light deflection is ERFA's (which differs from astropy's within
+90" of the Sun).
+"""
+
+# Earth rotation angle rate (rad/day of UT1; IERS Conventions 2010, eq. 5.15)
+ERA_RATE = 2.0*np.pi*1.00273781191135448
+
+
+@functools.lru_cache(maxsize=None)
+def site_location(latitude, longitude, elevation=0.0):
+    """ The EarthLocation of a site at latitude (deg N), longitude (deg E), elevation (m), made once """
+    return EarthLocation.from_geodetic(longitude*u.deg, latitude*u.deg, elevation*u.m)
+
+
+def to_time(obstime=None):
+    """ obstime as an astropy Time (default: now); accepts anything Time does """
+    if obstime is None: return Time.now()
+    if isinstance(obstime, Time): return obstime
+    return Time(obstime)
+
+
+def _output(a, b):
+    if np.ndim(a) == 0:
+        return float(a), float(b)
+    return a, b
+
+
+class AltAzTransform:
+    """
+    Parameters
+    ----------
+    latitude, longitude : float
+        Site latitude (deg N) and longitude (deg E).
+    elevation : float
+        Site elevation (m).
+    pressure, temperature, relative_humidity, wavelength : float
+        For refraction: hPa, C, 0-1, and microns. No refraction with
+        pressure=0 (the default, like astropy's AltAz).
+    fast : bool
+        Interpolate the astrometry context (see the module docstring).
+    time_resolution : float
+        Seconds between the exact contexts the fast path interpolates.
+    cache_size : int
+        Contexts (one per distinct time, or time array, or grid point) kept.
+    """
+
+    def __init__(self, latitude, longitude, elevation=0.0, pressure=0.0, temperature=0.0, relative_humidity=0.0,
+                 wavelength=1.0, fast=False, time_resolution=300.0, cache_size=256):
+        self.logger = logging.getLogger()
+        self.location = site_location(float(latitude), float(longitude), float(elevation))
+        self.pressure = pressure
+        self.temperature = temperature
+        self.relative_humidity = relative_humidity
+        self.wavelength = wavelength
+        self.fast = fast
+        self.time_resolution = float(time_resolution)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._grid = {}
+
+    def frame(self, obstime=None):
+        """ the equivalent astropy AltAz frame """
+        return AltAz(obstime=to_time(obstime), location=self.location, pressure=self.pressure*u.hPa,
+                     temperature=self.temperature*u.deg_C, relative_humidity=self.relative_humidity,
+                     obswl=self.wavelength*u.micron)
+
+    def _remember(self, key, astrom):
+        self._cache[key] = astrom
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return astrom
+
+    def astrom(self, obstime=None, fast=None):
+        """ the ERFA astrometry context (erfa.apco) at obstime (any shape) """
+        obstime = to_time(obstime)
+        if self.fast if fast is None else fast:
+            return self._interpolated_astrom(obstime)
+
+        key = (obstime.scale, obstime.shape, np.asarray(obstime.jd1).tobytes(),
+               np.asarray(obstime.jd2).tobytes())
+        astrom = self._cache.get(key)
+        if astrom is not None:
+            self._cache.move_to_end(key)
+            return astrom
+        return self._remember(key, ErfaAstrom.apco(self.frame(obstime)))
+
+    def _interpolated_astrom(self, obstime):
+        if obstime.scale == 'utc':
+            # the same as obstime.tt, without astropy's overhead for a new Time
+            tt = erfa.taitt(*erfa.utctai(obstime.jd1, obstime.jd2))
+        else:
+            tt = (obstime.tt.jd1, obstime.tt.jd2)
+        step = self.time_resolution/86400.0
+        # days since J2000 (to ~0.1 us), in grid steps and the remainder
+        days = np.asarray((tt[0] - 2451545.0) + tt[1])
+        steps = np.floor(days/step).astype(np.int64)
+        remainder = days - steps*step
+
+        grid = np.unique(np.concatenate((np.ravel(steps), np.ravel(steps) + 1)))
+        missing = [i for i in grid if i not in self._grid]
+        if missing:
+            # usually a grid point or two per call, in one exact (vectorized) apco
+            grid_times = Time(2451545.0, np.array(missing)*step, format='jd', scale='tt')
+            for i, astrom in zip(missing, ErfaAstrom.apco(self.frame(grid_times))):
+                self._grid[i] = astrom
+        table = np.array([self._grid[i] for i in grid], dtype=erfa.dt_eraASTROM)
+        while len(self._grid) > self.cache_size:
+            self._grid.pop(next(iter(self._grid)))
+
+        # every field is a float64, so interpolate them all at once
+        index = np.searchsorted(grid, steps)
+        table = table.view(np.float64).reshape(len(grid), -1)
+        a0, a1 = table[index], table[index + 1]
+        w = (remainder/step)[..., None]
+        astrom = a0 + w*(a1 - a0)
+        # the Earth rotation angle is linear in UT1, which runs at the rate of TT to ~1e-8
+        eral = erfa.dt_eraASTROM.fields['eral'][1]//8
+        astrom[..., eral] = np.mod(a0[..., eral] + ERA_RATE*remainder, 2.0*np.pi)
+        return astrom.view(erfa.dt_eraASTROM)[..., 0]
+
+    def icrs_to_altaz(self, ra, dec, obstime=None, fast=None):
+        """
+        alt, az (deg) of ICRS ra, dec (deg) at obstime (default: now)
+
+        ra, dec and obstime can be scalars or arrays that broadcast against
+        each other (e.g., targets[:, None] and times[None, :]). Returns floats
+        for scalars.
+        """
+        astrom = self.astrom(obstime, fast=fast)
+        ri, di = erfa.atciqz(np.radians(ra), np.radians(dec), astrom)
+        az, zen, _, _, _ = erfa.atioq(ri, di, astrom)
+        return _output(90.0 - np.degrees(zen), np.degrees(az))
+
+    def altaz_to_icrs(self, alt, az, obstime=None, fast=None):
+        """ ICRS ra, dec (deg) of alt, az (deg) at obstime (default: now); see icrs_to_altaz """
+        astrom = self.astrom(obstime, fast=fast)
+        ri, di = erfa.atoiq('A', np.radians(az), np.radians(90.0 - np.asarray(alt, dtype=float)), astrom)
+        ra, dec = erfa.aticq(ri, di, astrom)
+        return _output(np.degrees(ra) % 360.0, np.degrees(dec))